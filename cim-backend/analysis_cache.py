@@ -0,0 +1,227 @@
+# cim-backend/analysis_cache.py
+
+import os
+import re
+import zlib
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import undefer
+
+import instrumentation
+import models
+from database import SessionLocal
+
+# --- Cache Configuration ---
+# Entries live in analysis_cache_entries, shared by every worker and kept across
+# restarts. They expire after the TTL; past the entry bound the least recently used
+# are deleted.
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# zlib level for the cached text, as in text_store.
+ANALYSIS_CACHE_COMPRESSION_LEVEL = 6
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# --- Content Hashing ---
+
+def hash_bytes(data: bytes) -> str:
+    """SHA-256 of the raw PDF bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file on disk, read in chunks so large PDFs are never fully in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_stream(stream, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a seekable file object (e.g. a spooled upload), leaving it rewound for the next reader."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace and case so re-exported copies of the same PDF hash alike."""
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+def hash_text(text: str) -> str:
+    """SHA-256 of the normalized extracted text, used when the file bytes differ."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+# --- Cache Entries ---
+
+@dataclass
+class CacheEntry:
+    file_hash: str
+    text_hash: Optional[str]
+    is_cim: bool
+    text: Optional[str] = None
+    analysis_data: Optional[Dict[str, Any]] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.text or "")
+
+def _entry(row: models.AnalysisCacheEntry) -> CacheEntry:
+    return CacheEntry(
+        file_hash=row.file_hash,
+        text_hash=row.text_hash,
+        is_cim=row.is_cim,
+        text=zlib.decompress(row.text).decode("utf-8") if row.text is not None else None,
+        analysis_data=row.analysis_data,
+    )
+
+class AnalysisCache:
+    """
+    Content-addressed cache of classification, extracted text and analysis results, stored
+    in Postgres so every worker shares it and it survives restarts. Entries are indexed by
+    the file hash and, as a fallback, by the hash of the normalized text. Each lookup and
+    write is its own short transaction, independent of the caller's session.
+
+    version identifies the prompts behind the results (set by services); entries written
+    under another version are ignored, so a prompt change never meets old results.
+    """
+
+    def __init__(self, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANALYSIS_CACHE_TTL_SECONDS, version: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+
+    def _cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+
+    def get(self, file_hash: Optional[str] = None, text_hash: Optional[str] = None) -> Optional[CacheEntry]:
+        """Looks an entry up by file hash or by normalized-text hash, counting hits and misses per key type."""
+        key = "file" if file_hash else "text"
+        entry = None
+        if file_hash or text_hash:
+            db = SessionLocal()
+            try:
+                query = db.query(models.AnalysisCacheEntry).options(undefer(models.AnalysisCacheEntry.text))
+                query = query.filter(models.AnalysisCacheEntry.created_at > self._cutoff(),
+                                     models.AnalysisCacheEntry.version == self.version)
+                if file_hash:
+                    query = query.filter(models.AnalysisCacheEntry.file_hash == file_hash)
+                else:
+                    query = query.filter(models.AnalysisCacheEntry.text_hash == text_hash)
+                row = query.order_by(models.AnalysisCacheEntry.last_used_at.desc()).first()
+                if row is not None:
+                    entry = _entry(row)
+                    hits = models.AnalysisCacheEntry.file_hits if file_hash else models.AnalysisCacheEntry.text_hits
+                    db.query(models.AnalysisCacheEntry).filter(models.AnalysisCacheEntry.file_hash == row.file_hash).update(
+                        {hits: hits + 1, models.AnalysisCacheEntry.last_used_at: func.now()}, synchronize_session=False
+                    )
+                    db.commit()
+            finally:
+                db.close()
+        instrumentation.ANALYSIS_CACHE_LOOKUPS.inc(key=key, result="miss" if entry is None else "hit")
+        return entry
+
+    def put(self, entry: CacheEntry, alias_file_hash: Optional[str] = None) -> None:
+        """Stores an entry, optionally registering a second file hash that resolves to the same result."""
+        text = zlib.compress(entry.text.encode("utf-8"), ANALYSIS_CACHE_COMPRESSION_LEVEL) if entry.text else None
+        values = [{
+            "file_hash": file_hash,
+            "text_hash": entry.text_hash,
+            "is_cim": entry.is_cim,
+            "version": self.version,
+            "chars": entry.size,
+            "text": text,
+            "analysis_data": entry.analysis_data,
+        } for file_hash in dict.fromkeys(filter(None, (entry.file_hash, alias_file_hash)))]
+        statement = insert(models.AnalysisCacheEntry).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[models.AnalysisCacheEntry.file_hash],
+            set_={**{name: statement.excluded[name] for name in values[0] if name != "file_hash"},
+                  "created_at": func.now(), "last_used_at": func.now()},
+        )
+        db = SessionLocal()
+        try:
+            db.execute(statement)
+            self._evict(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def invalidate(self, file_hash: str, text_hash: Optional[str] = None) -> None:
+        """Drops the entry for file_hash and, given text_hash, every copy of the same text."""
+        db = SessionLocal()
+        try:
+            condition = models.AnalysisCacheEntry.file_hash == file_hash
+            if text_hash:
+                condition = or_(condition, models.AnalysisCacheEntry.text_hash == text_hash)
+            db.query(models.AnalysisCacheEntry).filter(condition).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def clear(self) -> None:
+        db = SessionLocal()
+        try:
+            db.query(models.AnalysisCacheEntry).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Totals over the shared table. Misses and evictions happen in the workers and are on
+        their /metrics (cim_analysis_cache_lookups_total, cim_analysis_cache_evictions_total).
+        """
+        db = SessionLocal()
+        try:
+            entries, cim_entries, analyzed, chars, compressed, file_hits, text_hits = db.query(
+                func.count(),
+                func.count().filter(models.AnalysisCacheEntry.is_cim.is_(True)),
+                func.count(models.AnalysisCacheEntry.analysis_data),
+                func.coalesce(func.sum(models.AnalysisCacheEntry.chars), 0),
+                func.coalesce(func.sum(func.octet_length(models.AnalysisCacheEntry.text)), 0),
+                func.coalesce(func.sum(models.AnalysisCacheEntry.file_hits), 0),
+                func.coalesce(func.sum(models.AnalysisCacheEntry.text_hits), 0),
+            ).filter(models.AnalysisCacheEntry.created_at > self._cutoff(),
+                     models.AnalysisCacheEntry.version == self.version).one()
+        finally:
+            db.close()
+        return {
+            "entries": entries,
+            "cim_entries": cim_entries,
+            "analyzed_entries": analyzed,
+            "chars": int(chars),
+            "compressed_bytes": int(compressed),
+            "file_hits": int(file_hits),
+            "text_hits": int(text_hits),
+        }
+
+    def _evict(self, db) -> None:
+        """Deletes expired entries and the least recently used beyond max_entries. The caller commits."""
+        expired = (
+            db.query(models.AnalysisCacheEntry)
+            .filter(models.AnalysisCacheEntry.created_at <= self._cutoff())
+            .delete(synchronize_session=False)
+        )
+        surplus = (
+            db.query(models.AnalysisCacheEntry.file_hash)
+            .order_by(models.AnalysisCacheEntry.last_used_at.desc())
+            .offset(self.max_entries)
+        )
+        evicted = (
+            db.query(models.AnalysisCacheEntry)
+            .filter(models.AnalysisCacheEntry.file_hash.in_(surplus.scalar_subquery()))
+            .delete(synchronize_session=False)
+        )
+        if expired or evicted:
+            instrumentation.ANALYSIS_CACHE_EVICTIONS.inc(expired + evicted)
+
+# Shared instance used by the processing pipeline and GET /api/cache/stats.
+cache = AnalysisCache()
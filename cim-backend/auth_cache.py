@@ -0,0 +1,196 @@
+# cim-backend/auth_cache.py
+#
+# Fast path for Clerk session tokens. The JWKS is fetched once and cached (and
+# refetched when a token names a key id we have not seen, i.e. after rotation),
+# and verified claims are kept in an LRU keyed by a hash of the token until the
+# token's own exp. A repeat request from the same session is a dictionary lookup.
+#
+# Anything the fast path cannot decide (machine tokens, unknown key ids, JWKS unavailable) falls
+# back to clerk.authenticate_request in main.get_current_user.
+#
+# Point CLERK_JWKS_URL at a local JWKS (or pass fetch_jwks) to stand in for Clerk.
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import jwt
+
+# --- Auth Cache Configuration ---
+CLERK_API_URL = os.getenv("CLERK_API_URL", "https://api.clerk.com/v1").rstrip("/")
+CLERK_JWKS_URL = os.getenv("CLERK_JWKS_URL", f"{CLERK_API_URL}/jwks")
+CLERK_AUTHORIZED_PARTIES = [p.strip() for p in os.getenv("CLERK_AUTHORIZED_PARTIES", "").split(",") if p.strip()]
+AUTH_CACHE_MAX_TOKENS = int(os.getenv("AUTH_CACHE_MAX_TOKENS", "4096"))
+AUTH_JWKS_TTL_SECONDS = int(os.getenv("AUTH_JWKS_TTL_SECONDS", "3600"))
+# Unknown key ids trigger a refetch, but at most this often, so garbage tokens cannot hammer the JWKS endpoint.
+AUTH_JWKS_MIN_REFRESH_SECONDS = int(os.getenv("AUTH_JWKS_MIN_REFRESH_SECONDS", "30"))
+AUTH_CLOCK_SKEW_SECONDS = int(os.getenv("AUTH_CLOCK_SKEW_SECONDS", "5"))
+
+class TokenRejected(Exception):
+    """The token is definitely invalid (bad signature, expired, wrong party); no fallback needed."""
+
+def token_from_request(headers) -> Optional[str]:
+    """Bearer token from the Authorization header, else the __session cookie (same order as Clerk)."""
+    authorization = headers.get("authorization")
+    if authorization:
+        return authorization[7:].strip() if authorization.lower().startswith("bearer ") else authorization.strip()
+    cookie_header = headers.get("cookie")
+    if cookie_header:
+        for key, morsel in SimpleCookie(cookie_header).items():
+            if key.startswith("__session"):
+                return morsel.value
+    return None
+
+def fetch_clerk_jwks(url: str = CLERK_JWKS_URL) -> dict:
+    headers = {"Accept": "application/json"}
+    secret_key = os.getenv("CLERK_SECRET_KEY")
+    if secret_key and url.startswith(CLERK_API_URL):
+        headers["Authorization"] = f"Bearer {secret_key}"
+    response = httpx.get(url, headers=headers, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+# --- JWKS Cache ---
+
+class JWKSCache:
+    def __init__(self, fetch_jwks: Callable[[], dict] = fetch_clerk_jwks, ttl_seconds: int = AUTH_JWKS_TTL_SECONDS,
+                 min_refresh_seconds: int = AUTH_JWKS_MIN_REFRESH_SECONDS):
+        self.fetch_jwks = fetch_jwks
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def _refresh(self):
+        keys = {}
+        for data in self.fetch_jwks().get("keys", []):
+            try:
+                key = jwt.PyJWK(data)
+            except jwt.PyJWKError:
+                continue
+            keys[data.get("kid")] = key
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+
+    def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        """Signing key for kid, refetching when the set is stale or the kid is new (key rotation)."""
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            if not self._fetched_at or age > self.ttl_seconds:
+                self._refresh()
+            elif kid not in self._keys and age > self.min_refresh_seconds:
+                self._refresh()
+            return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = 0.0
+
+# --- Verified Token Cache ---
+
+class AuthCache:
+    def __init__(self, jwks: JWKSCache = None, max_tokens: int = AUTH_CACHE_MAX_TOKENS,
+                 authorized_parties: List[str] = None, leeway: int = AUTH_CLOCK_SKEW_SECONDS):
+        self.jwks = jwks or JWKSCache()
+        self.max_tokens = max_tokens
+        self.authorized_parties = CLERK_AUTHORIZED_PARTIES if authorized_parties is None else authorized_parties
+        self.leeway = leeway
+        self._claims: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        with self._lock:
+            claims = self._claims.get(key)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims["exp"] + self.leeway <= time.time():
+                del self._claims[key]
+                self.misses += 1
+                return None
+            self._claims.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def _store(self, key: str, claims: dict):
+        with self._lock:
+            self._claims[key] = claims
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.max_tokens:
+                self._claims.popitem(last=False)
+
+    def _decode(self, token: str) -> Optional[dict]:
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            return None # not a JWT (e.g. a machine token or API key); let Clerk decide
+        if header.get("alg") != "RS256":
+            return None
+        try:
+            key = self.jwks.get(header.get("kid"))
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Could not load Clerk JWKS, falling back to full verification: {e}")
+            return None
+        if key is None:
+            # Possibly a key rotated in since the last refetch, which may be rate-limited; Clerk decides.
+            return None
+        try:
+            claims = jwt.decode(token, key.key, algorithms=["RS256"], leeway=self.leeway,
+                                options={"require": ["exp", "sub"], "verify_aud": False, "verify_iss": False})
+        except jwt.InvalidTokenError as e:
+            raise TokenRejected(str(e))
+        if self.authorized_parties and claims.get("azp") not in self.authorized_parties:
+            raise TokenRejected("Token issued for an unauthorized party.")
+        return claims
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Verified claims for token, from the cache when possible. Raises TokenRejected for
+        invalid tokens and returns None when the caller should fall back to Clerk.
+        """
+        key = self._key(token)
+        claims = self._lookup(key)
+        if claims is not None:
+            return claims
+        claims = self._decode(token)
+        if claims is not None:
+            self._store(key, claims)
+        return claims
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._claims.pop(self._key(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = len(self._claims)
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "jwks_refreshes": self.jwks.refreshes,
+        }
+
+# Shared cache for the API process.
+auth_cache = AuthCache()
@@ -0,0 +1,182 @@
+# cim-backend/batch_upload.py
+#
+# Data-room uploads: several PDFs and/or ZIP archives in one request. An archive is
+# opened through its central directory on the spooled upload and every PDF entry is
+# decompressed straight into S3 staging as a stream, so the archive is never inflated
+# in memory or on disk. All deals of a batch land in one bulk INSERT together with
+# their jobs, and the jobs share a concurrency key so one data room cannot take over
+# the whole worker pool.
+
+import os
+import uuid
+import posixpath
+import zipfile
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import models
+import services
+import deal_events
+
+# --- Batch Limits ---
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+# Declared (uncompressed) size above which an archive entry is skipped; guards against zip bombs.
+BATCH_MAX_FILE_MB = int(os.getenv("BATCH_MAX_FILE_MB", "200"))
+# Files of one batch streamed to S3 staging at the same time.
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "4"))
+# Jobs of one batch the worker pool runs at the same time.
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "4"))
+
+_ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+
+@dataclass
+class BatchEntry:
+    file_name: str
+    open: Callable[[], BinaryIO]
+    owns_stream: bool = True # archive entries are closed after staging; uploads are closed by Starlette
+    staging_key: Optional[str] = None
+
+def _read_magic(stream: BinaryIO, size: int = 5) -> bytes:
+    head = stream.read(size)
+    stream.seek(0)
+    return head
+
+def _is_pdf_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bool:
+    # Only the first deflate block is decompressed to read the magic bytes.
+    with archive.open(info) as entry:
+        return entry.read(5) == b"%PDF-"
+
+def _archive_entries(archive: zipfile.ZipFile, archive_name: str, skipped: list) -> List[BatchEntry]:
+    entries = []
+    for info in archive.infolist():
+        path = info.filename.replace("\\", "/")
+        file_name = posixpath.basename(path)
+        # Folders and macOS/Windows metadata are not documents; drop them silently.
+        if info.is_dir() or path.startswith("__MACOSX/") or file_name.startswith(".") or not file_name:
+            continue
+        label = f"{archive_name}/{path}"
+        if info.file_size > BATCH_MAX_FILE_MB * 1024 * 1024:
+            skipped.append({"file_name": label, "reason": "too large"})
+            continue
+        try:
+            is_pdf = _is_pdf_entry(archive, info)
+        except (RuntimeError, NotImplementedError, zipfile.BadZipFile, OSError) as e:
+            # Encrypted entries, unsupported compression, corrupt data.
+            logging.warning(f"Cannot read {label} from archive: {e}")
+            skipped.append({"file_name": label, "reason": "unreadable"})
+            continue
+        if not is_pdf:
+            skipped.append({"file_name": label, "reason": "not a PDF"})
+            continue
+        entries.append(BatchEntry(file_name, lambda info=info: archive.open(info)))
+    return entries
+
+def collect_entries(uploads: list, archives: List[zipfile.ZipFile]) -> tuple:
+    """
+    Returns (PDF entries to stage, skipped files) for uploaded PDFs and ZIP archives. Opened
+    archives are appended to archives; the caller closes them once staging is done.
+    """
+    entries, skipped = [], []
+    for upload in uploads:
+        head = _read_magic(upload.file, 4)
+        if head in _ZIP_MAGIC:
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                skipped.append({"file_name": upload.filename, "reason": "unreadable archive"})
+                continue
+            archives.append(archive)
+            entries += _archive_entries(archive, upload.filename, skipped)
+        elif _read_magic(upload.file) == b"%PDF-":
+            entries.append(BatchEntry(upload.filename, lambda upload=upload: upload.file, owns_stream=False))
+        else:
+            skipped.append({"file_name": upload.filename, "reason": "not a PDF"})
+    if len(entries) > BATCH_MAX_FILES:
+        skipped += [{"file_name": entry.file_name, "reason": "batch limit"} for entry in entries[BATCH_MAX_FILES:]]
+        entries = entries[:BATCH_MAX_FILES]
+    return entries, skipped
+
+def _stage_entry(entry: BatchEntry) -> str:
+    stream = entry.open()
+    try:
+        return services.stage_upload(stream, entry.file_name)
+    finally:
+        if entry.owns_stream:
+            stream.close()
+
+async def stage_entries(entries: List[BatchEntry]) -> bool:
+    """Streams entries to S3 staging, a few at a time. Returns False if any upload failed."""
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+    async def stage(entry: BatchEntry) -> bool:
+        async with semaphore:
+            try:
+                entry.staging_key = await run_in_threadpool(_stage_entry, entry)
+                return True
+            except Exception as e:
+                logging.error(f"Could not stage batch file {entry.file_name}: {e}", exc_info=True)
+                return False
+
+    return all(await asyncio.gather(*(stage(entry) for entry in entries)))
+
+def discard_entries(entries: List[BatchEntry]):
+    for entry in entries:
+        services.discard_staged_upload(entry.staging_key)
+
+def create_batch(db: Session, user_id: str, user_name: str, entries: List[BatchEntry], skipped: list,
+                 screen: bool) -> models.UploadBatch:
+    """Creates the batch, bulk-inserts its deals and queues one job per deal, in a single commit."""
+    batch = models.UploadBatch(id=uuid.uuid4().hex, user_id=user_id, user_name=user_name,
+                               file_count=len(entries), skipped=skipped)
+    db.add(batch)
+    db.flush()
+    deal_ids = []
+    if entries:
+        rows = [{"user_id": user_id, "user_name": user_name, "file_name": entry.file_name,
+                 "status": "Analyzing", "batch_id": batch.id} for entry in entries]
+        deal_ids = db.scalars(
+            insert(models.Deal).returning(models.Deal.id, sort_by_parameter_order=True), rows
+        ).all()
+    deal_events.record_many(db, [
+        (deal_id, "Analyzing", {"file_name": entry.file_name, "user_id": user_id, "batch_id": batch.id})
+        for deal_id, entry in zip(deal_ids, entries)
+    ])
+    for deal_id, entry in zip(deal_ids, entries):
+        services.enqueue_pdf_processing(db, deal_id, entry.staging_key, entry.file_name, screen=screen,
+                                        concurrency_key=f"batch:{batch.id}",
+                                        concurrency_limit=BATCH_ANALYSIS_CONCURRENCY)
+    db.commit()
+    return batch
+
+def batch_progress(db: Session, batch: models.UploadBatch) -> dict:
+    """Aggregate status of a batch's deals. Deals screened out as non-CIMs are deleted, so they count as removed."""
+    rows = (
+        db.query(models.Deal.id, models.Deal.status)
+        .filter(models.Deal.batch_id == batch.id)
+        .order_by(models.Deal.id)
+        .all()
+    )
+    counts = {}
+    for _, deal_status in rows:
+        counts[deal_status] = counts.get(deal_status, 0) + 1
+    complete, failed = counts.get("Complete", 0), counts.get("Failed", 0)
+    removed = max(batch.file_count - len(rows), 0)
+    analyzing = len(rows) - complete - failed
+    return {
+        "batch_id": batch.id,
+        "status": "processing" if analyzing else "done",
+        "total": batch.file_count,
+        "analyzing": analyzing,
+        "complete": complete,
+        "failed": failed,
+        "removed": removed,
+        "deal_ids": [deal_id for deal_id, _ in rows],
+        "skipped": batch.skipped or [],
+        "created_at": batch.created_at,
+    }
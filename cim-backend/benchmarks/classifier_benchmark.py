@@ -0,0 +1,78 @@
+# cim-backend/benchmarks/classifier_benchmark.py
+#
+# Scores the labeled fixtures with the local CIM pre-classifier and reports
+# precision/recall of its confident decisions, the share of LLM screening
+# calls it avoids, and its per-document latency.
+#
+# Usage (from cim-backend/): python benchmarks/classifier_benchmark.py [fixtures.jsonl]
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cim_classifier
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "classifier_fixtures.jsonl")
+SCREEN_CHARS = 2000
+TIMING_ROUNDS = 200
+
+def load_fixtures(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def ratio(numerator: int, denominator: int) -> float:
+    return round(numerator / denominator, 4) if denominator else 0.0
+
+def run(path: str) -> dict:
+    fixtures = load_fixtures(path)
+    tp = fp = tn = fn = ambiguous = 0
+    rows = []
+    for fixture in fixtures:
+        result = cim_classifier.score_text(fixture["text"][:SCREEN_CHARS])
+        label = fixture["is_cim"]
+        if result.decision == "ambiguous":
+            ambiguous += 1
+        elif result.decision == "cim":
+            tp, fp = (tp + 1, fp) if label else (tp, fp + 1)
+        else:
+            fn, tn = (fn + 1, tn) if label else (fn, tn + 1)
+        rows.append((fixture["name"], label, result.decision, result.score))
+
+    # Time the scorer alone, as the pipeline would call it.
+    texts = [fixture["text"][:SCREEN_CHARS] for fixture in fixtures]
+    began = time.perf_counter()
+    for _ in range(TIMING_ROUNDS):
+        for text in texts:
+            cim_classifier.score_text(text)
+    per_doc_ms = (time.perf_counter() - began) * 1000 / (TIMING_ROUNDS * len(texts))
+
+    return {
+        "documents": len(fixtures),
+        "decided_locally": len(fixtures) - ambiguous,
+        "sent_to_llm": ambiguous,
+        "llm_calls_avoided": ratio(len(fixtures) - ambiguous, len(fixtures)),
+        # Precision/recall of the local accept decisions, over documents it decided.
+        "precision": ratio(tp, tp + fp),
+        "recall": ratio(tp, tp + fn),
+        # Recall against every CIM, counting ambiguous CIMs as not (yet) accepted locally.
+        "local_accept_rate_of_cims": ratio(tp, sum(1 for f in fixtures if f["is_cim"])),
+        "false_accepts": fp,
+        "false_rejects": fn,
+        "mean_ms_per_document": round(per_doc_ms, 4),
+        "rows": rows,
+    }
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FIXTURES
+    report = run(path)
+    for name, label, decision, score in report.pop("rows"):
+        marker = "" if decision == "ambiguous" or (decision == "cim") == label else "  <-- WRONG"
+        print(f"{name:32} label={'cim' if label else 'other':5} decision={decision:9} score={score:6}{marker}")
+    print()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
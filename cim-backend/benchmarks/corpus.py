@@ -0,0 +1,83 @@
+# cim-backend/benchmarks/corpus.py
+#
+# Synthetic CIM PDFs for the pipeline benchmark. Every document is unique (so
+# the content-hash analysis cache and email deduplication never short-circuit a
+# run), reads as a CIM to the local pre-screen, and carries roughly a real page's
+# worth of text per page.
+#
+# Usage (from cim-backend/): python benchmarks/corpus.py OUT_DIR [count] [pages,pages,...]
+
+import os
+import sys
+import random
+from typing import List, Sequence, Tuple
+
+import fitz # PyMuPDF
+
+SECTIONS = ["Executive Summary", "Investment Highlights", "Company Overview", "Products and Services",
+            "Customers and End Markets", "Operations", "Management Team", "Historical Financial Performance",
+            "Projected Financial Performance", "Growth Opportunities", "Transaction Overview"]
+SENTENCES = [
+    "The Company has delivered consistent revenue growth driven by recurring service contracts.",
+    "Management believes the platform is well positioned for add-on acquisitions in a fragmented market.",
+    "Adjusted EBITDA margin expanded as the Company rationalized procurement and improved pricing.",
+    "The top ten customers represented approximately 38% of net revenue in the most recent fiscal year.",
+    "Capital expenditures have historically averaged roughly 3% of revenue.",
+    "The Company operates from three facilities and employs approximately 240 people.",
+    "Prospective buyers should rely solely on their own investigation of the Company.",
+    "Free cash flow conversion has exceeded 60% of EBITDA over the last three fiscal years.",
+]
+FONT_SIZE = 10
+LINE_HEIGHT = 13
+
+def _page_lines(rng: random.Random, page: int, pages: int, name: str) -> List[str]:
+    if page == 0:
+        return ["CONFIDENTIAL INFORMATION MEMORANDUM", f"Project {name}", "",
+                "Strictly private and confidential. This memorandum has been prepared solely for",
+                "prospective buyers and does not purport to be all-inclusive. No representation or",
+                "warranty is made. The recipient agrees to the terms of the confidentiality agreement.", "",
+                "Investment Highlights", f"- Revenue of ${rng.uniform(10, 90):.1f}M in FY2023, EBITDA of ${rng.uniform(1, 12):.1f}M",
+                f"- Revenue CAGR of {rng.uniform(2, 15):.1f}% (2021-2023)", "- Sole financial advisor: Example Partners"]
+    lines = [f"{SECTIONS[page % len(SECTIONS)]}", ""]
+    if page % 4 == 1:
+        revenue = rng.uniform(10, 90)
+        lines += ["($ in millions)        FY2021    FY2022    FY2023    FY2024E",
+                  f"Revenue               {revenue * .88:8.1f}  {revenue * .94:8.1f}  {revenue:8.1f}  {revenue * 1.1:8.1f}",
+                  f"EBITDA                {revenue * .09:8.1f}  {revenue * .1:8.1f}  {revenue * .11:8.1f}  {revenue * .12:8.1f}",
+                  f"Capex                 {revenue * .03:8.1f}  {revenue * .03:8.1f}  {revenue * .03:8.1f}  {revenue * .03:8.1f}", ""]
+    while len(lines) < 52:
+        lines.append(rng.choice(SENTENCES))
+    lines.append(f"Project {name} | Confidential | Page {page + 1} of {pages}")
+    return lines
+
+def make_cim_pdf(pages: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    name = f"{rng.choice(['Atlas', 'Birch', 'Cobalt', 'Delta', 'Ember', 'Falcon'])}-{seed}"
+    document = fitz.open()
+    try:
+        for page_number in range(pages):
+            page = document.new_page()
+            page.insert_text((54, 54), "\n".join(_page_lines(rng, page_number, pages, name)),
+                             fontsize=FONT_SIZE, lineheight=LINE_HEIGHT / FONT_SIZE)
+        return document.tobytes(deflate=True)
+    finally:
+        document.close()
+
+def build_corpus(count: int, page_counts: Sequence[int], seed: int = 0) -> List[Tuple[str, bytes]]:
+    """count (file name, PDF bytes) pairs, cycling through page_counts."""
+    return [(f"bench-{seed}-{i:04d}-{page_counts[i % len(page_counts)]}p.pdf",
+             make_cim_pdf(page_counts[i % len(page_counts)], seed * 100000 + i))
+            for i in range(count)]
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else "bench-corpus"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    page_counts = [int(p) for p in sys.argv[3].split(",")] if len(sys.argv) > 3 else [5, 20, 60]
+    os.makedirs(out_dir, exist_ok=True)
+    for file_name, data in build_corpus(count, page_counts):
+        with open(os.path.join(out_dir, file_name), "wb") as f:
+            f.write(data)
+    print(f"Wrote {count} PDFs to {out_dir}")
+
+if __name__ == "__main__":
+    main()
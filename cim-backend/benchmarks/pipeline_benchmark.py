@@ -0,0 +1,394 @@
+# cim-backend/benchmarks/pipeline_benchmark.py
+#
+# End-to-end load test of upload -> extract -> classify -> S3 -> analyze. Starts
+# local stand-ins for OpenAI, S3 and Clerk (benchmarks/stand_ins.py), runs the API
+# (uvicorn main:app) and one worker.py as child processes against them, then drives
+# /analyze/, the Mailgun /webhook and the deal list endpoints concurrently with a
+# synthetic CIM corpus. Reports p50/p95/p99 latency per stage, jobs/minute and
+# peak RSS per process, and writes everything to a JSON file so runs can be diffed.
+#
+# Needs DATABASE_URL pointing at a Postgres the benchmark may create tables in; use
+# a dedicated database, since the worker also drains any jobs already queued there.
+# Benchmark deals are owned by their own user ids and deleted afterwards (--keep
+# leaves them).
+#
+# Usage (from cim-backend/):
+#   python benchmarks/pipeline_benchmark.py --documents 40 --emails 5 --concurrency 8 \
+#       --llm-latency-ms 800 --llm-tokens-per-second 150 --workers 4
+
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import signal
+import asyncio
+import hashlib
+import argparse
+import platform
+import threading
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+import stand_ins
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MAILGUN_KEY = "bench-mailgun-key"
+TERMINAL_STATUSES = ("Complete", "Failed", "Removed")
+
+# --- Measurements ---
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(samples: List[float]) -> dict:
+    """Latency summary in milliseconds."""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1) if samples else 0.0,
+    }
+
+def _status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class RssSampler:
+    """Peak resident memory per process, from /proc (VmHWM where the kernel keeps it, else sampled VmRSS)."""
+    def __init__(self, pids: Dict[str, int], interval: float = 0.2):
+        self.pids = pids
+        self.interval = interval
+        self.peak_kb = {name: 0 for name in pids}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        for name, pid in self.pids.items():
+            self.peak_kb[name] = max(self.peak_kb[name], _status_kb(pid, "VmHWM"), _status_kb(pid, "VmRSS"))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._sample()
+        self._stop.set()
+        self._thread.join()
+        return {name: round(kb / 1024, 1) for name, kb in self.peak_kb.items()}
+
+# --- Processes Under Test ---
+
+def child_env(args, s3: stand_ins.Served, openai: stand_ins.Served, clerk: stand_ins.Served, run_id: str) -> dict:
+    env = dict(os.environ)
+    env.pop("CLERK_AUTHORIZED_PARTIES", None)
+    env.update({
+        "S3_ENDPOINT_URL": s3.url,
+        "S3_BUCKET_NAME": "bench",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_REGION": "us-east-1",
+        "OPENAI_BASE_URL": f"{openai.url}/v1",
+        "OPENAI_API_KEY": "bench",
+        "CLERK_SECRET_KEY": env.get("CLERK_SECRET_KEY") or "sk_test_bench",
+        "CLERK_JWKS_URL": f"{clerk.url}/jwks",
+        "MAILGUN_API_KEY": MAILGUN_KEY,
+        "EMAIL_INGEST_USER_ID": f"bench-email-{run_id}",
+        "WORKER_CONCURRENCY": str(args.workers),
+        "WORKER_POLL_INTERVAL_SECONDS": "0.2",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.llm_rate_limits:
+        env["LLM_RATE_LIMITS"] = args.llm_rate_limits
+    return env
+
+def start_process(command: List[str], env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_for_http(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s.")
+
+def stop_process(process: subprocess.Popen, timeout: float = 30.0):
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# --- Load ---
+
+def signed_fields() -> dict:
+    timestamp, token = str(int(time.time())), uuid.uuid4().hex
+    signature = hmac.new(MAILGUN_KEY.encode(), f"{timestamp}{token}".encode(), hashlib.sha256).hexdigest()
+    return {"timestamp": timestamp, "token": token, "signature": signature}
+
+async def drive_load(args, api_url: str, token: str, documents: List[tuple], emails: List[List[tuple]]) -> dict:
+    """Posts every upload and email with bounded concurrency while readers poll the deal list."""
+    latencies = {"analyze": [], "webhook": [], "deals_list": [], "deals_summary": []}
+    errors = {name: 0 for name in latencies}
+    deal_ids: List[int] = []
+    limit = asyncio.Semaphore(args.concurrency)
+    intake_done = asyncio.Event()
+    pipeline_done = asyncio.Event()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async with httpx.AsyncClient(base_url=api_url, headers=headers, timeout=120.0,
+                                 limits=httpx.Limits(max_connections=args.concurrency + args.readers + 4)) as client:
+
+        async def timed(name: str, call):
+            began = time.perf_counter()
+            try:
+                response = await call()
+                response.raise_for_status()
+                return response
+            except httpx.HTTPError as e:
+                errors[name] += 1
+                print(f"{name} request failed: {e}")
+                return None
+            finally:
+                latencies[name].append(time.perf_counter() - began)
+
+        async def upload(file_name: str, data: bytes):
+            async with limit:
+                response = await timed("analyze", lambda: client.post(
+                    "/analyze/", files={"file": (file_name, data, "application/pdf")}))
+            if response is not None:
+                deal_ids.append(response.json()["id"])
+
+        async def email(attachments: List[tuple]):
+            fields = {**signed_fields(), "sender": "bench@example.com", "subject": "Benchmark CIMs",
+                      "Message-Id": f"<{uuid.uuid4().hex}@bench>", "attachment-count": str(len(attachments))}
+            files = {f"attachment-{i}": (name, data, "application/pdf") for i, (name, data) in enumerate(attachments, 1)}
+            async with limit:
+                response = await timed("webhook", lambda: client.post("/webhook", data=fields, files=files))
+            if response is not None:
+                deal_ids.extend(response.json().get("deal_ids", []))
+
+        async def reader():
+            while not intake_done.is_set() or not pipeline_done.is_set():
+                await timed("deals_list", lambda: client.get("/api/deals"))
+                await timed("deals_summary", lambda: client.get("/api/deals/summary", params={"limit": 50}))
+                await asyncio.sleep(args.read_interval)
+
+        readers = [asyncio.create_task(reader()) for _ in range(args.readers)]
+        began = time.perf_counter()
+        await asyncio.gather(*(upload(name, data) for name, data in documents),
+                             *(email(attachments) for attachments in emails))
+        intake_seconds = time.perf_counter() - began
+        intake_done.set()
+        await asyncio.to_thread(wait_for_pipeline, deal_ids, args.timeout)
+        pipeline_done.set()
+        await asyncio.gather(*readers)
+
+    return {"latencies": latencies, "errors": errors, "deal_ids": deal_ids, "intake_seconds": intake_seconds}
+
+# --- Pipeline Results (read from the database) ---
+
+def wait_for_pipeline(deal_ids: List[int], timeout: float):
+    """Blocks until every deal reached a terminal status event, or timeout."""
+    import models
+    from database import SessionLocal
+    deadline = time.monotonic() + timeout
+    db = SessionLocal()
+    try:
+        while time.monotonic() < deadline:
+            finished = db.query(models.DealEvent.deal_id).filter(
+                models.DealEvent.deal_id.in_(deal_ids), models.DealEvent.status.in_(TERMINAL_STATUSES)
+            ).distinct().count()
+            db.rollback()
+            if finished >= len(deal_ids):
+                return
+            time.sleep(0.5)
+        print(f"Timed out with {len(deal_ids) - finished} deal(s) still in the pipeline.")
+    finally:
+        db.close()
+
+def pipeline_results(deal_ids: List[int]) -> dict:
+    """Queue-to-terminal time per deal, from the Analyzing and final events in deal_events."""
+    import models
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        events = db.query(models.DealEvent).filter(models.DealEvent.deal_id.in_(deal_ids)).all()
+        queued, finished, outcome = {}, {}, {}
+        for event in events:
+            if event.status == "Analyzing":
+                queued[event.deal_id] = min(queued.get(event.deal_id, event.created_at), event.created_at)
+            elif event.status in TERMINAL_STATUSES:
+                finished[event.deal_id] = event.created_at
+                outcome[event.deal_id] = event.status
+        durations = [(finished[d] - queued[d]).total_seconds() for d in finished if d in queued]
+        span = (max(finished.values()) - min(queued.values())).total_seconds() if finished and queued else 0.0
+        counts = {status: list(outcome.values()).count(status) for status in TERMINAL_STATUSES}
+        jobs = db.query(models.AnalysisJob).filter(models.AnalysisJob.deal_id.in_(deal_ids)).all()
+        return {
+            "deals": len(deal_ids),
+            "finished": len(finished),
+            "outcomes": counts,
+            "queued_to_done": summarize(durations),
+            "jobs_per_minute": round(len(finished) / span * 60, 2) if span else 0.0,
+            "span_seconds": round(span, 2),
+            "job_attempts": sum(job.attempts for job in jobs),
+        }
+    finally:
+        db.close()
+
+def delete_benchmark_deals(user_ids: List[str]):
+    import models
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        deal_ids = [row.id for row in db.query(models.Deal.id).filter(models.Deal.user_id.in_(user_ids))]
+        if deal_ids:
+            db.query(models.DealEvent).filter(models.DealEvent.deal_id.in_(deal_ids)).delete(synchronize_session=False)
+            db.query(models.Deal).filter(models.Deal.id.in_(deal_ids)).delete(synchronize_session=False)
+        db.commit()
+        print(f"Deleted {len(deal_ids)} benchmark deal(s).")
+    finally:
+        db.close()
+
+# --- Run ---
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def run(args) -> dict:
+    from database import Base, engine
+    import models  # noqa: F401 -- registers every table on Base.metadata
+    Base.metadata.create_all(bind=engine)
+
+    run_id = uuid.uuid4().hex[:8]
+    page_counts = [int(p) for p in args.pages.split(",")]
+    began = time.perf_counter()
+    documents = corpus.build_corpus(args.documents + args.emails * args.attachments, page_counts, seed=int(time.time()))
+    print(f"Built {len(documents)} synthetic CIMs ({args.pages} pages) in {time.perf_counter() - began:.1f}s.")
+    uploads = documents[:args.documents]
+    rest = documents[args.documents:]
+    emails = [rest[i:i + args.attachments] for i in range(0, len(rest), args.attachments)]
+
+    openai_app = stand_ins.fake_openai_app(args.llm_latency_ms, args.llm_tokens_per_second, args.llm_error_rate)
+    openai = stand_ins.serve(openai_app)
+    s3 = stand_ins.serve(stand_ins.fake_s3_app())
+    clerk = stand_ins.FakeClerk()
+    clerk_server = stand_ins.serve(clerk.app)
+    user_id = f"bench-{run_id}"
+    env = child_env(args, s3, openai, clerk_server, run_id)
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    api_port = stand_ins.free_port()
+    api = start_process([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(api_port),
+                         "--log-level", "warning", "--no-access-log"], env, os.path.join(args.log_dir, f"api-{run_id}.log"))
+    worker = start_process([sys.executable, "worker.py"], env, os.path.join(args.log_dir, f"worker-{run_id}.log"))
+    sampler = RssSampler({"api": api.pid, "worker": worker.pid, "harness_and_stand_ins": os.getpid()})
+    try:
+        api_url = f"http://127.0.0.1:{api_port}"
+        wait_for_http(api_url + "/")
+        sampler.start()
+        load = asyncio.run(drive_load(args, api_url, clerk.token(user_id, first_name="Bench"), uploads, emails))
+        pipeline = pipeline_results(load["deal_ids"])
+    finally:
+        stop_process(api)
+        stop_process(worker)
+        peak_rss_mb = sampler.stop()
+        openai.stop()
+        s3.stop()
+        clerk_server.stop()
+        if not args.keep:
+            delete_benchmark_deals([user_id, env["EMAIL_INGEST_USER_ID"]])
+
+    llm_stats = openai_app.state.stats
+    return {
+        "run_id": run_id,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "log_dir")},
+        "stages": {
+            "intake_analyze": summarize(load["latencies"]["analyze"]),
+            "intake_webhook": summarize(load["latencies"]["webhook"]),
+            "read_deals_list": summarize(load["latencies"]["deals_list"]),
+            "read_deals_summary": summarize(load["latencies"]["deals_summary"]),
+            "pipeline_queued_to_done": pipeline.pop("queued_to_done"),
+        },
+        "intake_seconds": round(load["intake_seconds"], 2),
+        "errors": load["errors"],
+        "pipeline": pipeline,
+        "peak_rss_mb": peak_rss_mb,
+        "llm": {key: llm_stats.get(key, 0) for key in ("requests", "rate_limited", "max_in_flight",
+                                                         "prompt_tokens", "completion_tokens")},
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline load benchmark with local stand-ins.")
+    parser.add_argument("--documents", type=int, default=20, help="PDFs uploaded through /analyze/")
+    parser.add_argument("--emails", type=int, default=4, help="Mailgun webhook posts")
+    parser.add_argument("--attachments", type=int, default=3, help="PDF attachments per email")
+    parser.add_argument("--pages", default="5,20,60", help="Page counts cycled through the corpus")
+    parser.add_argument("--concurrency", type=int, default=8, help="Uploads/emails in flight at once")
+    parser.add_argument("--readers", type=int, default=2, help="Clients polling /api/deals during the run")
+    parser.add_argument("--read-interval", type=float, default=0.5, help="Pause between a reader's polls (s)")
+    parser.add_argument("--workers", type=int, default=4, help="WORKER_CONCURRENCY of the worker process")
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0, help="Fixed latency of each fake OpenAI call")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=0.0, help="Fake output token rate (0: off)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of fake OpenAI calls answered 429")
+    parser.add_argument("--llm-rate-limits", help="LLM_RATE_LIMITS for the worker, e.g. gpt-4o=10000/10000000 "
+                        "to take the gateway's token budget out of the measurement (default: inherited)")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for the pipeline to drain")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark deals in the database")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/pipeline-<UTC time>.json)")
+    parser.add_argument("--log-dir", default=os.path.join(DEFAULT_RESULTS_DIR, "logs"), help="API/worker logs")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    # Turn SIGTERM into SystemExit so the API and worker children are stopped on the way out.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    report = run(args)
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"pipeline-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({key: report[key] for key in ("stages", "pipeline", "peak_rss_mb", "errors")}, indent=2))
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    main()
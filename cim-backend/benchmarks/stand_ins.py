@@ -0,0 +1,306 @@
+# cim-backend/benchmarks/stand_ins.py
+#
+# Local stand-ins for the external services the pipeline talks to, so the
+# benchmark measures our code rather than OpenAI, S3 or Clerk:
+#
+#   - fake_openai_app: /v1/chat/completions with configurable latency and output
+#     token rate; answers the screening prompt and the analysis prompt, streamed
+#     as server-sent events when the request asks for stream=True.
+#   - fake_s3_app: in-memory, path-style S3 subset used by services.py (put,
+#     multipart, get with Range, head, copy, delete).
+#   - FakeClerk: an RSA key pair, a /jwks endpoint for CLERK_JWKS_URL, and
+#     session tokens the cached auth fast path accepts.
+#
+# serve(app) runs any of them on a background uvicorn thread.
+
+import time
+import json
+import uuid
+import base64
+import socket
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from email.utils import formatdate
+from typing import Dict, Optional
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+
+import jwt
+import uvicorn
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# --- Serving ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Served:
+    def __init__(self, server: uvicorn.Server, thread: threading.Thread, port: int):
+        self.server = server
+        self.thread = thread
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+def serve(app, port: Optional[int] = None) -> Served:
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False, timeout_keep_alive=30))
+    thread = threading.Thread(target=server.run, name=f"stand-in-{port}", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Stand-in on port {port} did not start.")
+        time.sleep(0.02)
+    return Served(server, thread, port)
+
+# --- Fake OpenAI ---
+
+def sample_analysis(company: str = "Benchmark Manufacturing Co.") -> dict:
+    """A gpt-4o answer in the SYSTEM_PROMPT schema: raw yearly figures, ratios and CAGRs left to derived_financials."""
+    return {
+        "company": {"name": company, "description": "Designs and manufactures commercial HVAC equipment."},
+        "industry": "Industrial Machinery - HVAC Equipment",
+        "ibis_industries": ["HVAC Services"],
+        "financials": {"periods": [
+            {"year": "2021", "type": "actual", "revenue": "$35.5M", "ebitda": "$3.0M", "gross_profit": "$8.0M",
+             "gross_margin": "N/A", "capex": "$1.1M", "fcf": "N/A"},
+            {"year": "2022", "type": "actual", "revenue": "$37.6M", "ebitda": "$3.4M", "gross_profit": "$8.7M",
+             "gross_margin": "N/A", "capex": "$1.1M", "fcf": "$2.2M"},
+            {"year": "2023", "type": "actual", "revenue": "$39.9M", "ebitda": "$3.8M", "gross_profit": "$9.4M",
+             "gross_margin": "N/A", "capex": "$1.2M", "fcf": "$2.5M"},
+            {"year": "2024", "type": "estimate", "revenue": "$45.2M", "ebitda": "$5.1M", "gross_profit": "N/A",
+             "gross_margin": "N/A", "capex": "$1.5M", "fcf": "$3.0M"},
+        ]},
+        "growth": {"growth_commentary": "- Steady growth from service contracts."},
+        "thesis": "- Recurring service revenue\n- Fragmented market\n- Add-on potential",
+        "red_flags": "- Customer concentration\n- Projections rely on management estimates",
+        "summary": "Benchmark Manufacturing designs and services commercial HVAC equipment. " * 12,
+        "confidence_score": 78,
+        "flagged_fields": ["estimates.revenue"],
+        "low_confidence_flags": ["revenue: 2024 figure is projected"],
+    }
+
+def fake_openai_app(latency_ms: float = 500.0, tokens_per_second: float = 0.0,
+                    error_rate: float = 0.0) -> FastAPI:
+    """
+    Chat completions stand-in. Each call waits latency_ms plus completion_tokens /
+    tokens_per_second (0 disables the token-rate delay). error_rate of the calls
+    answer 429 with Retry-After, to exercise the gateway's backoff. Streamed calls send
+    the first chunk after latency_ms and the rest at tokens_per_second.
+    """
+    app = FastAPI()
+    app.state.stats = Counter()
+    screening = json.dumps({"is_cim": True})
+    analysis = json.dumps(sample_analysis())
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats = app.state.stats
+        stats["requests"] += 1
+        if error_rate and (stats["requests"] * 7919) % 1000 < error_rate * 1000:
+            stats["rate_limited"] += 1
+            return JSONResponse({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                status_code=429, headers={"retry-after": "0.2"})
+        system = next((m.get("content", "") for m in body.get("messages", []) if m.get("role") == "system"), "")
+        content = screening if '"is_cim"' in system else analysis
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(stream_completion(body.get("model", "gpt-4o"), content, usage, include_usage),
+                                     media_type="text/event-stream")
+        delay = latency_ms / 1000 + (completion_tokens / tokens_per_second if tokens_per_second else 0)
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            stats["in_flight"] -= 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def stream_completion(model: str, content: str, usage: dict, include_usage: bool):
+        stats = app.state.stats
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        completion_id, created = f"chatcmpl-{uuid.uuid4().hex}", int(time.time())
+
+        def event(choices, **extra) -> str:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        try:
+            await asyncio.sleep(latency_ms / 1000)
+            piece = 16 # characters per chunk, about four tokens
+            for start in range(0, len(content), piece):
+                if tokens_per_second and start:
+                    await asyncio.sleep(piece / 4 / tokens_per_second)
+                yield event([{"index": 0, "delta": {"content": content[start:start + piece]}, "finish_reason": None}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                yield event([], usage=usage)
+            yield "data: [DONE]\n\n"
+        finally:
+            stats["in_flight"] -= 1
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["completion_tokens"] += usage["completion_tokens"]
+
+    return app
+
+# --- Fake S3 ---
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Strips aws-chunked framing (size;chunk-signature lines and checksum trailers)."""
+    out, pos = bytearray(), 0
+    while pos < len(body):
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+        out += body[line_end + 2:line_end + 2 + size]
+        pos = line_end + 2 + size + 2
+    return bytes(out)
+
+def _xml(root: str, **fields) -> Response:
+    inner = "".join(f"<{k}>{escape(str(v))}</{k}>" for k, v in fields.items())
+    return Response(f'<?xml version="1.0" encoding="UTF-8"?><{root}>{inner}</{root}>', media_type="application/xml")
+
+def _not_found(key: str) -> Response:
+    return Response(f"<Error><Code>NoSuchKey</Code><Key>{escape(key)}</Key></Error>", status_code=404,
+                    media_type="application/xml")
+
+def fake_s3_app() -> FastAPI:
+    """Path-style S3 subset, in memory. Buckets spring into existence on first write."""
+    app = FastAPI()
+    objects: Dict[tuple, dict] = {}
+    uploads: Dict[str, dict] = {}
+    app.state.objects = objects
+    app.state.stats = Counter()
+
+    def store(bucket: str, key: str, data: bytes) -> dict:
+        entry = {"data": data, "etag": f'"{hashlib.md5(data).hexdigest()}"', "modified": time.time()}
+        objects[(bucket, key)] = entry
+        app.state.stats["bytes_in"] += len(data)
+        return entry
+
+    async def read_body(request: Request) -> bytes:
+        body = await request.body()
+        if "aws-chunked" in request.headers.get("content-encoding", "") or \
+                request.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+            body = _decode_aws_chunked(body)
+        return body
+
+    @app.put("/{bucket}")
+    async def create_bucket(bucket: str):
+        return Response(status_code=200)
+
+    @app.put("/{bucket}/{key:path}")
+    async def put_object(bucket: str, key: str, request: Request):
+        params = request.query_params
+        if "uploadId" in params:
+            upload = uploads[params["uploadId"]]
+            data = await read_body(request)
+            upload["parts"][int(params["partNumber"])] = data
+            return Response(status_code=200, headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+        source = request.headers.get("x-amz-copy-source")
+        if source:
+            source_bucket, _, source_key = source.lstrip("/").partition("/")
+            original = objects.get((source_bucket, unquote(source_key)))
+            if original is None:
+                return _not_found(source_key)
+            entry = store(bucket, key, original["data"])
+            return _xml("CopyObjectResult", ETag=entry["etag"], LastModified=time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()))
+        entry = store(bucket, key, await read_body(request))
+        app.state.stats["puts"] += 1
+        return Response(status_code=200, headers={"ETag": entry["etag"]})
+
+    @app.post("/{bucket}/{key:path}")
+    async def multipart(bucket: str, key: str, request: Request):
+        params = request.query_params
+        if "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+            return _xml("InitiateMultipartUploadResult", Bucket=bucket, Key=key, UploadId=upload_id)
+        upload = uploads.pop(params["uploadId"])
+        data = b"".join(upload["parts"][number] for number in sorted(upload["parts"]))
+        entry = store(bucket, key, data)
+        app.state.stats["multipart_uploads"] += 1
+        return _xml("CompleteMultipartUploadResult", Bucket=bucket, Key=key, ETag=entry["etag"])
+
+    @app.delete("/{bucket}/{key:path}")
+    async def delete_object(bucket: str, key: str, request: Request):
+        if "uploadId" in request.query_params:
+            uploads.pop(request.query_params["uploadId"], None)
+        else:
+            objects.pop((bucket, key), None)
+            app.state.stats["deletes"] += 1
+        return Response(status_code=204)
+
+    @app.api_route("/{bucket}/{key:path}", methods=["GET", "HEAD"])
+    async def get_object(bucket: str, key: str, request: Request):
+        entry = objects.get((bucket, key))
+        if entry is None:
+            return _not_found(key)
+        data, status_code = entry["data"], 200
+        headers = {"ETag": entry["etag"], "Last-Modified": formatdate(entry["modified"], usegmt=True),
+                   "Accept-Ranges": "bytes", "Content-Type": "application/pdf"}
+        byte_range = request.headers.get("range")
+        if byte_range and byte_range.startswith("bytes="):
+            start, _, end = byte_range[6:].partition("-")
+            if start:
+                first, last = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            else:
+                first, last = max(len(data) - int(end), 0), len(data) - 1
+            headers["Content-Range"] = f"bytes {first}-{last}/{len(data)}"
+            data, status_code = data[first:last + 1], 206
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(data))
+            return Response(status_code=status_code, headers=headers)
+        app.state.stats["gets"] += 1
+        app.state.stats["bytes_out"] += len(data)
+        return Response(data, status_code=status_code, headers=headers)
+
+    return app
+
+# --- Fake Clerk ---
+
+def _b64url_uint(value: int) -> str:
+    raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+class FakeClerk:
+    """Signs session tokens and serves the matching JWKS (point CLERK_JWKS_URL at app's /jwks)."""
+    def __init__(self, kid: str = "bench-key"):
+        self.kid = kid
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        numbers = self._key.public_key().public_numbers()
+        self.jwks = {"keys": [{"kty": "RSA", "use": "sig", "alg": "RS256", "kid": kid,
+                               "n": _b64url_uint(numbers.n), "e": _b64url_uint(numbers.e)}]}
+        self.app = FastAPI()
+        self.app.get("/jwks")(lambda: self.jwks)
+
+    def token(self, user_id: str, ttl_seconds: int = 3600, **claims) -> str:
+        now = int(time.time())
+        payload = {"sub": user_id, "iat": now, "nbf": now, "exp": now + ttl_seconds, **claims}
+        return jwt.encode(payload, self._key, algorithm="RS256", headers={"kid": self.kid})
@@ -0,0 +1,202 @@
+# cim-backend/chunked_analysis.py
+#
+# Split and merge helpers for analyzing documents too long for one gpt-4o call.
+# services.analyze_document_text maps SYSTEM_PROMPT over overlapping sections
+# concurrently; merge_analyses reduces the partial JSONs back into one object
+# with the same schema, resolving conflicts deterministically.
+
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import derived_financials
+
+# --- Chunking Configuration ---
+ANALYSIS_CHAR_LIMIT = int(os.getenv("ANALYSIS_CHAR_LIMIT", "120000"))
+ANALYSIS_CHUNK_CHARS = int(os.getenv("ANALYSIS_CHUNK_CHARS", "40000"))
+ANALYSIS_CHUNK_OVERLAP = int(os.getenv("ANALYSIS_CHUNK_OVERLAP", "1500"))
+ANALYSIS_MAX_CHUNKS = int(os.getenv("ANALYSIS_MAX_CHUNKS", "12"))
+
+NA = "N/A"
+_MAX_BULLETS = 6
+_MAX_IBIS = 3
+
+# --- Splitting ---
+
+def split_text(text: str, chunk_chars: int = ANALYSIS_CHUNK_CHARS, overlap: int = ANALYSIS_CHUNK_OVERLAP,
+               max_chunks: int = ANALYSIS_MAX_CHUNKS) -> List[str]:
+    """
+    Splits text into overlapping sections, preferring to break at paragraph or line
+    boundaries. Chunks grow beyond chunk_chars when needed to stay within max_chunks.
+    """
+    if len(text) <= chunk_chars:
+        return [text]
+    # Boundary back-off can shorten a chunk by up to 10%, so leave that much slack.
+    stride_needed = -(-(len(text) - overlap) // max_chunks)
+    size = max(chunk_chars, -(-(stride_needed + overlap) * 10 // 9))
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Back off to a natural boundary in the last 10% of the window.
+            window_start = end - size // 10
+            boundary = max(text.rfind("\n\n", window_start, end), text.rfind("\n", window_start, end))
+            if boundary > start:
+                end = boundary + 1
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def chunk_preamble(index: int, total: int) -> str:
+    return (
+        f"[This is section {index + 1} of {total} of a longer document. Sections overlap slightly. "
+        f"Report only what this section explicitly states and use \"N/A\" for everything else.]\n\n"
+    )
+
+# --- Merging ---
+
+def _present(value: Any) -> bool:
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return value.strip() not in ("", NA, "n/a", "N/A.")
+    if isinstance(value, (list, dict)):
+        return bool(value)
+    return True
+
+def _get(data: Any, *path: str) -> Any:
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def _confidence(partial: dict, *path: str) -> int:
+    value = _get(partial.get("confidence_breakdown"), *path)
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+def _vote(values: List[str]) -> Optional[str]:
+    """Most common value; ties go to the earliest section."""
+    present = [v for v in values if _present(v)]
+    if not present:
+        return None
+    counts = Counter(v.strip() for v in present)
+    best = max(counts.values())
+    return next(v.strip() for v in present if counts[v.strip()] == best)
+
+def _bullets(text: Any) -> List[str]:
+    if not _present(text):
+        return []
+    lines = text if isinstance(text, list) else str(text).split("\n")
+    return [line.strip().lstrip("-•* ").strip() for line in lines if line.strip().lstrip("-•* ").strip()]
+
+def _merge_bullets(values: List[Any], limit: int = _MAX_BULLETS) -> str:
+    seen = set()
+    merged = []
+    for value in values:
+        for bullet in _bullets(value):
+            key = re.sub(r"\W+", " ", bullet.lower()).strip()
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(f"- {bullet}")
+    return "\n".join(merged[:limit]) if merged else NA
+
+def _union(values: List[Any], limit: Optional[int] = None) -> List[Any]:
+    counts = Counter()
+    order = []
+    for value in values:
+        for item in value if isinstance(value, list) else []:
+            if not isinstance(item, str):
+                continue
+            if item not in counts:
+                order.append(item)
+            counts[item] += 1
+    ranked = sorted(order, key=lambda item: -counts[item])
+    return ranked[:limit] if limit else ranked
+
+def _merge_periods(partials: List[dict], conflicts: List[str]) -> tuple:
+    """
+    Unions the yearly figures of every section. Each figure of a year comes from the
+    most confident section reporting it; disagreements are recorded as conflicts.
+    """
+    reported: Dict[tuple, list] = {}
+    for i, partial in enumerate(partials):
+        for period in derived_financials.periods_from_analysis(partial):
+            reported.setdefault((period.year, period.estimate), []).append((i, period))
+
+    merged, confidence = [], {}
+    for (year, estimate), entries in sorted(reported.items()):
+        period = derived_financials.Period(year=year, estimate=estimate)
+        for field in derived_financials.PERIOD_FIELDS:
+            options = [(i, p) for i, p in entries if field in p.values]
+            if not options:
+                continue
+            best_i, best = max(options, key=lambda o: (_confidence(partials[o[0]], "financials", field), -o[0]))
+            period.raw[field] = best.raw[field]
+            period.values[field] = best.values[field]
+            confidence[field] = max(confidence.get(field, 0), _confidence(partials[best_i], "financials", field))
+            distinct = {p.raw[field] for _, p in options if p.values[field] != best.values[field]}
+            if distinct:
+                label = f"{year}{'E' if estimate else ''} {field}"
+                conflicts.append(f"{label}: sections disagreed ({', '.join(sorted(distinct | {best.raw[field]}))}); kept {best.raw[field]}")
+        merged.append(period)
+    return derived_financials.period_dicts(merged), confidence
+
+def merge_analyses(partials: List[dict]) -> dict:
+    """
+    Reduces per-section analyses into a single object in the SYSTEM_PROMPT schema.
+    Any failed section fails the whole analysis, so the job retries rather than
+    silently dropping part of the document.
+    """
+    if not partials or any(not isinstance(p, dict) or "error" in p for p in partials):
+        return {"error": "Failed to analyze document."}
+    if len(partials) == 1:
+        return partials[0]
+
+    conflicts: List[str] = []
+    periods, period_conf = _merge_periods(partials, conflicts)
+    # CAGRs and ratios are derived from the merged periods afterwards (derived_financials).
+    growth = {"growth_commentary": _merge_bullets([_get(p, "growth", "growth_commentary") for p in partials], 3)}
+
+    summaries = [(i, p.get("summary")) for i, p in enumerate(partials) if _present(p.get("summary"))]
+    summary = max(summaries, key=lambda o: (_confidence(partials[o[0]], "summary"), -o[0]))[1] if summaries else NA
+
+    name = _vote([_get(p, "company", "name") for p in partials]) or NA
+    description = next((d for d in (_get(p, "company", "description") for p in partials) if _present(d)), NA)
+    industry = _vote([p.get("industry") for p in partials]) or NA
+
+    scores = [p.get("confidence_score") for p in partials if isinstance(p.get("confidence_score"), (int, float))]
+
+    def best_confidence(key):
+        return max((_confidence(p, key) for p in partials), default=0)
+
+    return {
+        "company": {"name": name, "description": description},
+        "industry": industry,
+        "ibis_industries": _union([p.get("ibis_industries") for p in partials], _MAX_IBIS),
+        "financials": {"periods": periods},
+        "growth": growth,
+        "thesis": _merge_bullets([p.get("thesis") for p in partials]),
+        "red_flags": _merge_bullets([p.get("red_flags") for p in partials]),
+        "summary": summary,
+        "confidence_score": round(sum(scores) / len(scores)) if scores else 0,
+        "flagged_fields": _union([p.get("flagged_fields") for p in partials]),
+        "confidence_breakdown": {
+            "company": best_confidence("company"),
+            "industry": best_confidence("industry"),
+            "financials": period_conf,
+            "growth": best_confidence("growth"),
+            "thesis": best_confidence("thesis"),
+            "red_flags": best_confidence("red_flags"),
+            "summary": best_confidence("summary"),
+        },
+        "low_confidence_flags": _union([p.get("low_confidence_flags") for p in partials]) + conflicts,
+    }
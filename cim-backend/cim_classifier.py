@@ -0,0 +1,113 @@
+# cim-backend/cim_classifier.py
+#
+# Offline keyword/structure scorer for the CIM pre-screen. It settles the clear
+# cases on its own and only sends ambiguous documents to the LLM screening call.
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict
+
+# --- Decision Thresholds ---
+# Scores at or above ACCEPT are CIMs, at or below REJECT are not; anything between goes to the LLM.
+CIM_CLASSIFIER_ACCEPT_SCORE = float(os.getenv("CIM_CLASSIFIER_ACCEPT_SCORE", "6"))
+CIM_CLASSIFIER_REJECT_SCORE = float(os.getenv("CIM_CLASSIFIER_REJECT_SCORE", "-2"))
+
+def _phrases(*phrases: str):
+    return re.compile(r"\b(?:" + "|".join(phrases) + r")\b")
+
+# --- Signals ---
+# (name, pattern, weight per match, max matches counted). Patterns run on lower-cased text.
+_SIGNALS = [
+    # Document-type headers
+    ("cim_header", _phrases(
+        r"confidential information memorandum", r"confidential offering memorandum",
+        r"information memorandum", r"offering memorandum", r"confidential memorandum",
+        r"investment teaser", r"executive teaser", r"project [a-z]+ (?:teaser|memorandum|cim)",
+    ), 6.0, 1),
+    ("deal_language", _phrases(
+        r"investment highlights", r"key investment (?:highlights|considerations|merits)",
+        r"transaction overview", r"the opportunity", r"process letter", r"indications? of interest",
+        r"sell[- ]side", r"proposed transaction", r"strategic alternatives", r"sole (?:financial )?advisor",
+        r"exclusive (?:financial )?advisor", r"growth opportunities", r"management presentation",
+    ), 1.5, 3),
+    # Confidentiality disclaimers aimed at prospective buyers
+    ("disclaimer", _phrases(
+        r"prospective (?:buyers?|purchasers?|investors?|acquirers?)", r"has been prepared (?:by|solely)",
+        r"does not purport to be all[- ]inclusive", r"no representation or warranty",
+        r"not be (?:reproduced|copied|distributed)", r"strictly (?:private and )?confidential",
+        r"confidentiality agreement", r"the recipient", r"forward[- ]looking statements",
+    ), 1.0, 4),
+    # Financial highlights
+    ("financial_terms", _phrases(
+        r"adjusted ebitda", r"ebitda", r"gross margin", r"net revenues?", r"revenue", r"free cash flow",
+        r"capex", r"capital expenditures", r"cagr", r"recurring revenue",
+    ), 0.5, 8),
+    ("money_amounts", re.compile(r"\$\s?\d[\d,]*(?:\.\d+)?\s?(?:m|mm|million|k|bn|b|billion)\b"), 0.3, 10),
+    ("fiscal_years", re.compile(r"\b(?:fy|cy)?\s?20[0-3]\d[ae]?\b"), 0.15, 10),
+    ("business_overview", _phrases(
+        r"company overview", r"business overview", r"executive summary", r"customers?",
+        r"headquartered", r"founded in", r"employees", r"market (?:overview|position|leader)",
+    ), 0.4, 5),
+    # Negative evidence: invoices, legal contracts, resumes, filings, newsletters
+    ("invoice", _phrases(
+        r"invoice (?:number|no|#|date)", r"bill to", r"amount due", r"balance due", r"remit(?:tance)? to",
+        r"payment terms", r"due date", r"subtotal", r"purchase order", r"sales tax",
+    ), -2.0, 5),
+    ("legal_contract", _phrases(
+        r"this (?:mutual )?(?:non-disclosure|nondisclosure|confidentiality) agreement",
+        r"this agreement is (?:made|entered)", r"in witness whereof", r"witnesseth", r"hereinafter",
+        r"governing law", r"the parties agree", r"shall be governed", r"counterparts",
+    ), -2.0, 5),
+    ("resume", _phrases(
+        r"curriculum vitae", r"work experience", r"professional experience", r"references available",
+        r"education", r"skills",
+    ), -1.0, 4),
+    ("public_filing", _phrases(
+        r"securities and exchange commission", r"form 10-[kq]", r"earnings per share",
+        r"nasdaq", r"nyse", r"conference call", r"press release", r"per diluted share",
+    ), -1.5, 4),
+    ("newsletter", _phrases(
+        r"unsubscribe", r"newsletter", r"view (?:this email )?in (?:your )?browser", r"webinar",
+    ), -1.5, 3),
+]
+
+# Signals that only count as supporting evidence; on their own they say nothing about the document type.
+_SUPPORTING_ONLY = {"fiscal_years"}
+# With this much text and no real CIM evidence at all, the document is rejected outright.
+_MIN_CHARS_FOR_EMPTY_REJECT = 300
+
+@dataclass
+class Classification:
+    decision: str # "cim", "not_cim" or "ambiguous"
+    score: float
+    signals: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def is_confident(self) -> bool:
+        return self.decision != "ambiguous"
+
+def score_text(text: str) -> Classification:
+    """Scores the leading text of a document. Runs well under a millisecond on the 2000-character pre-screen window."""
+    lowered = text.lower()
+    score = 0.0
+    signals = {}
+    for name, pattern, weight, cap in _SIGNALS:
+        hits = len(pattern.findall(lowered))
+        if hits:
+            signals[name] = hits
+            score += weight * min(hits, cap)
+
+    positive_evidence = any(
+        name not in _SUPPORTING_ONLY and weight > 0
+        for name, _, weight, _ in _SIGNALS if name in signals
+    )
+    if score >= CIM_CLASSIFIER_ACCEPT_SCORE:
+        decision = "cim"
+    elif score <= CIM_CLASSIFIER_REJECT_SCORE:
+        decision = "not_cim"
+    elif not positive_evidence and len(text) >= _MIN_CHARS_FOR_EMPTY_REJECT:
+        decision = "not_cim"
+    else:
+        decision = "ambiguous"
+    return Classification(decision, round(score, 2), signals)
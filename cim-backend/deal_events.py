@@ -0,0 +1,326 @@
+# cim-backend/deal_events.py
+#
+# Push channel for deal status changes. Every transition (queued, Complete, Failed,
+# removed as a non-CIM) is written to the deal_events table in the same transaction
+# as the change itself, and announced with pg_notify, which Postgres delivers only
+# when that transaction commits. Events are inserted at commit time under a
+# transaction-level advisory lock, so ids become visible in id order and
+# "id > Last-Event-ID" never skips an event that committed late. Each API replica runs one listener thread that
+# fans notifications out to its Server-Sent Events subscribers in memory; clients
+# that reconnect with Last-Event-ID are replayed what they missed from the table.
+
+import os
+import json
+import time
+import select
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import event, insert, func, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import models
+from database import engine, SessionLocal
+
+# --- Event Configuration ---
+DEAL_EVENTS_CHANNEL = "deal_events"
+# Comment lines sent on idle streams so proxies and load balancers keep them open.
+DEAL_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("DEAL_EVENTS_HEARTBEAT_SECONDS", "15"))
+# How far back a reconnecting client can resume; older events are purged.
+DEAL_EVENTS_RETENTION_SECONDS = int(os.getenv("DEAL_EVENTS_RETENTION_SECONDS", "604800"))
+# Missed events replayed on resume; beyond this the client gets a "reset" event and should refetch.
+DEAL_EVENTS_REPLAY_LIMIT = int(os.getenv("DEAL_EVENTS_REPLAY_LIMIT", "1000"))
+# Events buffered per slow subscriber before its stream is closed (it resumes from Last-Event-ID).
+DEAL_EVENTS_QUEUE_SIZE = int(os.getenv("DEAL_EVENTS_QUEUE_SIZE", "1000"))
+DEAL_EVENTS_PURGE_INTERVAL_SECONDS = 3600
+# Reconnect delay suggested to EventSource clients.
+DEAL_EVENTS_RETRY_MS = 3000
+
+# --- Producer Side ---
+
+_NOTIFY_MANY = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+# Serializes event inserts from their id assignment to their commit.
+_ORDER_LOCK = text("SELECT pg_advisory_xact_lock(:key)")
+DEAL_EVENTS_LOCK_KEY = 0x6465616C # "deal"
+_PENDING = "deal_events_pending"
+
+def record(db: Session, deal_id: int, status: str, **fields) -> None:
+    """
+    Queues a status event and its notification on the session; both are written when the
+    caller commits, and a rollback discards them, so subscribers never see a transition
+    that did not happen.
+    """
+    record_many(db, [(deal_id, status, fields)])
+
+def record_many(db: Session, events: List[tuple]) -> None:
+    """record() for many (deal_id, status, fields) at once: one INSERT and one NOTIFY round trip at commit."""
+    if not db.in_transaction():
+        db.begin() # so even a rollback() before any other statement ends a transaction and discards these
+    now = datetime.now(timezone.utc)
+    db.info.setdefault(_PENDING, []).extend(
+        {"deal_id": deal_id, "status": status, "data": fields or None, "created_at": now}
+        for deal_id, status, fields in events
+    )
+
+@event.listens_for(SessionLocal, "before_commit")
+def _write_pending(db: Session):
+    """
+    Ids come from a sequence at INSERT, rows show up at COMMIT. Inserting at commit time,
+    under an advisory lock held until the commit ends, makes those two orders agree, however
+    early in its transaction an event was recorded.
+    """
+    rows = db.info.pop(_PENDING, None)
+    if not rows:
+        return
+    db.execute(_ORDER_LOCK, {"key": DEAL_EVENTS_LOCK_KEY})
+    ids = db.scalars(
+        insert(models.DealEvent).returning(models.DealEvent.id, sort_by_parameter_order=True), rows
+    ).all()
+    messages = [to_message(models.DealEvent(id=event_id, **row)) for event_id, row in zip(ids, rows)]
+    db.execute(_NOTIFY_MANY, {"channel": DEAL_EVENTS_CHANNEL,
+                              "payloads": [json.dumps(message) for message in messages]})
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _discard_pending(db: Session, transaction):
+    # Rolled back or closed without a commit: the events never happened.
+    if transaction.parent is None:
+        db.info.pop(_PENDING, None)
+
+def record_deal(db: Session, deal: models.Deal, status: Optional[str] = None, **fields) -> None:
+    """record() with the fields a deal list needs to update a card in place, plus any extra fields."""
+    return record(db, deal.id, status or deal.status, file_name=deal.file_name, user_id=deal.user_id,
+                  company_name=deal.company_name, industry=deal.industry, batch_id=deal.batch_id, **fields)
+
+def to_message(event: models.DealEvent) -> dict:
+    return {"id": event.id, "deal_id": event.deal_id, "status": event.status,
+            "created_at": event.created_at.isoformat(), **(event.data or {})}
+
+def events_since(last_event_id: int, limit: int = DEAL_EVENTS_REPLAY_LIMIT) -> List[dict]:
+    """Events after last_event_id, oldest first, at most limit + 1 (so callers can tell it was cut off)."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(models.DealEvent)
+            .filter(models.DealEvent.id > last_event_id)
+            .order_by(models.DealEvent.id)
+            .limit(limit + 1)
+            .all()
+        )
+        return [to_message(row) for row in rows]
+    finally:
+        db.close()
+
+def latest_event_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(func.max(models.DealEvent.id)).scalar() or 0
+    finally:
+        db.close()
+
+def purge_expired() -> int:
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=DEAL_EVENTS_RETENTION_SECONDS)
+        deleted = db.query(models.DealEvent).filter(models.DealEvent.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+# --- Broker (one per API process) ---
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_queued: int = DEAL_EVENTS_QUEUE_SIZE):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.max_queued = max_queued
+        self.overflowed = False
+
+    def offer(self, message: dict):
+        # Runs on the subscriber's event loop.
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self.max_queued:
+            # Too slow to keep up: end the stream; the client resumes from its Last-Event-ID.
+            self.overflowed = True
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(message)
+
+class EventBroker:
+    """
+    LISTENs on DEAL_EVENTS_CHANNEL from a background thread and hands each notification
+    to every subscriber. The thread starts with the first subscriber. After a lost
+    connection it reconnects and replays the gap from deal_events, so live streams
+    never silently skip an event.
+    """
+    def __init__(self, channel: str = DEAL_EVENTS_CHANNEL):
+        self.channel = channel
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._last_id = None
+        self.delivered = 0
+        self.reconnects = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="deal-events-listener", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def wait_ready(self, timeout: float = 10.0) -> bool:
+        """Blocks until the listener is LISTENing, so events after this call are not missed."""
+        return self._ready.wait(timeout)
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = len(self._subscriptions)
+        return {"subscribers": subscribers, "delivered": self.delivered, "reconnects": self.reconnects,
+                "last_event_id": self._last_id}
+
+    def publish(self, message: dict):
+        """Fans one event out to this process's subscribers. Safe to call from any thread."""
+        if message.get("id") is not None:
+            self._last_id = max(self._last_id or 0, message["id"])
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # The subscriber's event loop is closed.
+                self.unsubscribe(subscription)
+        self.delivered += 1
+
+    def _connect(self):
+        # A dedicated connection, taken out of the pool for good: LISTEN is per session.
+        pooled = engine.raw_connection()
+        connection = pooled.driver_connection
+        pooled.detach()
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _replay_gap(self):
+        """Publishes every event after _last_id, page by page. Subscribers that cannot keep up overflow and resume."""
+        if self._last_id is None:
+            return
+        while True:
+            missed = events_since(self._last_id)
+            for message in missed:
+                self.publish(message)
+            if len(missed) <= DEAL_EVENTS_REPLAY_LIMIT:
+                return
+
+    def _run(self):
+        backoff = 1.0
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                connection = self._connect()
+            except Exception as e:
+                print(f"Deal event listener could not connect: {e}. Retrying in {backoff:.0f}s.")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            try:
+                if self._last_id is None:
+                    # Listening before reading the high-water mark, so no event falls in between.
+                    self._last_id = latest_event_id()
+                else:
+                    self._replay_gap()
+                self._ready.set()
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if time.monotonic() - last_purge > DEAL_EVENTS_PURGE_INTERVAL_SECONDS:
+                        last_purge = time.monotonic()
+                        purge_expired()
+                    if select.select([connection], [], [], DEAL_EVENTS_HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        try:
+                            self.publish(json.loads(notify.payload))
+                        except ValueError:
+                            print(f"Ignoring malformed deal event: {notify.payload!r}")
+            except Exception as e:
+                print(f"Deal event listener lost its connection: {e}. Reconnecting.")
+                self.reconnects += 1
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+# Shared broker for the API process.
+broker = EventBroker()
+
+# --- Server-Sent Events ---
+
+def format_sse(message: dict, event: str = "status") -> str:
+    return f"id: {message['id']}\nevent: {event}\ndata: {json.dumps(message)}\n\n"
+
+def _wanted(message: dict, deal_id: Optional[int], batch_id: Optional[str]) -> bool:
+    if deal_id is not None and message.get("deal_id") != deal_id:
+        return False
+    if batch_id is not None and message.get("batch_id") != batch_id:
+        return False
+    return True
+
+async def stream(is_disconnected, last_event_id: Optional[int] = None, deal_id: Optional[int] = None,
+                 batch_id: Optional[str] = None, event_broker: EventBroker = broker):
+    """
+    Yields an SSE stream: missed events after last_event_id first, then live ones. Subscribing
+    happens before the replay query and replayed ids are not sent twice, so nothing falls in between.
+    """
+    subscription = event_broker.subscribe()
+    try:
+        await run_in_threadpool(event_broker.wait_ready)
+        yield f"retry: {DEAL_EVENTS_RETRY_MS}\n\n"
+        replayed = set()
+        reset_id = 0
+        if last_event_id is not None:
+            missed = await run_in_threadpool(events_since, last_event_id)
+            if len(missed) > DEAL_EVENTS_REPLAY_LIMIT:
+                # Too far behind to catch up event by event; the client should reload its deal list.
+                # The reset carries the newest id, so a reconnect after it resumes from now, not mid-gap.
+                reset_id = await run_in_threadpool(latest_event_id)
+                yield f"id: {reset_id}\nevent: reset\ndata: {{}}\n\n"
+                missed = []
+            for message in missed:
+                replayed.add(message["id"])
+                if _wanted(message, deal_id, batch_id):
+                    yield format_sse(message)
+        while not await is_disconnected():
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), DEAL_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                break
+            if message["id"] in replayed or message["id"] <= reset_id:
+                continue
+            if _wanted(message, deal_id, batch_id):
+                yield format_sse(message)
+    finally:
+        event_broker.unsubscribe(subscription)
@@ -0,0 +1,220 @@
+# cim-backend/derived_financials.py
+#
+# Deterministic post-processing of the analysis JSON. gpt-4o reports only the raw
+# yearly figures it finds (financials.periods); margins, capex as a share of
+# revenue and the historical/projected CAGRs are computed here and written into
+# the financials.actuals / estimates and growth fields the rest of the app reads.
+# When the model also returned one of those derived values and it disagrees with
+# the arithmetic, the computed value wins and the disagreement is flagged.
+#
+# The math is scalar Python, not vectorized: a series is a handful of years, one
+# pass over it costs microseconds, and numpy is not a dependency of this service.
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from financial_metrics import parse_money, parse_percent, parse_year
+
+NA = "N/A"
+# Raw per-period figures the prompt asks for.
+PERIOD_FIELDS = ["revenue", "ebitda", "gross_profit", "gross_margin", "capex", "fcf"]
+# Display fields of financials.actuals / estimates, as financial_metrics and the frontend read them.
+ACTUAL_FIELDS = ["revenue", "year", "ebitda", "margin", "gross_margin", "capex", "capex_pct_revenue", "fcf"]
+ESTIMATE_FIELDS = ["revenue", "year", "ebitda", "fcf", "capex", "capex_pct_revenue"]
+RATIO_FIELDS = ("margin", "gross_margin", "capex_pct_revenue")
+# Raw figures each display field is computed from, for its confidence.
+_DERIVED_FROM = {"revenue": ("revenue",), "ebitda": ("ebitda",), "margin": ("revenue", "ebitda"),
+                 "gross_margin": ("revenue", "gross_profit"), "capex": ("capex",),
+                 "capex_pct_revenue": ("revenue", "capex"), "fcf": ("fcf",)}
+# Percentage points by which a model-reported ratio may differ from ours before it is flagged.
+RATIO_TOLERANCE = 0.5
+_ESTIMATE_TYPES = ("estimate", "projected", "projection", "forecast", "budget", "plan")
+
+@dataclass
+class Period:
+    year: int
+    estimate: bool
+    raw: Dict[str, str] = field(default_factory=dict) # field -> the string the model reported
+    values: Dict[str, float] = field(default_factory=dict) # field -> $M, or percentage points for gross_margin
+
+    def get(self, name: str) -> Optional[float]:
+        return self.values.get(name)
+
+# --- Parsing ---
+
+def _is_estimate(period: dict) -> bool:
+    kind = str(period.get("type") or "").strip().lower()
+    if kind:
+        return kind.startswith(_ESTIMATE_TYPES)
+    year = str(period.get("year") or "").strip().upper()
+    return year.endswith(("E", "P", "F", "B", "PF"))
+
+def _period(entry: dict, estimate: bool) -> Optional[Period]:
+    year = parse_year(entry.get("year"))
+    if year is None:
+        return None
+    period = Period(year=year, estimate=estimate)
+    for name in PERIOD_FIELDS:
+        value = entry.get(name)
+        parsed = parse_percent(value) if name == "gross_margin" else parse_money(value)
+        if parsed is not None:
+            period.raw[name] = str(value).strip()
+            period.values[name] = parsed
+    return period
+
+def periods_from_analysis(analysis: dict) -> List[Period]:
+    """
+    The yearly figures in an analysis, oldest first. Reads financials.periods, or falls back
+    to the single-year actuals/estimates of analyses written before the prompt asked for periods.
+    """
+    financials = analysis.get("financials") if isinstance(analysis.get("financials"), dict) else {}
+    entries = financials.get("periods")
+    periods: Dict[tuple, Period] = {}
+    if isinstance(entries, list) and entries:
+        candidates = [(entry, _is_estimate(entry)) for entry in entries if isinstance(entry, dict)]
+    else:
+        candidates = [(financials.get(section), section == "estimates") for section in ("actuals", "estimates")
+                      if isinstance(financials.get(section), dict)]
+    for entry, estimate in candidates:
+        period = _period(entry, estimate)
+        if period is None:
+            continue
+        # The same year reported twice: keep the first, fill its gaps from the repeat.
+        existing = periods.setdefault((period.year, period.estimate), period)
+        if existing is not period:
+            for name, value in period.values.items():
+                existing.values.setdefault(name, value)
+                existing.raw.setdefault(name, period.raw[name])
+    return sorted(periods.values(), key=lambda p: (p.year, p.estimate))
+
+def period_dicts(periods: List[Period]) -> List[dict]:
+    """Periods back in the prompt's JSON shape, for storage."""
+    return [{"year": str(p.year), "type": "estimate" if p.estimate else "actual",
+             **{name: p.raw.get(name, NA) for name in PERIOD_FIELDS}} for p in periods]
+
+# --- Math ---
+
+def cagr(start_value: float, end_value: float, years: int) -> Optional[float]:
+    """Compound annual growth rate in percentage points; None when undefined (non-positive base, no span)."""
+    if years <= 0 or start_value is None or end_value is None or start_value <= 0 or end_value < 0:
+        return None
+    return ((end_value / start_value) ** (1 / years) - 1) * 100
+
+def ratio(numerator: Optional[float], denominator: Optional[float]) -> Optional[float]:
+    if numerator is None or denominator is None or denominator <= 0:
+        return None
+    return numerator / denominator * 100
+
+def format_percent(value: Optional[float]) -> str:
+    return NA if value is None else f"{value:.1f}%"
+
+def _series_cagr(periods: List[Period], name: str) -> Optional[str]:
+    points = [p for p in periods if p.get(name) is not None]
+    if len(points) < 2:
+        return None
+    first, last = points[0], points[-1]
+    rate = cagr(first.get(name), last.get(name), last.year - first.year)
+    return None if rate is None else f"{rate:.1f}% ({first.year}–{last.year})"
+
+# --- Derivation ---
+
+def _period_summary(period: Optional[Period], fields: List[str]) -> Dict[str, str]:
+    if period is None:
+        return {name: NA for name in fields}
+    revenue = period.get("revenue")
+    gross_margin = period.get("gross_margin")
+    if period.get("gross_profit") is not None:
+        gross_margin = ratio(period.get("gross_profit"), revenue)
+    computed = {
+        "year": str(period.year),
+        "revenue": period.raw.get("revenue", NA),
+        "ebitda": period.raw.get("ebitda", NA),
+        "margin": format_percent(ratio(period.get("ebitda"), revenue)),
+        "gross_margin": format_percent(gross_margin),
+        "capex": period.raw.get("capex", NA),
+        "capex_pct_revenue": format_percent(ratio(period.get("capex"), revenue)),
+        "fcf": period.raw.get("fcf", NA),
+    }
+    return {name: computed[name] for name in fields}
+
+def _check(model_value, computed: str, label: str, flags: List[str]):
+    """Flags a model-reported ratio the arithmetic does not support."""
+    reported, ours = parse_percent(model_value), parse_percent(computed)
+    if reported is None or ours is None:
+        return
+    if abs(reported - ours) > RATIO_TOLERANCE:
+        flags.append(f"{label}: model reported {model_value}, computed {computed} from the stated figures")
+
+def _confidence(analysis: dict, *names: str) -> int:
+    """Confidence of a derived value: the weakest of the raw figures it comes from."""
+    raw = ((analysis.get("confidence_breakdown") or {}).get("financials") or {})
+    scores = []
+    for name in names:
+        try:
+            scores.append(int(round(float(raw.get(name)))))
+        except (TypeError, ValueError):
+            scores.append(0)
+    return min(scores) if scores else 0
+
+def derive_financials(analysis: dict) -> dict:
+    """
+    Returns the analysis with financials.actuals/estimates, growth CAGRs and their
+    confidences computed from financials.periods. Older single-year analyses (no
+    periods) only get their ratios recomputed; their CAGRs are left as reported.
+    """
+    if not isinstance(analysis, dict) or "error" in analysis:
+        return analysis
+    periods = periods_from_analysis(analysis)
+    if not periods:
+        return analysis
+
+    actuals = [p for p in periods if not p.estimate]
+    latest_actual = actuals[-1] if actuals else None
+    estimates = [p for p in periods if p.estimate and (latest_actual is None or p.year > latest_actual.year)]
+    next_estimate = estimates[0] if estimates else None
+
+    financials = dict(analysis.get("financials") or {})
+    legacy = not (isinstance(financials.get("periods"), list) and financials["periods"])
+    previous = {section: financials.get(section) if isinstance(financials.get(section), dict) else {}
+                for section in ("actuals", "estimates")}
+    computed = {"actuals": _period_summary(latest_actual, ACTUAL_FIELDS),
+                "estimates": _period_summary(next_estimate, ESTIMATE_FIELDS)}
+    flags: List[str] = []
+    for section, summary in computed.items():
+        for name in RATIO_FIELDS:
+            if name in summary:
+                _check(previous[section].get(name), summary[name], f"{section}.{name}", flags)
+        if legacy:
+            # Keep the reported figures; only ratios we can recompute are replaced.
+            summary = {**previous[section], **{name: summary[name] for name in RATIO_FIELDS
+                                               if summary.get(name, NA) != NA}}
+        financials[section] = summary
+    if not legacy:
+        financials["periods"] = period_dicts(periods)
+
+    result = dict(analysis)
+    result["financials"] = financials
+    if not legacy:
+        # Projected growth runs from the last actual year (the usual "2023A–2028E" convention).
+        projected = ([latest_actual] if latest_actual else []) + estimates
+        growth = dict(analysis["growth"]) if isinstance(analysis.get("growth"), dict) else {}
+        for key, series, name in (("historical_revenue_cagr", actuals, "revenue"),
+                                  ("projected_revenue_cagr", projected, "revenue"),
+                                  ("historical_fcf_cagr", actuals, "fcf"),
+                                  ("projected_fcf_cagr", projected, "fcf")):
+            value = _series_cagr(series, name)
+            if value is not None:
+                _check(growth.get(key), value, f"growth.{key}", flags)
+            growth[key] = value or NA
+        growth.setdefault("growth_commentary", NA)
+        result["growth"] = growth
+
+        breakdown = dict(analysis.get("confidence_breakdown") or {})
+        breakdown["financials"] = {
+            section: {name: _confidence(analysis, *_DERIVED_FROM[name]) for name in fields if name != "year"}
+            for section, fields in (("actuals", ACTUAL_FIELDS), ("estimates", ESTIMATE_FIELDS))
+        }
+        result["confidence_breakdown"] = breakdown
+    if flags:
+        result["low_confidence_flags"] = list(analysis.get("low_confidence_flags") or []) + flags
+    return result
@@ -0,0 +1,117 @@
+# cim-backend/financial_metrics.py
+#
+# Parses the display strings in analysis_data["financials"] and ["growth"]
+# ("$39.9M", "9.6%", "1.2% (2021–2023)", "N/A") into numbers for the typed
+# deal_metrics table. Money is stored in millions of dollars, percentages in
+# percentage points, and anything unparseable becomes None rather than a guess.
+
+import re
+from typing import Any, Optional
+
+_NUMBER = r"\d[\d,]*(?:\.\d+)?|\.\d+"
+_MONEY = re.compile(
+    r"(?P<neg>[-−–(])?\s*(?P<cur>US\$|USD|\$)?\s*(?P<neg2>[-−])?\s*(?P<num>" + _NUMBER + r")"
+    r"(?:\s*(?:[-−–]|to)\s*\$?\s*(?P<num2>" + _NUMBER + r"))?"
+    r"\s*(?P<unit>billion|bn|b|million|mm|mn|m|thousand|k)?\b",
+    re.IGNORECASE,
+)
+# Valuation and leverage multiples ("1.5x", "12.0× EBITDA") are never money amounts.
+_MULTIPLE = re.compile(r"(?:" + _NUMBER + r")\s*[x×](?![a-z])", re.IGNORECASE)
+_PERCENT = re.compile(r"(?P<neg>[-−–(])?\s*(?P<num>" + _NUMBER + r")\s*(?P<pct>%)?")
+_YEAR = re.compile(r"(?<!\d)((?:19|20)\d{2})(?!\d)|\bFY\s?'?(\d{2})(?!\d)", re.IGNORECASE)
+_UNIT_TO_MILLIONS = {"b": 1000.0, "bn": 1000.0, "billion": 1000.0, "m": 1.0, "mm": 1.0, "mn": 1.0,
+                     "million": 1.0, "k": 0.001, "thousand": 0.001}
+_MISSING = {"", "n/a", "na", "n.a.", "none", "null", "-", "--", "not disclosed", "not available", "not stated"}
+# Bare numbers at or above this are taken as whole dollars rather than millions.
+_WHOLE_DOLLAR_THRESHOLD = 100000
+
+def _missing(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and value.strip().lower().rstrip(".") in _MISSING)
+
+def _to_float(text: str) -> float:
+    return float(text.replace(",", ""))
+
+def parse_money(value: Any) -> Optional[float]:
+    """
+    '$39.9M' -> 39.9, '$1.2B' -> 1200.0, '$850K' -> 0.85, '($1.2M)' -> -1.2, '$4-5M' -> 4.5 (millions).
+    Multiples are skipped: '1.5x' -> None, '$2.1M (1.5x)' -> 2.1.
+    """
+    if isinstance(value, bool) or _missing(value):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    matches = list(_MONEY.finditer(_MULTIPLE.sub(" ", str(value))))
+    if not matches:
+        return None
+    # Prefer an amount marked with a currency or unit over stray numbers such as years.
+    match = (next((m for m in matches if m.group("cur") or m.group("unit")), None)
+             or next((m for m in matches if not _YEAR.fullmatch(m.group("num"))), matches[0]))
+    amount = _to_float(match.group("num"))
+    if match.group("num2"):
+        amount = (amount + _to_float(match.group("num2"))) / 2
+    unit = (match.group("unit") or "").lower()
+    if unit:
+        amount *= _UNIT_TO_MILLIONS[unit]
+    elif amount >= _WHOLE_DOLLAR_THRESHOLD:
+        amount /= 1_000_000
+    if match.group("neg") in ("-", "−", "(") or match.group("neg2"):
+        amount = -amount
+    return round(amount, 6)
+
+def parse_percent(value: Any) -> Optional[float]:
+    """'9.6%' -> 9.6, '-3.4% (2023–2024)' -> -3.4, '(2.0%)' -> -2.0."""
+    if isinstance(value, bool) or _missing(value):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    matches = list(_PERCENT.finditer(str(value)))
+    if not matches:
+        return None
+    match = (next((m for m in matches if m.group("pct")), None)
+             or next((m for m in matches if not _YEAR.fullmatch(m.group("num"))), matches[0]))
+    amount = _to_float(match.group("num"))
+    return -amount if match.group("neg") in ("-", "−", "(") else amount
+
+def parse_year(value: Any) -> Optional[int]:
+    """'2023', 'FY2023', '2024E', "FY'24" -> the first fiscal year mentioned."""
+    if isinstance(value, bool) or _missing(value):
+        return None
+    if isinstance(value, int):
+        return value if 1900 <= value <= 2099 else None
+    match = _YEAR.search(str(value))
+    if not match:
+        return None
+    return int(match.group(1)) if match.group(1) else 2000 + int(match.group(2))
+
+def _section(data: Any, *path: str) -> dict:
+    for key in path:
+        data = data.get(key) if isinstance(data, dict) else None
+    return data if isinstance(data, dict) else {}
+
+def metrics_from_analysis(analysis_data: Any) -> dict:
+    """Column values for a DealMetrics row, from one analysis JSON."""
+    actuals = _section(analysis_data, "financials", "actuals")
+    estimates = _section(analysis_data, "financials", "estimates")
+    growth = _section(analysis_data, "growth")
+    return {
+        "year": parse_year(actuals.get("year")),
+        "revenue": parse_money(actuals.get("revenue")),
+        "ebitda": parse_money(actuals.get("ebitda")),
+        "ebitda_margin": parse_percent(actuals.get("margin")),
+        "gross_margin": parse_percent(actuals.get("gross_margin")),
+        "capex": parse_money(actuals.get("capex")),
+        "capex_pct_revenue": parse_percent(actuals.get("capex_pct_revenue")),
+        "fcf": parse_money(actuals.get("fcf")),
+        "estimate_year": parse_year(estimates.get("year")),
+        "estimate_revenue": parse_money(estimates.get("revenue")),
+        "estimate_ebitda": parse_money(estimates.get("ebitda")),
+        "estimate_capex": parse_money(estimates.get("capex")),
+        "estimate_fcf": parse_money(estimates.get("fcf")),
+        "historical_revenue_cagr": parse_percent(growth.get("historical_revenue_cagr")),
+        "projected_revenue_cagr": parse_percent(growth.get("projected_revenue_cagr")),
+        "historical_fcf_cagr": parse_percent(growth.get("historical_fcf_cagr")),
+        "projected_fcf_cagr": parse_percent(growth.get("projected_fcf_cagr")),
+    }
+
+# Screenable columns, in the order the API documents them.
+METRIC_FIELDS = list(metrics_from_analysis({}).keys())
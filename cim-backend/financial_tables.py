@@ -0,0 +1,375 @@
+# cim-backend/financial_tables.py
+#
+# Table-aware extraction of the financial summary tables in a CIM. Plain text
+# extraction flattens a table into one cell per line, leaving gpt-4o to rebuild
+# rows and columns. Here MuPDF's table detection (page.find_tables) runs on the
+# pages that look financial; tables with fiscal-year columns and revenue, EBITDA
+# or capex rows are rewritten as compact " | "-separated rows in place of their
+# flattened text, and figures that are unambiguous (one row per line item, known
+# units, a marked actual/estimate year) are written into financials.periods
+# directly, overriding what the model read from the text.
+
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import fitz # PyMuPDF
+
+import derived_financials
+from derived_financials import Period
+from financial_metrics import parse_money, parse_percent
+
+# --- Table Configuration ---
+# "on" detects financial tables before analysis, "off" sends the extracted text as is.
+FINANCIAL_TABLES = os.getenv("FINANCIAL_TABLES", "on")
+# Table detection costs tens of milliseconds a page, so only this many candidate pages are searched.
+FINANCIAL_TABLE_MAX_PAGES = int(os.getenv("FINANCIAL_TABLE_MAX_PAGES", "30"))
+# Confidence given to a raw figure filled from a table.
+FINANCIAL_TABLE_CONFIDENCE = 95
+# Relative difference between two readings of one figure still treated as agreement.
+FIGURE_TOLERANCE = 0.005
+# The model rounds to one decimal of $M; differences beyond that, or this share, are flagged.
+MODEL_TOLERANCE = 0.02
+# Points above a table searched for its units line ("($ in thousands)").
+_UNITS_BAND = 60
+
+# --- Patterns ---
+_CANDIDATE_TERMS = re.compile(r"revenue|net sales|ebitda|capex|capital expenditure", re.IGNORECASE)
+_YEAR_TOKEN = re.compile(r"(?<!\d)(?:19|20)\d{2}(?!\d)|\b(?:FY|CY)\s?'?\d{2}\b", re.IGNORECASE)
+_YEAR_CELL = re.compile(
+    r"^(?:(?P<prefix>FY|CY|')\s?)?(?P<year>(?:19|20)\d{2}|\d{2})\s?(?P<mark>A|E|P|F|B|PF|Act|Est)?"
+    r"(?:\s+(?P<word>actual|estimated?|projected|projection|forecast|budget|plan))?$",
+    re.IGNORECASE,
+)
+_ESTIMATE_MARKS = ("e", "p", "f", "b", "pf", "est", "estimate", "estimated", "projected", "projection",
+                   "forecast", "budget", "plan")
+_FOOTNOTE = re.compile(r"\s*(?:\(\d{1,2}\)|\[\d{1,2}\]|\*+|\d(?=$))\s*$")
+# Line items that can fill a raw figure. Labels are matched whole, so "Revenue growth" or
+# "% of revenue" never count as revenue, and segment rows ("Services revenue") are left out.
+_LABELS = {
+    "revenue": re.compile(r"^(?:total |net |total net )?(?:revenues?|sales)$"),
+    "gross_profit": re.compile(r"^(?:total )?gross profit$"),
+    "gross_margin": re.compile(r"^(?:% )?gross (?:profit )?margin(?: %| \(%\))?$"),
+    "ebitda": re.compile(r"^(?:adj(?:usted|\.)? |pro forma |reported )?ebitda$"),
+    "capex": re.compile(r"^(?:total )?(?:capex|cap ex|capital expenditures?)$"),
+    "fcf": re.compile(r"^(?:unlevered |levered )?(?:free cash flow|fcf)$"),
+}
+# A table counts as financial when it has one of these line items.
+_KEY_FIELDS = ("revenue", "ebitda", "capex")
+_THOUSANDS = re.compile(r"in thousands|\$\s?(?:in\s)?(?:'?000s?|thousands)|\(\s?\$?\s?'?000s?\s?\)|\(\s?\$\s?k\s?\)", re.IGNORECASE)
+_MILLIONS = re.compile(r"in millions|\$\s?(?:in\s)?millions|\(\s?\$\s?m{1,2}\s?\)|\$\s?mm\b", re.IGNORECASE)
+# A word that reads as a figure or fiscal year: "35,512", "(1,100)", "$4.2M", "9.5%", "FY2024E", "3.1x".
+_NUMERIC_WORD = re.compile(r"^(?:FY|CY)?[(\-−$']*\d[\d,.]*[)%xMKBAEPF]*$|^[-–—]$", re.IGNORECASE)
+# Points by which words of one table row may sit above or below each other.
+_ROW_TOLERANCE = 3
+# Words other than years a header row may carry ("($ in thousands)", "Fiscal Year Ending").
+_MAX_HEADER_WORDS = 8
+_VALUE_CELL = re.compile(r"^(?:[-−(]?\s?\$?\s?\d[\d,]*(?:\.\d+)?\s?(?:%|x|[mkb]|mm|bn)?\s?\)?|[-–—]|n/?a|nm)$", re.IGNORECASE)
+_BARE_NUMBER = re.compile(r"^(?P<neg>[-−(])?\s?\$?\s?(?P<num>\d[\d,]*(?:\.\d+)?)\s?\)?$")
+
+@dataclass
+class Figure:
+    year: int
+    estimate: bool
+    field: str
+    value: float # $M, or percentage points for gross_margin
+    text: str
+    page: int # one-based, as shown to readers
+
+@dataclass
+class FinancialTable:
+    page: int # one-based
+    bbox: tuple
+    units: str
+    columns: List[str]
+    rows: List[List[str]]
+    figures: List[Figure] = field(default_factory=list)
+
+    def render(self) -> str:
+        lines = [f"[Financial table, page {self.page}, {self.units}]", " | ".join(["Line item"] + self.columns)]
+        lines += [" | ".join(cell or "-" for cell in row) for row in self.rows]
+        return "\n".join(lines)
+
+@dataclass
+class TableExtraction:
+    pages: List[str] # page texts, financial tables rewritten as rows
+    tables: List[FinancialTable] = field(default_factory=list)
+    figures: List[Figure] = field(default_factory=list) # unambiguous figures across all tables
+    pages_searched: int = 0
+
+# --- Cell Parsing ---
+
+def _clean(cell) -> str:
+    return re.sub(r"\s+", " ", str(cell or "")).strip()
+
+def _label_field(label: str) -> Optional[str]:
+    label = _FOOTNOTE.sub("", label.lower()).rstrip(":").strip()
+    return next((name for name, pattern in _LABELS.items() if pattern.match(label)), None)
+
+def _year_column(cell: str) -> Optional[tuple]:
+    """'FY2023A' -> (2023, False, True), '2024E' -> (2024, True, True), '2022' -> (2022, False, False)."""
+    match = _YEAR_CELL.match(cell.replace("(", " ").replace(")", "").strip())
+    if not match:
+        return None
+    year = match.group("year")
+    mark = (match.group("mark") or match.group("word") or "").lower()
+    if len(year) == 2:
+        if not (match.group("prefix") or mark):
+            return None
+        year = "20" + year
+    marked = bool(mark)
+    if not marked:
+        # Unmarked columns are taken as actuals only for years already over.
+        return int(year), int(year) >= datetime.now().year, False
+    return int(year), mark.startswith(_ESTIMATE_MARKS), True
+
+def _units(text: str) -> Optional[float]:
+    """Multiplier from the stated units to millions of dollars."""
+    if _THOUSANDS.search(text):
+        return 0.001
+    if _MILLIONS.search(text):
+        return 1.0
+    return None
+
+def _money(cell: str, scale: Optional[float]) -> Optional[float]:
+    """A money cell in $M: explicit units win ("$35.5M"), bare numbers take the table's units."""
+    if not cell or "%" in cell or cell.lower().endswith("x"):
+        return None
+    match = _BARE_NUMBER.match(cell)
+    if match is None:
+        return parse_money(cell) if re.search(r"\d\s?(?:[mkb]|mm|bn)\b", cell, re.IGNORECASE) else None
+    if scale is None:
+        return None
+    value = float(match.group("num").replace(",", "")) * scale
+    return -value if match.group("neg") else value
+
+def _is_ratio_row(row: List[str]) -> bool:
+    """Growth and margin rows ("% growth", "% margin") repeat what derived_financials computes."""
+    values = [cell for cell in row[1:] if cell and cell not in ("-", "–", "—")]
+    return bool(values) and all(cell.endswith(("%", "x")) for cell in values)
+
+def _format_millions(value: float) -> str:
+    text = f"{abs(value):,.2f}".rstrip("0").rstrip(".")
+    return f"{'-' if value < 0 else ''}${text}M"
+
+# --- Table Reading ---
+
+def _read_table(page: fitz.Page, table, page_number: int) -> Optional[FinancialTable]:
+    rows = [[_clean(cell) for cell in row] for row in table.extract()]
+    rows = [row for row in rows if any(row)]
+    header_index, years = None, {}
+    for i, row in enumerate(rows[:3]):
+        found = {c: _year_column(cell) for c, cell in enumerate(row) if c > 0 and cell}
+        found = {c: year for c, year in found.items() if year}
+        if len(found) >= 2:
+            header_index, years = i, found
+            break
+    if header_index is None:
+        return None
+
+    body = [row for row in rows[header_index + 1:] if row[0]]
+    labels = [_label_field(row[0]) for row in body]
+    if not any(name in _KEY_FIELDS for name in labels):
+        return None
+    # Split or merged cells ("17" | ".4 21.") mean the columns were misread; leave the text alone.
+    for row, name in zip(body, labels):
+        if name and not all(_VALUE_CELL.match(row[c]) for c in years if c < len(row) and row[c]):
+            return None
+
+    y0 = table.bbox[1]
+    above = page.get_text(clip=fitz.Rect(0, max(0, y0 - _UNITS_BAND), page.rect.width, y0))
+    header_text = " ".join(" ".join(row) for row in rows[:header_index + 1])
+    scale = _units(header_text) or _units(above)
+    units = {0.001: "$ in thousands", 1.0: "$ in millions"}.get(scale, "units as shown")
+
+    columns = sorted(years)
+    result = FinancialTable(
+        page=page_number, bbox=tuple(table.bbox), units=units,
+        columns=[rows[header_index][c] for c in columns],
+        rows=[[row[0]] + [row[c] if c < len(row) else "" for c in columns]
+              for row, name in zip(body, labels) if name or not _is_ratio_row(row)],
+    )
+
+    # A line item stated twice in one table (segments, reported and adjusted) is ambiguous...
+    rows_by_field: Dict[str, List[List[str]]] = {}
+    for row, name in zip(body, labels):
+        if name:
+            rows_by_field.setdefault(name, []).append(row)
+    for name, matches in rows_by_field.items():
+        if name == "ebitda" and len(matches) > 1:
+            # ...except EBITDA, where the adjusted figure is the one CIMs are read on.
+            matches = [row for row in matches if row[0].lower().startswith("adj")]
+        if len(matches) != 1:
+            continue
+        row = matches[0]
+        for c in columns:
+            year, estimate, marked = years[c]
+            cell = row[c] if c < len(row) else ""
+            if not marked and estimate:
+                continue
+            if name == "gross_margin":
+                value = parse_percent(cell) if "%" in cell else None
+            else:
+                value = _money(cell, scale)
+            if value is None:
+                continue
+            if name == "capex":
+                value = abs(value) # shown as an outflow in most tables
+            text = f"{value:.1f}%" if name == "gross_margin" else _format_millions(value)
+            result.figures.append(Figure(year, estimate, name, value, text, page_number))
+    return result
+
+def _word_rows(page: fitz.Page) -> List[List[tuple]]:
+    """The page's words grouped into visual rows, top to bottom."""
+    rows: List[List[tuple]] = []
+    for word in sorted(page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        center = (word[1] + word[3]) / 2
+        if rows and abs(center - (rows[-1][0][1] + rows[-1][0][3]) / 2) <= _ROW_TOLERANCE:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    return rows
+
+def _table_regions(page: fitz.Page) -> List[fitz.Rect]:
+    """
+    Areas that may hold a financial table: a row with two or more fiscal years, and the
+    rows under it with two or more figures each (one short sub-heading may interrupt them).
+    Table detection then runs on just these areas, which keeps it fast and keeps prose out.
+    """
+    rows = _word_rows(page)
+    regions = []
+    i = 0
+    while i < len(rows):
+        text = " ".join(w[4] for w in rows[i])
+        words = [w[4] for w in rows[i]]
+        if len(_YEAR_TOKEN.findall(text)) < 2 or sum(not _NUMERIC_WORD.match(w) for w in words) > _MAX_HEADER_WORDS:
+            i += 1
+            continue
+        last = i
+        j = i + 1
+        while j < len(rows):
+            if sum(bool(_NUMERIC_WORD.match(w[4])) for w in rows[j]) >= 2:
+                last = j
+            elif not (len(rows[j]) <= 4 and j + 1 < len(rows)
+                      and sum(bool(_NUMERIC_WORD.match(w[4])) for w in rows[j + 1]) >= 2):
+                break
+            j += 1
+        if last > i:
+            top = min(w[1] for w in rows[i]) - 2
+            bottom = max(w[3] for w in rows[last]) + 2
+            regions.append(fitz.Rect(page.rect.x0, top, page.rect.x1, bottom))
+        i = max(j, i + 1)
+    return regions
+
+def _find_tables(page: fitz.Page, page_number: int) -> List[FinancialTable]:
+    """Ruled tables first; CIM tables are often drawn without lines, so fall back to text alignment."""
+    found = []
+    for region in _table_regions(page):
+        for strategy in ("lines", "text"):
+            tables = [_read_table(page, table, page_number)
+                      for table in page.find_tables(clip=region, strategy=strategy).tables]
+            tables = [table for table in tables if table is not None]
+            if tables:
+                found += tables
+                break
+    return found
+
+def _rewrite_page(page: fitz.Page, tables: List[FinancialTable]) -> str:
+    """The page text with each table's lines replaced by its compact rows, where the table stood."""
+    rects = [fitz.Rect(table.bbox) for table in tables]
+    out, placed = [], set()
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"])
+            x0, y0, x1, y1 = line["bbox"]
+            center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+            inside = next((i for i, rect in enumerate(rects) if center in rect), None)
+            if inside is None:
+                out.append(text)
+            elif inside not in placed:
+                placed.add(inside)
+                out.append(tables[inside].render())
+    out += [table.render() for i, table in enumerate(tables) if i not in placed]
+    return "\n".join(out) + "\n"
+
+def _is_candidate(text: str) -> bool:
+    return bool(_CANDIDATE_TERMS.search(text)) and len(_YEAR_TOKEN.findall(text)) >= 2
+
+def _agreed_figures(tables: List[FinancialTable]) -> List[Figure]:
+    """Figures every table that states them agrees on; a figure read two ways is left to the model."""
+    by_key: Dict[tuple, List[Figure]] = {}
+    for table in tables:
+        for figure in table.figures:
+            by_key.setdefault((figure.year, figure.estimate, figure.field), []).append(figure)
+    agreed = []
+    for figures in by_key.values():
+        first = figures[0]
+        if all(abs(f.value - first.value) <= FIGURE_TOLERANCE * max(abs(first.value), 1e-9) for f in figures):
+            agreed.append(first)
+    return agreed
+
+# --- Entry Points ---
+
+def extract_financial_tables(path: str, pages: Sequence[str]) -> TableExtraction:
+    """
+    Finds the financial tables of the PDF at `path`, given its already extracted page
+    texts (one per page). Returns the page texts with those tables rewritten as rows,
+    plus the figures they state unambiguously.
+    """
+    result = TableExtraction(pages=list(pages))
+    if FINANCIAL_TABLES == "off":
+        return result
+    candidates = [i for i, text in enumerate(pages) if _is_candidate(text)][:FINANCIAL_TABLE_MAX_PAGES]
+    if not candidates:
+        return result
+    with fitz.open(path, filetype="pdf") as doc:
+        if doc.page_count != len(pages):
+            return result
+        for i in candidates:
+            page = doc[i]
+            tables = _find_tables(page, i + 1)
+            if tables:
+                result.pages[i] = _rewrite_page(page, tables)
+                result.tables += tables
+        result.pages_searched = len(candidates)
+    result.figures = _agreed_figures(result.tables)
+    return result
+
+def fill_periods(analysis: dict, figures: List[Figure]) -> dict:
+    """
+    Writes table figures into financials.periods, over what the model reported.
+    Disagreements are added to low_confidence_flags so a reviewer can check them.
+    """
+    if not figures or not isinstance(analysis, dict) or "error" in analysis:
+        return analysis
+    periods = {(p.year, p.estimate): p for p in derived_financials.periods_from_analysis(analysis)}
+    flags = []
+    for figure in figures:
+        period = periods.setdefault((figure.year, figure.estimate), Period(year=figure.year, estimate=figure.estimate))
+        reported = period.get(figure.field)
+        if reported is not None and abs(reported - figure.value) > max(MODEL_TOLERANCE * abs(figure.value), 0.05):
+            flags.append(f"{figure.year} {figure.field}: model reported {period.raw[figure.field]}, "
+                         f"the table on page {figure.page} shows {figure.text}; used the table")
+        period.values[figure.field] = figure.value
+        period.raw[figure.field] = figure.text
+
+    result = dict(analysis)
+    financials = dict(result.get("financials") or {})
+    financials["periods"] = derived_financials.period_dicts(sorted(periods.values(), key=lambda p: (p.year, p.estimate)))
+    result["financials"] = financials
+    breakdown = dict(result.get("confidence_breakdown") or {})
+    confidence = dict(breakdown.get("financials") or {})
+    for name in {figure.field for figure in figures}:
+        key = "gross_profit" if name == "gross_margin" else name
+        try:
+            current = float(confidence.get(key))
+        except (TypeError, ValueError):
+            current = 0
+        confidence[key] = max(current, FINANCIAL_TABLE_CONFIDENCE)
+    breakdown["financials"] = confidence
+    result["confidence_breakdown"] = breakdown
+    if flags:
+        result["low_confidence_flags"] = list(analysis.get("low_confidence_flags") or []) + flags
+    return result
@@ -0,0 +1,117 @@
+# cim-backend/idempotency.py
+#
+# Deduplication store for webhook deliveries, backed by the idempotency_keys
+# table. A key is claimed with INSERT ... ON CONFLICT DO NOTHING, so exactly one
+# request wins even across API processes; later deliveries get the winner's
+# stored result instead of re-processing. Keys expire after a TTL and are purged
+# in the background of normal traffic.
+
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import models
+
+# --- Idempotency Configuration ---
+# How long an email (Message-Id) or attachment hash is remembered. Mailgun retries for up to 8 hours.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A claim still "processing" after this long belongs to a crashed request and can be taken over.
+IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS = int(os.getenv("IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS", "600"))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "300"))
+
+_last_purge = 0.0
+
+@dataclass
+class Claim:
+    acquired: bool # True: the caller owns the key and must finish() or release() it
+    record_id: Optional[int] = None
+    status: Optional[str] = None # the existing record's status when not acquired
+    result: Optional[dict] = None
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def claim(db: Session, scope: str, key: str, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS) -> Claim:
+    """Atomically claims (scope, key), or reports the delivery that already holds it. Commits."""
+    now = _now()
+    statement = (
+        insert(models.IdempotencyKey)
+        .values(scope=scope, key=key, status="processing", created_at=now,
+                expires_at=now + timedelta(seconds=ttl_seconds))
+        .on_conflict_do_nothing(constraint="uq_idempotency_keys_scope_key")
+        .returning(models.IdempotencyKey.id)
+    )
+    record_id = db.execute(statement).scalar()
+    if record_id is not None:
+        db.commit()
+        return Claim(acquired=True, record_id=record_id)
+
+    existing = (
+        db.query(models.IdempotencyKey)
+        .filter(models.IdempotencyKey.scope == scope, models.IdempotencyKey.key == key)
+        .with_for_update()
+        .first()
+    )
+    if existing is None:
+        # Released between our insert and select; try again.
+        db.rollback()
+        return claim(db, scope, key, ttl_seconds)
+    stale = existing.status == "processing" and existing.created_at < now - timedelta(seconds=IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS)
+    if existing.expires_at <= now or stale:
+        # Expired but not purged yet, or abandoned by a crashed request: take it over.
+        existing.status = "processing"
+        existing.result = None
+        existing.created_at = now
+        existing.expires_at = now + timedelta(seconds=ttl_seconds)
+        db.commit()
+        return Claim(acquired=True, record_id=existing.id)
+    found = Claim(acquired=False, record_id=existing.id, status=existing.status, result=existing.result)
+    db.commit()
+    return found
+
+def take_over(db: Session, record_id: int, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS) -> Claim:
+    """
+    Re-claims a finished key whose result no longer holds (e.g. its deal was deleted). Only
+    one caller wins; the others see the key as processing. Commits.
+    """
+    now = _now()
+    updated = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.id == record_id, models.IdempotencyKey.status == "done"
+    ).update({"status": "processing", "result": None, "created_at": now,
+              "expires_at": now + timedelta(seconds=ttl_seconds)}, synchronize_session=False)
+    db.commit()
+    if updated:
+        return Claim(acquired=True, record_id=record_id)
+    return Claim(acquired=False, record_id=record_id, status="processing")
+
+def finish(db: Session, results: dict):
+    """Marks claims done, storing {record_id: result} for later deliveries to replay. Commits."""
+    for record_id, result in results.items():
+        if record_id is None:
+            continue
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.id == record_id).update(
+            {"status": "done", "result": result}, synchronize_session=False
+        )
+    db.commit()
+
+def release(db: Session, record_ids: Iterable[Optional[int]]):
+    """Drops claims after a failure so the sender's retry is processed normally. Commits."""
+    ids = [record_id for record_id in record_ids if record_id is not None]
+    if ids:
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+
+def purge_expired(db: Session, force: bool = False) -> int:
+    """Deletes expired keys, at most once per IDEMPOTENCY_PURGE_INTERVAL_SECONDS per process. Commits."""
+    global _last_purge
+    if not force and time.monotonic() - _last_purge < IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+        return 0
+    _last_purge = time.monotonic()
+    deleted = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at <= _now()).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -0,0 +1,80 @@
+# cim-backend/industry_index.py
+#
+# Local BM25 index over the IBIS industry names and their synonyms. It shortlists
+# the candidate industries for a document so the analysis prompt carries a few
+# dozen names instead of the whole catalog. The index is built once, at import.
+
+import os
+import re
+import math
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence
+
+from industry_list import IBIS_INDUSTRIES, IBIS_SYNONYMS
+
+# --- Shortlist Configuration ---
+INDUSTRY_SHORTLIST_SIZE = int(os.getenv("INDUSTRY_SHORTLIST_SIZE", "15"))
+# Standard BM25 parameters; industry "documents" are a handful of terms, so length normalization is mild.
+BM25_K1 = 1.2
+BM25_B = 0.5
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"and", "the", "of", "for", "in", "on", "to", "a", "an", "or", "with", "by", "at", "as"}
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased words with a light plural strip, plus adjacent-word bigrams ("real estate")."""
+    words = []
+    for word in _TOKEN.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class IndustryIndex:
+    """Inverted BM25 index where each industry (name + synonyms) is a document and the CIM text is the query."""
+    def __init__(self, industries: Sequence[str], synonyms: Dict[str, List[str]]):
+        self.industries = list(industries)
+        self._postings: Dict[str, List[tuple]] = defaultdict(list) # term -> [(industry index, term weight)]
+        documents = []
+        for name in self.industries:
+            # The name counts twice so it outweighs any single synonym.
+            terms = tokenize(name) * 2
+            for synonym in synonyms.get(name, []):
+                terms += tokenize(synonym)
+            documents.append(Counter(terms))
+        average_length = sum(sum(doc.values()) for doc in documents) / max(len(documents), 1)
+        document_frequency = Counter(term for doc in documents for term in doc)
+        for i, doc in enumerate(documents):
+            length = sum(doc.values())
+            for term, tf in doc.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+                weight = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+                self._postings[term].append((i, weight))
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """BM25 score per matching industry. Repeated query terms count logarithmically, so one long section cannot dominate."""
+        totals: Dict[int, float] = defaultdict(float)
+        for term, count in Counter(tokenize(text)).items():
+            postings = self._postings.get(term)
+            if postings:
+                boost = 1 + math.log(count)
+                for i, weight in postings:
+                    totals[i] += weight * boost
+        return {self.industries[i]: score for i, score in totals.items()}
+
+    def shortlist(self, text: str, k: int = INDUSTRY_SHORTLIST_SIZE) -> List[str]:
+        """The k best-matching industries, best first. Empty when nothing in the text matches."""
+        ranked = sorted(self.scores(text).items(), key=lambda item: (-item[1], item[0]))
+        return [name for name, _ in ranked[:k]]
+
+# Shared index, built at startup.
+index = IndustryIndex(IBIS_INDUSTRIES, IBIS_SYNONYMS)
+
+def shortlist_industries(text: str, k: int = INDUSTRY_SHORTLIST_SIZE) -> List[str]:
+    """Candidate IBIS industries for a document, or the full list when the text matches none of them."""
+    return index.shortlist(text, k) or list(IBIS_INDUSTRIES)
@@ -43,3 +43,102 @@ IBIS_INDUSTRIES = [
     "Virtual Event Platforms", "Vocational Schools", "Voice Over IP (VoIP) Services", "Warehouse Clubs & Supercenters",
     "Web Design Services", "Wedding Planners", "Wineries", "Yoga Studios"
 ]
+
+# Extra terms for the local shortlist index (industry_index.py), keyed by industry name.
+# Names are indexed too, so list only words a CIM would use that the name does not contain.
+IBIS_SYNONYMS = {
+    "Accounting Services": ["accounting", "bookkeeping", "audit", "cpa", "assurance"],
+    "Advertising Agencies": ["creative agency", "media buying", "brand campaigns"],
+    "Aerospace Engineering & Operations": ["aircraft", "aviation", "avionics", "defense", "airframe", "mro"],
+    "Apparel Manufacturing": ["garments", "clothing", "textiles", "sewing", "apparel"],
+    "Architectural Services": ["architects", "architecture", "design firm"],
+    "Auto Mechanics": ["auto repair", "collision repair", "automotive service", "oil change"],
+    "Auto Parts Wholesaling": ["aftermarket parts", "automotive parts", "auto parts distribution"],
+    "Automotive Dealerships": ["car dealership", "new vehicles", "franchised dealer"],
+    "Beer Production": ["brewing", "brewer", "beer"],
+    "Biotechnology": ["biologics", "drug discovery", "clinical trials", "therapeutics", "life sciences"],
+    "Building Inspection Services": ["inspections", "code compliance", "home inspection"],
+    "Building Lighting Control Systems": ["lighting controls", "led lighting", "building automation"],
+    "Call Centers": ["contact center", "customer support outsourcing", "bpo"],
+    "Car Wash & Auto Detailing": ["car wash", "express wash", "detailing"],
+    "Carbon Fiber Manufacturing": ["composites", "composite materials"],
+    "Catering Services": ["caterer", "food service", "event catering"],
+    "Child Care Services": ["daycare", "childcare", "child care centers"],
+    "Cloud Storage Services": ["cloud", "data storage", "saas storage", "backup"],
+    "Commercial Banking": ["bank", "lending", "deposits", "loans"],
+    "Commercial Printing": ["printing", "print", "labels", "packaging printing"],
+    "Commercial Trucking": ["trucking", "truckload", "ltl", "freight carrier", "fleet", "tractors", "trailers"],
+    "Computer Repair Services": ["it repair", "device repair"],
+    "Construction Machinery Wholesaling": ["equipment dealer", "heavy equipment", "construction equipment"],
+    "Convenience Stores": ["c-store", "convenience retail"],
+    "Cosmetic & Beauty Products": ["cosmetics", "beauty", "personal care", "fragrance"],
+    "Cybersecurity Services": ["cybersecurity", "security operations", "penetration testing", "managed detection"],
+    "Data Analytics Services": ["analytics", "business intelligence", "data science"],
+    "Dental Insurance": ["dental plans", "dental benefits"],
+    "Digital Advertising": ["programmatic", "ad tech", "online advertising", "digital marketing"],
+    "E-Commerce Platforms": ["ecommerce", "online retail", "marketplace", "direct-to-consumer", "dtc"],
+    "Electric Power Transmission": ["utility", "transmission lines", "grid"],
+    "Electric Vehicle Charging Stations": ["ev charging", "chargers", "electric vehicles"],
+    "Electronic Component Manufacturing": ["electronics", "pcb", "printed circuit boards", "contract manufacturing", "ems", "semiconductors"],
+    "Engineering Services": ["engineering", "civil engineering", "design engineering"],
+    "Environmental Consulting": ["environmental", "remediation", "compliance consulting"],
+    "Facilities Management": ["facility services", "building maintenance", "integrated facilities"],
+    "Fast Food Restaurants": ["quick service", "qsr", "franchise restaurants", "drive-thru"],
+    "Financial Planning & Advice": ["wealth management", "ria", "financial advisors", "assets under management"],
+    "Food Delivery Platforms": ["food delivery", "delivery app"],
+    "Freight Packing & Logistics": ["freight forwarding", "3pl", "third-party logistics", "crating"],
+    "Funeral Homes": ["funeral", "cremation", "deathcare", "cemeteries"],
+    "Game Development": ["video games", "gaming studio"],
+    "Garage Door Installation": ["garage doors", "overhead doors"],
+    "General Hospitals": ["hospital", "acute care", "inpatient"],
+    "Green Building Construction": ["sustainable construction", "leed"],
+    "Grocery Wholesaling": ["food distribution", "foodservice distribution", "grocery distributor"],
+    "Hair Salons": ["salon", "barbershop", "hair care"],
+    "Hardware Stores": ["home improvement", "hardware"],
+    "Health Insurance": ["health plans", "medicare advantage", "payer"],
+    "Home Cleaning Services": ["maid services", "residential cleaning"],
+    "Home Healthcare": ["home health", "hospice", "personal care services", "in-home care"],
+    "HR Consulting": ["human resources", "peo", "payroll", "benefits administration"],
+    "HVAC Services": ["hvac", "heating", "air conditioning", "ventilation", "refrigeration", "mechanical contractor"],
+    "Industrial Cleaning Services": ["industrial cleaning", "hydro excavation", "tank cleaning"],
+    "Industrial Machinery Manufacturing": ["machinery", "equipment manufacturer", "oem", "industrial equipment", "fabrication", "machining"],
+    "Insurance Brokers & Agencies": ["insurance agency", "brokerage", "commissions", "carriers", "underwriting"],
+    "IT Consulting": ["systems integration", "technology consulting", "digital transformation"],
+    "Janitorial Services": ["janitorial", "custodial", "commercial cleaning"],
+    "Kitchen Cabinet Manufacturing": ["cabinets", "cabinetry", "millwork", "countertops"],
+    "Landscaping Services": ["landscaping", "lawn care", "snow removal", "grounds maintenance"],
+    "Laundry & Linen Supply": ["linen", "uniform rental", "laundry"],
+    "Legal Services": ["law firm", "litigation", "attorneys"],
+    "Logistics & Warehousing": ["warehousing", "distribution centers", "fulfillment", "3pl", "supply chain"],
+    "Machine Tool Manufacturing": ["machine tools", "cnc", "cutting tools"],
+    "Managed IT Services": ["msp", "managed services", "help desk", "it outsourcing"],
+    "Medical Billing Services": ["revenue cycle management", "rcm", "medical coding", "claims processing"],
+    "Mental Health Clinics": ["behavioral health", "psychiatry", "therapy", "addiction treatment"],
+    "Mobile App Development": ["apps", "ios", "android"],
+    "Moving Services": ["movers", "relocation"],
+    "Natural Gas Distribution": ["natural gas", "gas utility", "pipelines"],
+    "Nursing Care Facilities": ["skilled nursing", "snf", "long-term care"],
+    "Oil & Gas Field Services": ["oilfield", "drilling", "upstream", "well services", "completions"],
+    "Packaging Services": ["packaging", "corrugated", "containers", "co-packing"],
+    "Pharmacies & Drug Stores": ["pharmacy", "prescriptions", "specialty pharmacy"],
+    "Physical Therapy Clinics": ["physical therapy", "outpatient rehabilitation", "occupational therapy"],
+    "Plumbing Services": ["plumbing", "drain", "water heaters"],
+    "Pool & Spa Services": ["pool service", "pool maintenance"],
+    "Property Management Services": ["property management", "hoa", "leasing"],
+    "Radiology Services": ["imaging", "mri", "diagnostic imaging"],
+    "Residential Building Construction": ["homebuilder", "residential construction", "remodeling"],
+    "Roofing Contractors": ["roofing", "roof replacement", "commercial roofing"],
+    "Security Alarm Services": ["alarm monitoring", "security systems", "fire alarm", "access control"],
+    "Security Guards & Patrol Services": ["security officers", "guard services"],
+    "Self-Storage Services": ["self storage", "storage units"],
+    "Senior Living Facilities": ["assisted living", "memory care", "independent living"],
+    "Software Publishing": ["software", "saas", "subscription software", "arr", "enterprise software", "licenses"],
+    "Solar Panel Installation": ["solar", "photovoltaic", "renewable energy installation"],
+    "Staffing Agencies": ["staffing", "temporary staffing", "recruiting", "placement"],
+    "Telehealth Services": ["telemedicine", "virtual care"],
+    "Tile & Marble Contractors": ["tile installation", "stone", "flooring"],
+    "Tire Dealers": ["tires", "tire service"],
+    "Veterinary Services": ["veterinary", "animal hospital", "pet health"],
+    "Vocational Schools": ["trade school", "career education", "skilled trades training"],
+    "Web Design Services": ["website design", "web development"],
+}
@@ -0,0 +1,328 @@
+# cim-backend/instrumentation.py
+#
+# Pipeline instrumentation without extra dependencies: process-wide counters and
+# histograms rendered in the Prometheus text format (GET /metrics on the API,
+# WORKER_METRICS_PORT on worker.py), plus a per-job PipelineTrace that collects
+# stage timings, LLM tokens and cost, bytes and pages, and is stored in
+# pipeline_runs so a slow deal can be inspected after the fact.
+#
+# The current trace lives in a contextvar. LLMGateway.run() hands coroutines to
+# its loop with run_coroutine_threadsafe, which carries the caller's context, so
+# token usage recorded on the gateway thread lands on the right deal.
+#
+# Hot-path cost is a perf_counter() pair and a few dict updates under a lock per stage.
+
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+
+# --- Configuration ---
+# USD per 1M prompt/completion tokens, overridable as LLM_PRICES="gpt-4o=2.50/10.00,gpt-3.5-turbo=0.50/1.50".
+DEFAULT_LLM_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+def parse_prices(spec: Optional[str]) -> Dict[str, tuple]:
+    prices = dict(DEFAULT_LLM_PRICES)
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, _, price = item.strip().partition("=")
+        prompt, _, completion = price.partition("/")
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+LLM_PRICES = parse_prices(os.getenv("LLM_PRICES"))
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600)
+
+# --- Metric Types ---
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def _sample_text(value: float) -> str:
+    """Sample values at full precision (shortest round-trip repr); :g would freeze counters past 1e6."""
+    value = float(value)
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labels), 0.0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {_sample_text(value)}")
+        return "\n".join(lines)
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [count per bucket (+Inf last), sum]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._values.get(tuple(str(labels.get(name, "")) for name in self.labels))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_sample_text(total)}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return "\n".join(lines)
+
+# --- Registry ---
+
+STAGE_SECONDS = Histogram("cim_stage_duration_seconds", "Time spent per pipeline stage.", ["stage"])
+JOB_QUEUE_WAIT_SECONDS = Histogram("cim_job_queue_wait_seconds", "Time from a job becoming runnable to a worker claiming it.",
+                                   ["kind"], buckets=WAIT_BUCKETS)
+JOB_SECONDS = Histogram("cim_job_duration_seconds", "Handler run time per job attempt.", ["kind", "outcome"])
+JOBS_TOTAL = Counter("cim_jobs_total", "Job attempts by outcome (done, retry, failed, lost).", ["kind", "outcome"])
+LLM_REQUESTS = Counter("cim_llm_requests_total", "Completed OpenAI requests.", ["model"])
+LLM_ERRORS = Counter("cim_llm_errors_total", "OpenAI errors, including retried ones.", ["model", "error"])
+LLM_SECONDS = Histogram("cim_llm_request_duration_seconds", "OpenAI request latency, excluding rate-limit waits.", ["model"])
+LLM_FIRST_TOKEN_SECONDS = Histogram("cim_llm_first_token_seconds", "Time from sending a streamed OpenAI request to its first content.",
+                                    ["model"])
+LLM_TOKENS = Counter("cim_llm_tokens_total", "OpenAI tokens by kind (prompt, completion).", ["model", "kind"])
+LLM_COST = Counter("cim_llm_cost_usd_total", "Estimated OpenAI spend in USD, from LLM_PRICES.", ["model"])
+PDF_BYTES = Counter("cim_pdf_bytes_total", "PDF bytes downloaded by workers.")
+PDF_PAGES = Counter("cim_pdf_pages_total", "PDF pages whose text was extracted.")
+TEXT_TOKENS = Counter("cim_text_tokens_total", "Estimated document tokens before (raw) and after (clean) preprocessing.", ["kind"])
+FIRST_CONTENT_SECONDS = Histogram("cim_analysis_first_content_seconds",
+                                  "Time from a job starting to the first analysis section stored on its deal.", ["kind"])
+ANALYSIS_CACHE_LOOKUPS = Counter("cim_analysis_cache_lookups_total", "Analysis cache lookups by key (file, text) and result (hit, miss).",
+                                 ["key", "result"])
+ANALYSIS_CACHE_EVICTIONS = Counter("cim_analysis_cache_evictions_total", "Analysis cache entries deleted as expired or least recently used.")
+
+REGISTRY = [STAGE_SECONDS, JOB_QUEUE_WAIT_SECONDS, JOB_SECONDS, JOBS_TOTAL, LLM_REQUESTS, LLM_ERRORS,
+            LLM_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, LLM_COST, PDF_BYTES, PDF_PAGES, TEXT_TOKENS,
+            FIRST_CONTENT_SECONDS, ANALYSIS_CACHE_LOOKUPS, ANALYSIS_CACHE_EVICTIONS]
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Per-Job Trace ---
+
+class PipelineTrace:
+    """What one job attempt spent, where. Mutated from the worker thread and the LLM gateway loop."""
+    def __init__(self, deal_id: Optional[int] = None, job_id: Optional[int] = None, kind: Optional[str] = None,
+                 attempt: int = 1, queue_wait_seconds: Optional[float] = None):
+        self.deal_id = deal_id
+        self.job_id = job_id
+        self.kind = kind
+        self.attempt = attempt
+        self.queue_wait_seconds = queue_wait_seconds
+        self.started = time.time()
+        self._began = time.perf_counter()
+        self._seconds: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.llm: Dict[str, dict] = {}
+        self.file_bytes = 0
+        self.pages_total = 0
+        self.pages_extracted = 0
+        self.extracted_chars = 0
+        self.text_tokens_raw = None
+        self.text_tokens_clean = None
+        self.first_content_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_llm(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float, seconds: float):
+        with self._lock:
+            usage = self.llm.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                "cost_usd": 0.0, "seconds": 0.0})
+            usage["requests"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["cost_usd"] += cost
+            usage["seconds"] += seconds
+
+    def finish(self):
+        if self._seconds is None:
+            self._seconds = time.perf_counter() - self._began
+
+    @property
+    def elapsed(self) -> float:
+        return self._seconds if self._seconds is not None else time.perf_counter() - self._began
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {
+                "prompt_tokens": sum(u["prompt_tokens"] for u in self.llm.values()),
+                "completion_tokens": sum(u["completion_tokens"] for u in self.llm.values()),
+                "cost_usd": round(sum(u["cost_usd"] for u in self.llm.values()), 6),
+            }
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("pipeline_trace", default=None)
+
+def current_trace() -> Optional[PipelineTrace]:
+    return _current_trace.get()
+
+@contextmanager
+def tracing(trace: PipelineTrace):
+    """Makes trace current for the block (and the LLM calls it makes), then stops its clock."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+@contextmanager
+def stage(name: str):
+    """Times a block into cim_stage_duration_seconds and the current trace, if any."""
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - began
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+
+# --- Recorders ---
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = LLM_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def record_llm_call(model: str, seconds: float, usage=None):
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cost = llm_cost(model, prompt_tokens, completion_tokens)
+    LLM_REQUESTS.inc(model=model)
+    LLM_SECONDS.observe(seconds, model=model)
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+    LLM_COST.inc(cost, model=model)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_llm(model, prompt_tokens, completion_tokens, cost, seconds)
+
+def record_llm_error(model: str, error: Exception):
+    LLM_ERRORS.inc(model=model, error=type(error).__name__)
+
+def record_document(file_bytes: int = 0, pages_total: int = 0, pages_extracted: int = 0, chars: int = 0):
+    PDF_BYTES.inc(file_bytes)
+    PDF_PAGES.inc(pages_extracted)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.file_bytes += file_bytes
+        trace.pages_total = max(trace.pages_total, pages_total)
+        trace.pages_extracted += pages_extracted
+        trace.extracted_chars += chars
+
+def record_preprocessing(tokens_before: int, tokens_after: int):
+    TEXT_TOKENS.inc(tokens_before, kind="raw")
+    TEXT_TOKENS.inc(tokens_after, kind="clean")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.text_tokens_raw = tokens_before
+        trace.text_tokens_clean = tokens_after
+
+def record_llm_first_token(model: str, seconds: float):
+    LLM_FIRST_TOKEN_SECONDS.observe(seconds, model=model)
+
+def record_first_content():
+    """Marks the first analysis section becoming visible on the deal; later calls are ignored."""
+    trace = _current_trace.get()
+    if trace is not None and trace.first_content_seconds is None:
+        trace.first_content_seconds = trace.elapsed
+        FIRST_CONTENT_SECONDS.observe(trace.first_content_seconds, kind=trace.kind)
+
+def record_job(trace: PipelineTrace, outcome: str):
+    JOBS_TOTAL.inc(kind=trace.kind, outcome=outcome)
+    JOB_SECONDS.observe(trace.elapsed, kind=trace.kind, outcome=outcome)
+
+def record_queue_wait(kind: str, seconds: float):
+    JOB_QUEUE_WAIT_SECONDS.observe(max(seconds, 0.0), kind=kind)
+
+# --- Persistence ---
+
+def save_run(db: Session, trace: PipelineTrace, worker_id: str, outcome: str, error: Optional[str] = None):
+    """Stores the trace as a pipeline_runs row and commits."""
+    trace.finish()
+    totals = trace.totals()
+    db.add(models.PipelineRun(
+        deal_id=trace.deal_id,
+        job_id=trace.job_id,
+        kind=trace.kind,
+        attempt=trace.attempt,
+        worker=worker_id,
+        outcome=outcome,
+        error=error[:2000] if error else None,
+        started_at=datetime.fromtimestamp(trace.started, timezone.utc),
+        queue_wait_seconds=trace.queue_wait_seconds,
+        total_seconds=round(trace.elapsed, 4),
+        stages={name: round(seconds, 4) for name, seconds in trace.stages.items()},
+        llm=trace.llm or None,
+        prompt_tokens=totals["prompt_tokens"],
+        completion_tokens=totals["completion_tokens"],
+        cost_usd=totals["cost_usd"],
+        file_bytes=trace.file_bytes or None,
+        pages_total=trace.pages_total or None,
+        pages_extracted=trace.pages_extracted or None,
+        extracted_chars=trace.extracted_chars or None,
+        text_tokens_raw=trace.text_tokens_raw,
+        text_tokens_clean=trace.text_tokens_clean,
+        first_content_seconds=round(trace.first_content_seconds, 4) if trace.first_content_seconds is not None else None,
+    ))
+    db.commit()
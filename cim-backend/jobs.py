@@ -0,0 +1,269 @@
+# cim-backend/jobs.py
+
+import os
+import random
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import or_, and_, func, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+import models
+import instrumentation
+
+# --- Queue Configuration ---
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# A running job whose lease is older than this is assumed lost and gets reclaimed.
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "15"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+# Runnable jobs passed over per claim because their concurrency group is full.
+JOB_CLAIM_MAX_SKIPPED = 100
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help (e.g. an unreadable PDF)."""
+
+class JobSnapshot:
+    """Detached copy of a claimed job, safe to hand to handlers after the claim commits."""
+    def __init__(self, job: models.AnalysisJob):
+        self.id = job.id
+        self.kind = job.kind
+        self.deal_id = job.deal_id
+        self.payload = dict(job.payload or {})
+        self.attempts = job.attempts
+        self.max_attempts = job.max_attempts
+        self.locked_by = job.locked_by
+        # Seconds between the job becoming runnable and this claim; set by claim_job.
+        self.queue_wait_seconds: Optional[float] = None
+
+    @property
+    def is_last_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+# --- Handler Registry ---
+# kind -> (run(job), give_up(job, error)). give_up runs once a job exhausts its retries.
+# Handlers register themselves from services.py, which keeps this module free of pipeline imports.
+JOB_HANDLERS: Dict[str, tuple] = {}
+
+def job_handler(kind: str, on_give_up: Optional[Callable] = None):
+    def register(func):
+        JOB_HANDLERS[kind] = (func, on_give_up)
+        return func
+    return register
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+# --- Producer Side ---
+
+def enqueue_job(db: Session, kind: str, deal_id: Optional[int] = None, payload: Optional[dict] = None,
+                max_attempts: int = JOB_MAX_ATTEMPTS, concurrency_key: Optional[str] = None,
+                concurrency_limit: Optional[int] = None) -> models.AnalysisJob:
+    """
+    Adds a job to the session. The caller commits, so the job lands atomically with its deal.
+    Jobs enqueued with the same concurrency_key never run more than concurrency_limit at once.
+    """
+    job = models.AnalysisJob(
+        kind=kind,
+        deal_id=deal_id,
+        payload=payload or {},
+        status="queued",
+        max_attempts=max_attempts,
+        run_after=_now(),
+        concurrency_key=concurrency_key if concurrency_limit else None,
+        concurrency_limit=concurrency_limit if concurrency_key else None,
+    )
+    db.add(job)
+    return job
+
+# --- Consumer Side ---
+
+def _group_is_full(db: Session, job: models.AnalysisJob, now: datetime) -> bool:
+    """
+    True when job's concurrency group already has concurrency_limit live jobs. The advisory
+    lock serializes claimers of one group until commit, so the count cannot race.
+    """
+    db.execute(select(func.pg_advisory_xact_lock(func.hashtext(job.concurrency_key))))
+    running = db.query(func.count(models.AnalysisJob.id)).filter(
+        models.AnalysisJob.concurrency_key == job.concurrency_key,
+        models.AnalysisJob.status == "running",
+        models.AnalysisJob.locked_until >= now,
+        models.AnalysisJob.id != job.id,
+    ).scalar()
+    return running >= job.concurrency_limit
+
+def claim_job(db: Session, worker_id: str) -> Optional[JobSnapshot]:
+    """
+    Claims the next runnable job with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+    workers never receive the same row. Jobs whose lease expired are reclaimed, and jobs
+    whose concurrency group is full are passed over until a slot frees up.
+    """
+    now = _now()
+    skipped = []
+    while True:
+        query = db.query(models.AnalysisJob).filter(or_(
+            and_(models.AnalysisJob.status == "queued", models.AnalysisJob.run_after <= now),
+            and_(models.AnalysisJob.status == "running", models.AnalysisJob.locked_until < now),
+        ))
+        if skipped:
+            query = query.filter(models.AnalysisJob.id.notin_(skipped))
+        job = (
+            query.order_by(models.AnalysisJob.run_after, models.AnalysisJob.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None or len(skipped) >= JOB_CLAIM_MAX_SKIPPED:
+            db.rollback()
+            return None
+
+        if job.status == "running" and job.attempts >= job.max_attempts:
+            # The final attempt's worker died; there is nothing left to retry.
+            print(f"Job {job.id} lease expired on its last attempt. Giving up.")
+            job.status = "failed"
+            job.last_error = job.last_error or "Visibility timeout expired."
+            job.locked_until = None
+            snapshot = JobSnapshot(job)
+            db.commit()
+            _give_up(snapshot, job.last_error)
+            continue
+
+        if job.concurrency_key and job.concurrency_limit and _group_is_full(db, job, now):
+            skipped.append(job.id)
+            continue
+
+        # Runnable since its run_after, or since the lost lease expired for a reclaimed job.
+        runnable_since = job.locked_until if job.status == "running" else job.run_after
+        job.status = "running"
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_until = now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS)
+        snapshot = JobSnapshot(job)
+        snapshot.queue_wait_seconds = (now - runnable_since).total_seconds() if runnable_since else None
+        db.commit()
+        return snapshot
+
+def extend_lease(job_id: int, worker_id: str) -> None:
+    """Pushes the visibility timeout forward while a long job is still making progress."""
+    db = SessionLocal()
+    try:
+        db.query(models.AnalysisJob).filter(
+            models.AnalysisJob.id == job_id,
+            models.AnalysisJob.status == "running",
+            models.AnalysisJob.locked_by == worker_id,
+        ).update(
+            {"locked_until": _now() + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS)},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _owned(db: Session, job: JobSnapshot):
+    """The job's row, as long as this claim still holds its lease (another worker may have reclaimed it)."""
+    return db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.id == job.id,
+        models.AnalysisJob.status == "running",
+        models.AnalysisJob.locked_by == job.locked_by,
+    )
+
+def complete_job(db: Session, job: JobSnapshot) -> bool:
+    """Marks the job done. Returns False if the lease was lost, leaving the new owner's row alone."""
+    updated = _owned(db, job).update(
+        {"status": "done", "locked_until": None, "last_error": None}, synchronize_session=False
+    )
+    db.commit()
+    return bool(updated)
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff, jittered so retries from a burst of failures spread out."""
+    ceiling = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return random.uniform(ceiling / 2, ceiling)
+
+def fail_job(db: Session, job: JobSnapshot, error: str, permanent: bool = False) -> Optional[bool]:
+    """
+    Schedules a retry, or marks the job failed when out of attempts. Returns True if it will
+    retry, False if it failed, and None if the lease was lost (the new owner decides).
+    """
+    will_retry = not permanent and not job.is_last_attempt
+    values = {"last_error": error[:2000], "locked_until": None}
+    if will_retry:
+        values.update(status="queued", run_after=_now() + timedelta(seconds=retry_delay(job.attempts)))
+    else:
+        values.update(status="failed")
+    updated = _owned(db, job).update(values, synchronize_session=False)
+    db.commit()
+    if not updated:
+        print(f"Job {job.id} was reclaimed by another worker; leaving its outcome to the new owner.")
+        return None
+    if not will_retry:
+        _give_up(job, error)
+    return will_retry
+
+def _give_up(job: JobSnapshot, error: str) -> None:
+    _, on_give_up = JOB_HANDLERS.get(job.kind, (None, None))
+    if on_give_up is None:
+        return
+    try:
+        on_give_up(job, error)
+    except Exception as e:
+        print(f"Error in give-up handler for job {job.id}: {e}")
+
+def run_next_job(worker_id: str) -> bool:
+    """Claims and runs a single job. Returns False when the queue had nothing runnable."""
+    db = SessionLocal()
+    try:
+        job = claim_job(db, worker_id)
+        if job is None:
+            return False
+
+        handler, _ = JOB_HANDLERS.get(job.kind, (None, None))
+        if handler is None:
+            fail_job(db, job, f"No handler registered for job kind '{job.kind}'.", permanent=True)
+            return True
+
+        # Renew the lease in the background so only crashed workers lose their jobs.
+        finished = threading.Event()
+        def heartbeat():
+            while not finished.wait(JOB_VISIBILITY_TIMEOUT_SECONDS / 3):
+                try:
+                    extend_lease(job.id, worker_id)
+                except Exception as e:
+                    print(f"Could not extend lease for job {job.id}: {e}")
+        threading.Thread(target=heartbeat, daemon=True).start()
+
+        trace = instrumentation.PipelineTrace(deal_id=job.deal_id, job_id=job.id, kind=job.kind,
+                                              attempt=job.attempts, queue_wait_seconds=job.queue_wait_seconds)
+        if job.queue_wait_seconds is not None:
+            instrumentation.record_queue_wait(job.kind, job.queue_wait_seconds)
+        outcome, error = "done", None
+        try:
+            with instrumentation.tracing(trace):
+                handler(job)
+        except PermanentJobError as e:
+            print(f"Job {job.id} ({job.kind}) failed permanently: {e}")
+            error = str(e)
+            outcome = "lost" if fail_job(db, job, error, permanent=True) is None else "failed"
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}/{job.max_attempts}: {e}")
+            traceback.print_exc()
+            error = str(e)
+            will_retry = fail_job(db, job, error)
+            outcome = "lost" if will_retry is None else "retry" if will_retry else "failed"
+        else:
+            if not complete_job(db, job):
+                print(f"Job {job.id} finished after its lease was reclaimed; the new owner's status stands.")
+                outcome = "lost"
+        finally:
+            finished.set()
+        instrumentation.record_job(trace, outcome)
+        try:
+            instrumentation.save_run(db, trace, worker_id, outcome, error)
+        except Exception as e:
+            db.rollback()
+            print(f"Could not store pipeline run for job {job.id}: {e}")
+        return True
+    finally:
+        db.close()
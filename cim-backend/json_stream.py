@@ -0,0 +1,67 @@
+# cim-backend/json_stream.py
+#
+# Incremental parsing of a streamed JSON object. The analysis arrives from gpt-4o
+# a few characters at a time; ObjectStream hands back each top-level member
+# ("company", "financials", ...) as soon as its value is complete, so finished
+# sections can be shown while the rest is still being written. Each character is
+# scanned once, and only completed members are handed to json.loads.
+
+import json
+from typing import Any, List, Tuple
+
+class ObjectStream:
+    """Feeds on chunks of one JSON object's text and yields its completed top-level members."""
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0 # next character to scan
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None # offset of the current top-level member, once inside the object
+        self.members = {} # every member completed so far
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Adds text and returns the (key, value) members it completed, in order."""
+        if not chunk:
+            return []
+        self._text += chunk
+        completed = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = i + 1
+            elif char in "}]":
+                if self._depth == 1:
+                    completed += self._close_member(text, i)
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                completed += self._close_member(text, i)
+                self._member_start = i + 1
+        self._pos = len(text)
+        return completed
+
+    def _close_member(self, text: str, end: int) -> List[Tuple[str, Any]]:
+        member = text[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            # Not valid on its own (the model wrote malformed JSON); the final parse will say so.
+            return []
+        self.members.update(parsed)
+        return list(parsed.items())
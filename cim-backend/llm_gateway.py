@@ -0,0 +1,380 @@
+# cim-backend/llm_gateway.py
+#
+# Single entry point for OpenAI calls. Requests run on one background event loop
+# per process with a shared, pooled HTTP client; a token bucket per model keeps
+# requests/minute and tokens/minute under budget, a semaphore bounds concurrency,
+# and rate-limit/transient errors are retried honoring Retry-After.
+#
+# The buckets live in Postgres (llm_rate_buckets), so every worker process and
+# thread draws on the account's one budget. LLM_SHARED_RATE_LIMITS=off keeps them
+# in memory instead, per process; divide the limits across processes then.
+
+import os
+import time
+import random
+import asyncio
+import threading
+import concurrent.futures
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import instrumentation
+from database import engine
+
+# --- Gateway Configuration ---
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "90"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "60"))
+# Output tokens reserved per request when the caller does not set max_tokens; the
+# reservation is trued up to the reported usage when the call returns.
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", "1500"))
+# "on" shares the rate-limit buckets across processes through Postgres, "off" keeps them per process.
+LLM_SHARED_RATE_LIMITS = os.getenv("LLM_SHARED_RATE_LIMITS", "on")
+# Longest a caller waiting for budget sleeps before looking at the shared bucket again.
+LLM_SHARED_BUCKET_POLL_SECONDS = 1.0
+
+# requests/minute and tokens/minute per model for the whole account, overridable as
+# LLM_RATE_LIMITS="gpt-4o=5000/450000,gpt-3.5-turbo=3500/90000". The defaults are
+# OpenAI's usage tier 2; a tier 1 account (500/30000) should set them.
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": (5000, 450000),
+    "gpt-3.5-turbo": (3500, 90000),
+}
+
+def parse_rate_limits(spec: Optional[str]) -> Dict[str, tuple]:
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, _, budget = item.strip().partition("=")
+        rpm, _, tpm = budget.partition("/")
+        limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+LLM_RATE_LIMITS = parse_rate_limits(os.getenv("LLM_RATE_LIMITS"))
+
+def estimate_tokens(messages: List[dict]) -> int:
+    """Rough prompt size (about 4 characters per token), good enough for budgeting."""
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 8 * len(messages)
+
+# --- Token Bucket ---
+
+class TokenBucket:
+    """Continuously refilling budget. Lives on the gateway loop, so asyncio primitives suffice."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    async def adjust(self, delta: float):
+        """Returns over-reserved tokens (negative delta) or charges extra usage once the real count is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    async def drain(self):
+        """Empties the bucket after the provider reports a rate limit, so other callers back off too."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+_REFILLED = "LEAST(:capacity, tokens + EXTRACT(EPOCH FROM (clock_timestamp() - updated_at)) * :rate)"
+_CREATE_BUCKET = text("INSERT INTO llm_rate_buckets (name, tokens, updated_at) VALUES (:name, :capacity, clock_timestamp()) "
+                      "ON CONFLICT (name) DO NOTHING")
+_TAKE = text(f"UPDATE llm_rate_buckets SET tokens = {_REFILLED} - :amount, updated_at = clock_timestamp() "
+             f"WHERE name = :name AND {_REFILLED} >= :amount RETURNING tokens")
+_LEVEL = text(f"SELECT {_REFILLED} FROM llm_rate_buckets WHERE name = :name")
+_ADJUST = text(f"UPDATE llm_rate_buckets SET tokens = LEAST(:capacity, {_REFILLED} - :delta), updated_at = clock_timestamp() "
+               f"WHERE name = :name")
+_DRAIN = text(f"UPDATE llm_rate_buckets SET tokens = LEAST({_REFILLED}, 0), updated_at = clock_timestamp() WHERE name = :name")
+
+class SharedTokenBucket:
+    """
+    TokenBucket kept in llm_rate_buckets, so all processes spend one budget. Each operation is
+    one statement that refills and updates the row under its row lock. Falls back to an
+    in-process bucket while the database is unreachable rather than stalling analyses.
+    """
+
+    def __init__(self, name: str, per_minute: int):
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._local = TokenBucket(per_minute)
+        self._created = False
+        self._warned = False
+        self._lock = asyncio.Lock()
+
+    def _params(self, **extra) -> dict:
+        return {"name": self.name, "capacity": self.capacity, "rate": self.rate, **extra}
+
+    def _execute(self, statement, **extra):
+        with engine.begin() as connection:
+            if not self._created:
+                connection.execute(_CREATE_BUCKET, self._params())
+                self._created = True
+            return connection.execute(statement, self._params(**extra))
+
+    def _take(self, amount: float) -> float:
+        """Takes amount if the bucket holds it and returns 0, else the seconds until it will."""
+        if self._execute(_TAKE, amount=amount).first() is not None:
+            return 0.0
+        level = self._execute(_LEVEL).scalar()
+        if level is None:
+            # The row is gone (e.g. reset_db); recreate it on the next attempt.
+            self._created = False
+            return 0.01
+        return max((amount - level) / self.rate, 0.01)
+
+    def _fallback(self, operation: str, error: Exception):
+        if not self._warned:
+            print(f"Shared LLM rate bucket {self.name} unavailable ({type(error).__name__}); using the in-process bucket for {operation}.")
+            self._warned = True
+
+    async def acquire(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                try:
+                    wait = await asyncio.to_thread(self._take, amount)
+                except SQLAlchemyError as e:
+                    self._fallback("acquire", e)
+                    return await self._local.acquire(amount)
+                if wait <= 0:
+                    return
+                # Other processes refund and true up too, so look again before the full wait.
+                await asyncio.sleep(min(wait, LLM_SHARED_BUCKET_POLL_SECONDS))
+
+    async def adjust(self, delta: float):
+        try:
+            await asyncio.to_thread(self._execute, _ADJUST, delta=delta)
+        except SQLAlchemyError as e:
+            self._fallback("adjust", e)
+            await self._local.adjust(delta)
+
+    async def drain(self):
+        try:
+            await asyncio.to_thread(self._execute, _DRAIN)
+        except SQLAlchemyError as e:
+            self._fallback("drain", e)
+            await self._local.drain()
+
+class ModelLimiter:
+    def __init__(self, model: str, requests_per_minute: int, tokens_per_minute: int, shared: bool = True):
+        if shared:
+            self.requests = SharedTokenBucket(f"{model}:requests", requests_per_minute)
+            self.tokens = SharedTokenBucket(f"{model}:tokens", tokens_per_minute)
+        else:
+            self.requests = TokenBucket(requests_per_minute)
+            self.tokens = TokenBucket(tokens_per_minute)
+
+# --- Retry Helpers ---
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+def used_quota(error: Exception) -> bool:
+    """
+    Whether a failed request may still have counted against the provider's token limit:
+    only a timeout, where the request may have been processed. Rejections (429, 4xx),
+    server errors and connection failures did not.
+    """
+    return isinstance(error, openai.APITimeoutError)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads retry-after-ms / Retry-After (seconds or HTTP date) from an OpenAI error response."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def backoff_seconds(attempt: int) -> float:
+    ceiling = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(ceiling / 2, ceiling)
+
+class StreamInterruptedError(Exception):
+    """A streamed completion failed after part of the answer was delivered; retrying it here would repeat that part."""
+
+# --- Gateway ---
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate_limits: Dict[str, tuple] = None,
+                 shared_rate_limits: bool = LLM_SHARED_RATE_LIMITS == "on"):
+        self.max_concurrency = max_concurrency
+        self.rate_limits = rate_limits or LLM_RATE_LIMITS
+        self.shared_rate_limits = shared_rate_limits
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._start_lock = threading.Lock()
+
+    # The loop and everything bound to it are created on first use, inside the loop thread.
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._client = AsyncOpenAI(
+                        api_key=os.getenv("OPENAI_API_KEY"),
+                        timeout=LLM_TIMEOUT_SECONDS,
+                        max_retries=0, # retries happen here, where the rate limiter can see them
+                        http_client=httpx.AsyncClient(
+                            timeout=LLM_TIMEOUT_SECONDS,
+                            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                                max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                        ),
+                    )
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="llm-gateway", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _limiter(self, model: str) -> Optional[ModelLimiter]:
+        if model not in self._limiters and model in self.rate_limits:
+            self._limiters[model] = ModelLimiter(model, *self.rate_limits[model], shared=self.shared_rate_limits)
+        return self._limiters.get(model)
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Starts a coroutine on the gateway loop from synchronous code and returns its future without waiting."""
+        loop = self._ensure_started()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            coro.close()
+            raise RuntimeError("LLMGateway.run() cannot be called from the gateway loop; await the coroutine instead.")
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro):
+        """Runs a coroutine on the gateway loop from synchronous code (worker threads) and waits for it."""
+        return self.submit(coro).result()
+
+    async def _call(self, model: str, messages: List[dict], send, **kwargs):
+        """
+        Runs send() under the model's rate limits and the concurrency bound, retrying
+        rate-limit and transient errors. send() returns (result, usage).
+        """
+        limiter = self._limiter(model)
+        reserved = estimate_tokens(messages) + kwargs.get("max_tokens", LLM_DEFAULT_COMPLETION_TOKENS)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self._semaphore:
+                if limiter is not None:
+                    await limiter.requests.acquire(1)
+                    await limiter.tokens.acquire(reserved)
+                started = time.perf_counter()
+                try:
+                    result, usage = await send()
+                except (*RETRYABLE_ERRORS, openai.APIStatusError) as e:
+                    if limiter is not None and not used_quota(e):
+                        # Give the reservation back, so the local budget tracks real provider usage.
+                        await limiter.tokens.adjust(-reserved)
+                    if not isinstance(e, RETRYABLE_ERRORS):
+                        raise
+                    instrumentation.record_llm_error(model, e)
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    delay = retry_after_seconds(e)
+                    if isinstance(e, openai.RateLimitError) and limiter is not None:
+                        await limiter.tokens.drain()
+                    delay = backoff_seconds(attempt) if delay is None else min(delay, LLM_RETRY_MAX_SECONDS)
+                    print(f"OpenAI {type(e).__name__} for {model}; retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES}).")
+                else:
+                    instrumentation.record_llm_call(model, time.perf_counter() - started, usage)
+                    if limiter is not None and usage is not None and usage.total_tokens:
+                        await limiter.tokens.adjust(usage.total_tokens - reserved)
+                    return result
+            # Sleep outside the semaphore so waiting retries do not block other calls.
+            await asyncio.sleep(delay)
+
+    async def chat_completion(self, model: str, messages: List[dict], **kwargs):
+        """Rate-limited, retried chat completion. Must run on the gateway loop (use run() from sync code)."""
+        async def send():
+            response = await self._client.chat.completions.create(model=model, messages=messages, **kwargs)
+            return response, getattr(response, "usage", None)
+        return await self._call(model, messages, send, **kwargs)
+
+    async def chat_completion_stream(self, model: str, messages: List[dict], on_text: Callable[[str], None], **kwargs) -> str:
+        """
+        chat_completion with the answer streamed: on_text receives each piece of content as it
+        arrives (on the gateway loop, so it must not block), and the full content is returned.
+        Failures before the first piece are retried as usual; a stream that breaks midway raises
+        StreamInterruptedError, since on_text has already seen part of the answer.
+        """
+        async def send():
+            started = time.perf_counter()
+            parts, usage = [], None
+            stream = await self._client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+            try:
+                async for chunk in stream:
+                    usage = chunk.usage or usage
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if not text:
+                        continue
+                    if not parts:
+                        instrumentation.record_llm_first_token(model, time.perf_counter() - started)
+                    parts.append(text)
+                    on_text(text)
+            except RETRYABLE_ERRORS as e:
+                if parts:
+                    instrumentation.record_llm_error(model, e)
+                    raise StreamInterruptedError(f"OpenAI stream for {model} broke after {len(parts)} chunks: {e}") from e
+                raise
+            return "".join(parts), usage
+        return await self._call(model, messages, send, **kwargs)
+
+    def complete(self, model: str, messages: List[dict], **kwargs):
+        """Synchronous wrapper around chat_completion."""
+        return self.run(self.chat_completion(model, messages, **kwargs))
+
+# Shared gateway for the process.
+gateway = LLMGateway()
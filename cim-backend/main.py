@@ -4,19 +4,21 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from fastapi import FastAPI, Depends, UploadFile, File, HTTPException, status, Request, BackgroundTasks
+from fastapi import FastAPI, Depends, UploadFile, File, HTTPException, status, Request, Query
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Dict
-from starlette.responses import StreamingResponse
-
-import io
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Dict, Optional
+from starlette.responses import StreamingResponse, RedirectResponse, Response
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 
 from clerk_backend_api import Clerk
 from clerk_backend_api.security.types import AuthenticateRequestOptions
 
-import models, schemas, services
-from database import get_db, SessionLocal
+import models, schemas, services, analysis_cache, auth_cache, batch_upload, deal_events, instrumentation
+from database import get_db
 from routers import email_ingest # --- NEW: Import the email ingest router ---
 
 # --- Clerk and Security Setup ---
@@ -25,6 +27,11 @@ if not clerk_secret_key:
     raise ValueError("CLERK_SECRET_KEY environment variable not found.")
 clerk = Clerk(bearer_auth=clerk_secret_key)
 
+# Most recent full-text matches considered for relevance ranking in /api/deals/search.
+SEARCH_RANK_CANDIDATES = int(os.getenv("SEARCH_RANK_CANDIDATES", "5000"))
+# Optional bearer token for GET /metrics; scrapers usually cannot present a Clerk session.
+METRICS_BEARER_TOKEN = os.getenv("METRICS_BEARER_TOKEN")
+
 # --- CORS Configuration ---
 allowed_origins_str = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000")
 allowed_origins = [origin.strip() for origin in allowed_origins_str.split(',')]
@@ -48,6 +55,15 @@ def read_root():
 
 # --- Authentication and Helper Functions ---
 def get_current_user(req: Request) -> Dict:
+    # Fast path: cached JWKS and previously verified session tokens.
+    token = auth_cache.token_from_request(req.headers)
+    if token:
+        try:
+            claims = auth_cache.auth_cache.verify(token)
+        except auth_cache.TokenRejected as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Authentication error: {e}")
+        if claims is not None:
+            return claims
     try:
         request_state = clerk.authenticate_request(req, options=AuthenticateRequestOptions())
         if not request_state.is_signed_in:
@@ -56,54 +72,269 @@ def get_current_user(req: Request) -> Dict:
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Authentication error: {e}")
 
-def perform_analysis_and_update(deal_id: int, file_contents: bytes, file_name: str):
+# --- User-Facing API Endpoints ---
+
+@app.get("/metrics", tags=["System"], include_in_schema=False)
+def get_metrics(req: Request):
+    """Prometheus exposition of this process's pipeline metrics (jobs run in worker.py expose their own)."""
+    if METRICS_BEARER_TOKEN and req.headers.get("Authorization") != f"Bearer {METRICS_BEARER_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token.")
+    return Response(instrumentation.render_metrics(), media_type=instrumentation.PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/api/cache/stats", tags=["System"])
+def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Returns size and hit totals of the shared content-hash analysis cache."""
+    return analysis_cache.cache.stats()
+
+def filter_deals(query, status_filter: Optional[str], user_id: Optional[str], industry: Optional[str], before_id: Optional[int]):
+    """Applies the index-backed list filters and the keyset cursor (ids below before_id)."""
+    if status_filter:
+        query = query.filter(models.Deal.status == status_filter)
+    if user_id:
+        query = query.filter(models.Deal.user_id == user_id)
+    if industry:
+        query = query.filter(models.Deal.industry == industry)
+    if before_id is not None:
+        query = query.filter(models.Deal.id < before_id)
+    return query
+
+def summary_columns() -> list:
+    """List-view columns plus a correlated feedback count, without loading analysis_data."""
+    feedback_count = (
+        select(func.count(models.Feedback.id))
+        .where(models.Feedback.deal_id == models.Deal.id)
+        .correlate(models.Deal)
+        .scalar_subquery()
+    )
+    return [
+        models.Deal.id, models.Deal.file_name, models.Deal.status, models.Deal.user_id, models.Deal.user_name,
+        models.Deal.company_name, models.Deal.industry, models.Deal.confidence_score, models.Deal.analysis_sections,
+        feedback_count.label("feedback_count"),
+    ]
+
+def attach_feedback(db: Session, items: list):
+    """Loads feedback for a whole page of summaries in one query."""
+    if not items:
+        return
+    by_deal: Dict[int, list] = {item.id: [] for item in items}
+    for feedback in db.query(models.Feedback).filter(models.Feedback.deal_id.in_(list(by_deal))):
+        by_deal[feedback.deal_id].append(schemas.Feedback.model_validate(feedback))
+    for item in items:
+        item.feedbacks = by_deal[item.id]
+
+@app.get("/api/deals", response_model=List[schemas.Deal], tags=["Deals"])
+def get_all_deals(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before_id: Optional[int] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    user_id: Optional[str] = None,
+    industry: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Retrieve deals with full analysis, ordered by most recent. Feedback is loaded in one batched query."""
+    query = filter_deals(db.query(models.Deal), status_filter, user_id, industry, before_id)
+    query = query.options(selectinload(models.Deal.feedbacks)).order_by(models.Deal.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+@app.get("/api/deals/summary", response_model=schemas.DealPage, tags=["Deals"])
+def get_deal_summaries(
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    user_id: Optional[str] = None,
+    industry: Optional[str] = None,
+    include_feedback: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
-    Background task to process a user-uploaded PDF, run analysis, and update the deal.
+    Keyset-paginated deal list without analysis_data. Pass next_cursor back as before_id
+    for the next page. Feedback, when requested, is fetched for the whole page at once.
     """
-    db = SessionLocal()
-    try:
-        deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
-        if not deal: return
+    query = filter_deals(db.query(*summary_columns()), status_filter, user_id, industry, before_id)
+    rows = query.order_by(models.Deal.id.desc()).limit(limit + 1).all()
 
-        s3_stream = io.BytesIO(file_contents)
-        s3_url = services.upload_to_s3(s3_stream, file_name)
-        
-        pdf_stream = io.BytesIO(file_contents)
-        text = services.extract_text_from_pdf(pdf_stream)
-        if not text: raise Exception("Failed to extract text from PDF.")
+    has_more = len(rows) > limit
+    items = [schemas.DealSummary.model_validate(row._mapping) for row in rows[:limit]]
+    if include_feedback:
+        attach_feedback(db, items)
+    return schemas.DealPage(items=items, next_cursor=items[-1].id if has_more else None)
 
-        analysis_data = services.analyze_document_text(text)
-        if "error" in analysis_data: raise Exception(analysis_data["error"])
+@app.get("/api/deals/search", response_model=schemas.DealSearchPage, tags=["Deals"])
+def search_deals(
+    q: Optional[str] = Query(None, max_length=200),
+    industry: Optional[str] = None,
+    ibis_industry: List[str] = Query([]),
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(25, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    include_feedback: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Full-text search over company name, description, summary, thesis and red flags
+    (web-search syntax: quoted phrases, OR, -exclusions), ranked by relevance.
+    industry and ibis_industry are exact JSONB containment filters; repeat ibis_industry
+    to require several. Without q, matches are returned newest first.
+    """
+    criteria = {}
+    if industry:
+        criteria["industry"] = industry
+    if ibis_industry:
+        criteria["ibis_industries"] = ibis_industry
 
-        deal.s3_url = s3_url
-        deal.analysis_data = analysis_data
-        deal.status = "Complete"
-        db.commit()
-    except Exception as e:
-        print(f"Error in background task for deal {deal_id}: {e}")
-        deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
-        if deal:
-            deal.status = "Failed"
-            db.commit()
-    finally:
-        db.close()
+    conditions = []
+    if criteria:
+        conditions.append(models.Deal.analysis_data.contains(criteria))
+    if status_filter:
+        conditions.append(models.Deal.status == status_filter)
 
-# --- User-Facing API Endpoints ---
+    columns = summary_columns()
+    if q and q.strip():
+        tsquery = func.websearch_to_tsquery("english", q)
+        # Ranking reads every match's vector, so broad queries rank only the newest matches.
+        candidates = (
+            select(models.Deal.id, func.ts_rank_cd(models.Deal.search_vector, tsquery).label("rank"))
+            .where(models.Deal.search_vector.op("@@")(tsquery), *conditions)
+            .order_by(models.Deal.id.desc())
+            .limit(SEARCH_RANK_CANDIDATES)
+            .subquery()
+        )
+        # Rank and page the ids first, then fetch list columns for that page only.
+        page = (
+            select(candidates.c.id, candidates.c.rank)
+            .order_by(candidates.c.rank.desc(), candidates.c.id.desc())
+            .offset(offset)
+            .limit(limit + 1)
+            .subquery()
+        )
+        query = (
+            db.query(*columns, page.c.rank)
+            .join(page, page.c.id == models.Deal.id)
+            .order_by(page.c.rank.desc(), models.Deal.id.desc())
+        )
+    else:
+        query = db.query(*columns).filter(*conditions).order_by(models.Deal.id.desc()).offset(offset).limit(limit + 1)
+    rows = query.all()
 
-@app.get("/api/deals", response_model=List[schemas.Deal], tags=["Deals"])
-def get_all_deals(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Retrieve all deals from the database, ordered by most recent."""
-    deals = db.query(models.Deal).order_by(models.Deal.id.desc()).all()
-    return deals
+    has_more = len(rows) > limit
+    items = [schemas.DealSearchResult.model_validate(row._mapping) for row in rows[:limit]]
+    if include_feedback:
+        attach_feedback(db, items)
+    return schemas.DealSearchPage(items=items, next_offset=offset + limit if has_more else None)
+
+@app.get("/api/deals/screen", response_model=schemas.DealScreenPage, tags=["Deals"])
+def screen_deals(
+    criteria: schemas.ScreenCriteria = Depends(),
+    industry: Optional[str] = None,
+    sort_by: str = Query("revenue", pattern="^(" + "|".join(schemas.SCREEN_FIELDS) + ")$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(25, ge=1, le=200),
+    offset: int = Query(0, ge=0, le=10000),
+    include_feedback: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Screens analyzed deals on their parsed financials, e.g.
+    ?industry=HVAC&min_ebitda_margin=15&min_revenue=20&sort_by=ebitda. Money is in $M and
+    margins/CAGRs in percent. Deals without a value for sort_by are left out.
+    """
+    sort_column = getattr(models.DealMetrics, sort_by)
+    query = (
+        db.query(*summary_columns(), models.DealMetrics)
+        .join(models.DealMetrics, models.DealMetrics.deal_id == models.Deal.id)
+        .filter(sort_column.isnot(None))
+    )
+    if industry:
+        query = query.filter(models.DealMetrics.industry == industry)
+    for name, value in criteria.model_dump(exclude_none=True).items():
+        bound, field = name.split("_", 1)
+        column = getattr(models.DealMetrics, field)
+        query = query.filter(column >= value if bound == "min" else column <= value)
+
+    if order == "desc":
+        query = query.order_by(sort_column.desc(), models.Deal.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), models.Deal.id.asc())
+    rows = query.offset(offset).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    items = []
+    for row in rows[:limit]:
+        data = dict(row._mapping)
+        data["metrics"] = schemas.DealMetrics.model_validate(data.pop("DealMetrics"))
+        items.append(schemas.DealScreenResult.model_validate(data))
+    if include_feedback:
+        attach_feedback(db, items)
+    return schemas.DealScreenPage(items=items, next_offset=offset + limit if has_more else None)
+
+@app.get("/api/deals/events", tags=["Deals"])
+async def stream_deal_events(
+    req: Request,
+    deal_id: Optional[int] = None,
+    batch_id: Optional[str] = None,
+    last_event_id: Optional[int] = Query(None, description="Resume point when the Last-Event-ID header cannot be set"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream of deal status changes ("Analyzing", "Complete", "Failed",
+    "Removed"), replacing polling of /api/deals. EventSource reconnects send Last-Event-ID
+    and receive what they missed; a "reset" event means too much was missed and the deal
+    list should be refetched. Filter with deal_id or batch_id.
+    """
+    header = req.headers.get("last-event-id")
+    if header and header.strip().isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(
+        deal_events.stream(req.is_disconnected, last_event_id, deal_id, batch_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/deals/events/stats", tags=["System"])
+def get_deal_event_stats(current_user: dict = Depends(get_current_user)):
+    """Subscriber and delivery counters for this API process's event broker."""
+    return deal_events.broker.stats()
+
+@app.get("/api/deals/{deal_id}/runs", response_model=List[schemas.PipelineRun], tags=["Deals"])
+def get_deal_runs(deal_id: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Every processing attempt for a deal, newest first, with per-stage timings and LLM usage."""
+    return (
+        db.query(models.PipelineRun)
+        .filter(models.PipelineRun.deal_id == deal_id)
+        .order_by(models.PipelineRun.id.desc())
+        .all()
+    )
+
+@app.post("/api/deals/{deal_id}/reanalyze", response_model=schemas.Deal, status_code=status.HTTP_202_ACCEPTED, tags=["Deals"])
+def reanalyze_deal(deal_id: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Re-runs the analysis of a deal on the worker pool from its stored text (no S3 download,
+    no PDF extraction, no analysis cache), e.g. after a prompt change or an OpenAI failure.
+    The deal is Analyzing until the job finishes; follow it on /api/deals/events.
+    """
+    deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
+    if deal is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deal not found")
+    if deal.status == "Analyzing":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Deal is already being analyzed.")
+    services.enqueue_reanalysis(db, deal)
+    db.commit()
+    db.refresh(deal)
+    return deal
 
 @app.post("/analyze/", response_model=schemas.Deal, tags=["Deals"])
 async def analyze_document(
-    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user), 
     file: UploadFile = File(...), 
     db: Session = Depends(get_db)
 ):
-    """Endpoint for manual user uploads via the web interface."""
+    """Endpoint for manual user uploads via the web interface. Analysis runs on the worker pool."""
     user_id = current_user.get("sub")
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token")
@@ -112,22 +343,80 @@ async def analyze_document(
     last_name = current_user.get("last_name", "")
     user_name = f"{first_name} {last_name}".strip() or "Anonymous"
     
-    file_contents = await file.read()
+    # UploadFile is already spooled to a temp file; stream it to S3 without reading it into memory.
+    staging_key = await run_in_threadpool(services.stage_upload, file.file, file.filename)
     
-    new_deal = models.Deal(
-        user_id=user_id, 
-        user_name=user_name,
-        file_name=file.filename,
-        status="Analyzing"
-    )
-    db.add(new_deal)
-    db.commit()
+    try:
+        new_deal = models.Deal(
+            user_id=user_id, 
+            user_name=user_name,
+            file_name=file.filename,
+            status="Analyzing"
+        )
+        db.add(new_deal)
+        db.flush()
+        deal_events.record_deal(db, new_deal)
+        # Manual uploads are trusted to be CIMs, so the worker skips the screening call.
+        services.enqueue_pdf_processing(db, new_deal.id, staging_key, file.filename, screen=False)
+        db.commit()
+    except Exception:
+        # No job will ever pick the staged copy up; do not leave it behind.
+        db.rollback()
+        await run_in_threadpool(services.discard_staged_upload, staging_key)
+        raise
     db.refresh(new_deal)
     
-    background_tasks.add_task(perform_analysis_and_update, new_deal.id, file_contents, file.filename)
-    
     return new_deal
 
+@app.post("/api/deals/batch", response_model=schemas.BatchProgress, status_code=status.HTTP_202_ACCEPTED, tags=["Deals"])
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    screen: bool = True,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Uploads a data room: any mix of PDFs and ZIP archives of PDFs. Every PDF becomes a deal,
+    queued with at most BATCH_ANALYSIS_CONCURRENCY analyzed at once. Data rooms mix CIMs with
+    other documents, so files are screened like email attachments (non-CIMs are removed);
+    pass screen=false to analyze every file. Poll GET /api/batches/{batch_id} for progress.
+    """
+    user_id = current_user.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token")
+
+    first_name = current_user.get("first_name", "")
+    last_name = current_user.get("last_name", "")
+    user_name = f"{first_name} {last_name}".strip() or "Anonymous"
+
+    archives = []
+    try:
+        entries, skipped = await run_in_threadpool(batch_upload.collect_entries, files, archives)
+        if not entries:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No PDF files found in the upload.")
+        staged = await batch_upload.stage_entries(entries)
+    finally:
+        for archive in archives:
+            archive.close()
+    if not staged:
+        await run_in_threadpool(batch_upload.discard_entries, entries)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not store files. Please retry.")
+
+    try:
+        batch = await run_in_threadpool(batch_upload.create_batch, db, user_id, user_name, entries, skipped, screen)
+    except Exception:
+        db.rollback()
+        await run_in_threadpool(batch_upload.discard_entries, entries)
+        raise
+    return await run_in_threadpool(batch_upload.batch_progress, db, batch)
+
+@app.get("/api/batches/{batch_id}", response_model=schemas.BatchProgress, tags=["Deals"])
+def get_batch_progress(batch_id: str, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    batch = db.get(models.UploadBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+    return batch_upload.batch_progress(db, batch)
+
 @app.delete("/api/deals/{deal_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Deals"])
 def delete_deal(deal_id: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     """Deletes a deal and its associated file from S3."""
@@ -138,22 +427,144 @@ def delete_deal(deal_id: int, current_user: dict = Depends(get_current_user), db
     if deal.file_name:
         services.delete_from_s3(deal.file_name)
         
+    # Announced in the same transaction, so open deal lists drop the card.
+    deal_events.record_deal(db, deal, "Removed")
     db.delete(deal)
     db.commit()
     return
 
+# --- PDF Delivery Helpers ---
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Inclusive (start, end) for a single "bytes=" range. Returns None when the whole file
+    should be sent (no header, malformed, or multiple ranges, which we serve as a plain 200).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if header.strip() == "*":
+        return True
+    strip = lambda tag: tag.strip().removeprefix("W/")
+    return strip(etag) in {strip(tag) for tag in header.split(",")}
+
+def http_date(value) -> Optional[datetime]:
+    try:
+        return parsedate_to_datetime(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def is_not_modified(req: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = req.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    since = http_date(req.headers.get("if-modified-since"))
+    return since is not None and last_modified <= since
+
+def range_still_valid(req: Request, etag: str, last_modified: datetime) -> bool:
+    """If-Range: only honor the Range header if the client's copy is still current (strong comparison)."""
+    if_range = req.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith("W/"):
+        return False
+    return http_date(if_range) == last_modified
+
+def iter_s3_body(body):
+    try:
+        yield from body.iter_chunks(services.PDF_STREAM_CHUNK_BYTES)
+    finally:
+        body.close()
+
 @app.get("/api/deals/{deal_id}/view-pdf", tags=["Deals"])
-def view_pdf(deal_id: int, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Gets a streaming response for a deal's PDF from S3."""
+def view_pdf(
+    deal_id: int,
+    req: Request,
+    delivery: Optional[str] = Query(None, pattern="^(proxy|redirect|url)$"),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Serves a deal's PDF. In proxy mode the file streams through the API with Range,
+    ETag and conditional GET support, so viewers fetch only the bytes they display.
+    "redirect" and "url" hand out a short-lived presigned S3 URL instead.
+    """
     deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
     if deal is None or not deal.s3_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="PDF not available yet or deal not found.")
-    
-    pdf_stream = services.get_s3_object_stream(deal.file_name)
-    if pdf_stream is None: 
+
+    mode = delivery or services.PDF_DELIVERY_MODE
+    if mode in ("redirect", "url"):
+        url = services.presigned_pdf_url(deal.file_name)
+        if mode == "url":
+            return {"url": url, "expires_in": services.PDF_PRESIGNED_URL_TTL_SECONDS}
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"Cache-Control": "no-store"})
+
+    metadata = services.head_s3_object(deal.file_name)
+    if metadata is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not retrieve PDF.")
-        
-    return StreamingResponse(pdf_stream, media_type="application/pdf", headers={"Content-Disposition": f"inline; filename=\"{deal.file_name}\""})
+    size = metadata["ContentLength"]
+    etag = metadata["ETag"]
+    # HTTP dates have whole-second precision.
+    last_modified = metadata["LastModified"].astimezone(timezone.utc).replace(microsecond=0)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"inline; filename=\"{deal.file_name}\"",
+    }
+    if is_not_modified(req, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = None
+    # An empty object has no byte to address: ignore Range and send the (empty) whole file.
+    if size > 0 and range_still_valid(req, etag, last_modified):
+        try:
+            byte_range = parse_byte_range(req.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+    if byte_range is None:
+        pdf_stream = services.get_s3_object_stream(deal.file_name)
+        status_code = status.HTTP_200_OK
+        headers["Content-Length"] = str(size)
+    else:
+        start, end = byte_range
+        pdf_stream = services.get_s3_object_stream(deal.file_name, f"bytes={start}-{end}")
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+    if pdf_stream is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not retrieve PDF.")
+
+    return StreamingResponse(iter_s3_body(pdf_stream), status_code=status_code, media_type="application/pdf", headers=headers)
 
 @app.post("/api/deals/{deal_id}/feedback", response_model=schemas.Feedback, tags=["Feedback"])
 def create_feedback_for_deal(deal_id: int, feedback: schemas.FeedbackCreate, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
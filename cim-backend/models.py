@@ -1,7 +1,18 @@
-from sqlalchemy import Column, Integer, String, JSON, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, JSON, ForeignKey, DateTime, Index, Computed, UniqueConstraint, LargeBinary, func
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from database import Base
 
+# Full-text document for deal search, weighted by where the words appear. Postgres keeps
+# the generated column in sync on every write of analysis_data.
+DEAL_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english'::regconfig, coalesce(analysis_data #>> '{company,name}', '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(analysis_data #>> '{company,description}', '')), 'B') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(analysis_data ->> 'summary', '')), 'B') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(analysis_data ->> 'thesis', '')), 'C') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(analysis_data ->> 'red_flags', '')), 'C')"
+)
+
 class Deal(Base):
     __tablename__ = "deals"
     id = Column(Integer, primary_key=True, index=True)
@@ -11,8 +22,29 @@ class Deal(Base):
     s3_url = Column(String, nullable=True) # S3 URL can be null initially
     # --- NEW: Status to track analysis progress ---
     status = Column(String, default="Pending") # e.g., "Pending", "Analyzing", "Complete", "Failed"
-    analysis_data = Column(JSON, nullable=True) # Analysis can be null initially
+    analysis_data = Column(JSONB, nullable=True) # Analysis can be null initially
+    search_vector = deferred(Column(TSVECTOR, Computed(DEAL_SEARCH_DOCUMENT, persisted=True)))
+    # --- Summary fields copied out of analysis_data so list views can skip the JSON ---
+    company_name = Column(String, nullable=True)
+    industry = Column(String, nullable=True)
+    confidence_score = Column(Integer, nullable=True)
+    # Set for deals created by one /api/deals/batch upload (a data room); see UploadBatch.
+    batch_id = Column(String, nullable=True, index=True)
+    # Top-level analysis sections stored so far while the analysis streams in ("company", "financials", ...).
+    # While set, analysis_data is partial; it is cleared when the analysis completes.
+    analysis_sections = Column(JSON, nullable=True)
     feedbacks = relationship("Feedback", back_populates="deal", cascade="all, delete-orphan")
+    metrics = relationship("DealMetrics", back_populates="deal", uselist=False, cascade="all, delete-orphan")
+    # Keyset pagination walks id descending within each filter.
+    __table_args__ = (
+        Index("ix_deals_status_id", "status", "id"),
+        Index("ix_deals_user_id_id", "user_id", "id"),
+        Index("ix_deals_industry_id", "industry", "id"),
+        # Containment (@>) on any analysis field, e.g. {"industry": ...} or {"ibis_industries": [...]}.
+        Index("ix_deals_analysis_data", "analysis_data", postgresql_using="gin",
+              postgresql_ops={"analysis_data": "jsonb_path_ops"}),
+        Index("ix_deals_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
 class Feedback(Base):
     __tablename__ = "feedback"
@@ -21,5 +53,202 @@ class Feedback(Base):
     user_name = Column(String, default="Anonymous")
     comment = Column(String)
     ratings = Column(JSON)
-    deal_id = Column(Integer, ForeignKey("deals.id"))
+    deal_id = Column(Integer, ForeignKey("deals.id"), index=True)
     deal = relationship("Deal", back_populates="feedbacks")
+
+class DealMetrics(Base):
+    """
+    Numeric copy of a deal's headline financials, parsed from analysis_data by
+    financial_metrics. Money in $M, margins and growth rates in percentage points.
+    """
+    __tablename__ = "deal_metrics"
+    deal_id = Column(Integer, ForeignKey("deals.id", ondelete="CASCADE"), primary_key=True)
+    industry = Column(String, nullable=True) # copied from deals.industry for (industry, metric) indexes
+    year = Column(Integer, nullable=True)
+    revenue = Column(Float, nullable=True)
+    ebitda = Column(Float, nullable=True)
+    ebitda_margin = Column(Float, nullable=True)
+    gross_margin = Column(Float, nullable=True)
+    capex = Column(Float, nullable=True)
+    capex_pct_revenue = Column(Float, nullable=True)
+    fcf = Column(Float, nullable=True)
+    estimate_year = Column(Integer, nullable=True)
+    estimate_revenue = Column(Float, nullable=True)
+    estimate_ebitda = Column(Float, nullable=True)
+    estimate_capex = Column(Float, nullable=True)
+    estimate_fcf = Column(Float, nullable=True)
+    historical_revenue_cagr = Column(Float, nullable=True)
+    projected_revenue_cagr = Column(Float, nullable=True)
+    historical_fcf_cagr = Column(Float, nullable=True)
+    projected_fcf_cagr = Column(Float, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    deal = relationship("Deal", back_populates="metrics")
+    # Screens filter by industry and range/sort on one headline metric.
+    __table_args__ = (
+        Index("ix_deal_metrics_revenue", "revenue"),
+        Index("ix_deal_metrics_ebitda", "ebitda"),
+        Index("ix_deal_metrics_ebitda_margin", "ebitda_margin"),
+        Index("ix_deal_metrics_projected_revenue_cagr", "projected_revenue_cagr"),
+        Index("ix_deal_metrics_industry_revenue", "industry", "revenue"),
+        Index("ix_deal_metrics_industry_ebitda", "industry", "ebitda"),
+        Index("ix_deal_metrics_industry_ebitda_margin", "industry", "ebitda_margin"),
+        Index("ix_deal_metrics_year_revenue", "year", "revenue"),
+    )
+
+class AnalysisJob(Base):
+    """Durable queue entry for background PDF processing, claimed by worker.py."""
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    deal_id = Column(Integer, ForeignKey("deals.id", ondelete="CASCADE"), index=True)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="queued") # "queued", "running", "done", "failed"
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    locked_by = Column(String, nullable=True)
+    last_error = Column(String, nullable=True)
+    # Jobs sharing a concurrency_key (e.g. the attachments of one email) run at most concurrency_limit at a time.
+    concurrency_key = Column(String, nullable=True)
+    concurrency_limit = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    __table_args__ = (
+        Index("ix_analysis_jobs_claim", "status", "run_after"),
+        Index("ix_analysis_jobs_concurrency", "concurrency_key", "status"),
+    )
+
+class UploadBatch(Base):
+    """
+    One multi-file or ZIP upload. Its deals carry batch_id, so progress is a GROUP BY
+    over deals.status; deals the pipeline removed count against file_count.
+    """
+    __tablename__ = "upload_batches"
+    id = Column(String, primary_key=True) # uuid hex, returned to the client
+    user_id = Column(String, index=True)
+    user_name = Column(String, default="Anonymous")
+    file_count = Column(Integer, nullable=False, default=0)
+    skipped = Column(JSON, nullable=True) # [{"file_name": ..., "reason": ...}] for entries not queued
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class DealEvent(Base):
+    """
+    Append-only log of deal status changes, pushed to clients by deal_events. The id is
+    the SSE event id, so a reconnecting client resumes from Last-Event-ID. No foreign
+    key: the event announcing a removed deal outlives the deal.
+    """
+    __tablename__ = "deal_events"
+    id = Column(BigInteger, primary_key=True)
+    deal_id = Column(Integer, nullable=False, index=True)
+    status = Column(String, nullable=False) # "Analyzing", "Complete", "Failed" or "Removed"
+    data = Column(JSON, nullable=True) # file_name, company_name, industry, user_id, batch_id; sections while partial
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    __table_args__ = (
+        Index("ix_deal_events_created_at", "created_at"),
+    )
+
+class PipelineRun(Base):
+    """
+    One row per job attempt with where its time and money went, written by jobs.run_next_job
+    from an instrumentation.PipelineTrace. No foreign key, so runs of removed deals stay inspectable.
+    """
+    __tablename__ = "pipeline_runs"
+    id = Column(BigInteger, primary_key=True)
+    deal_id = Column(Integer, nullable=True, index=True)
+    job_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+    attempt = Column(Integer, nullable=False, default=1)
+    worker = Column(String, nullable=True)
+    outcome = Column(String, nullable=False) # "done", "retry", "failed" or "lost" (lease reclaimed by another worker)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    queue_wait_seconds = Column(Float, nullable=True)
+    total_seconds = Column(Float, nullable=False)
+    stages = Column(JSON, nullable=True) # {"s3_download": 0.41, "screen": 0.02, "analyze": 38.2, ...}
+    llm = Column(JSON, nullable=True) # per model: requests, prompt/completion tokens, cost_usd, seconds
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    file_bytes = Column(BigInteger, nullable=True)
+    pages_total = Column(Integer, nullable=True)
+    pages_extracted = Column(Integer, nullable=True)
+    extracted_chars = Column(Integer, nullable=True)
+    # Estimated document tokens before and after text_preprocessing.
+    text_tokens_raw = Column(Integer, nullable=True)
+    text_tokens_clean = Column(Integer, nullable=True)
+    # Seconds from the job starting to the first streamed analysis section stored on the deal.
+    first_content_seconds = Column(Float, nullable=True)
+    __table_args__ = (
+        Index("ix_pipeline_runs_started_at", "started_at"),
+    )
+
+class DocumentText(Base):
+    """
+    Extracted text of a deal's PDF, compressed, written by the pipeline right after extraction.
+    Re-analysis (POST /api/deals/{id}/reanalyze, reanalyze.py) reads it instead of downloading
+    and extracting the PDF again. See text_store.py.
+    """
+    __tablename__ = "document_texts"
+    id = Column(Integer, primary_key=True)
+    deal_id = Column(Integer, ForeignKey("deals.id", ondelete="CASCADE"), nullable=False, index=True)
+    file_hash = Column(String, nullable=False) # SHA-256 of the PDF bytes
+    text_hash = Column(String, nullable=True) # analysis_cache.hash_text of the text
+    page_count = Column(Integer, nullable=False)
+    chars = Column(Integer, nullable=False)
+    compressed_bytes = Column(Integer, nullable=False)
+    pages = deferred(Column(LargeBinary, nullable=False)) # zlib-compressed JSON list of page texts
+    tables = Column(JSON, nullable=True) # financial_tables output: rewritten pages and figures
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    __table_args__ = (
+        UniqueConstraint("deal_id", "file_hash", name="uq_document_texts_deal_file"),
+    )
+
+class AnalysisCacheEntry(Base):
+    """
+    Content-addressed analysis cache shared by every worker (analysis_cache.py): the screening
+    verdict, extracted text and analysis of a PDF, keyed by its file hash and findable by the
+    hash of its normalized text. A re-sent copy is answered from here without calling OpenAI.
+    """
+    __tablename__ = "analysis_cache_entries"
+    file_hash = Column(String, primary_key=True) # SHA-256 of the PDF bytes
+    text_hash = Column(String, nullable=True, index=True) # analysis_cache.hash_text; None for non-CIMs
+    is_cim = Column(Boolean, nullable=False)
+    version = Column(String, nullable=True) # AnalysisCache.version (prompts) the result was produced with
+    chars = Column(Integer, nullable=False, default=0)
+    text = deferred(Column(LargeBinary, nullable=True)) # zlib-compressed extracted text
+    analysis_data = Column(JSONB, nullable=True)
+    file_hits = Column(Integer, nullable=False, default=0)
+    text_hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
+class IdempotencyKey(Base):
+    """
+    One row per webhook delivery token, email Message-Id or attachment hash already
+    ingested. The unique constraint makes claiming a key atomic across API processes.
+    """
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True)
+    scope = Column(String, nullable=False) # "token", "message" or "attachment"
+    key = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="processing") # "processing" or "done"
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+class LLMRateBucket(Base):
+    """
+    Token-bucket state shared by every process calling OpenAI (llm_gateway.SharedTokenBucket),
+    one row per model and kind ("gpt-4o:tokens", "gpt-4o:requests"). Updated with single
+    conditional UPDATEs, so concurrent workers never overspend the account's budget.
+    """
+    __tablename__ = "llm_rate_buckets"
+    name = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,178 @@
+# cim-backend/pdf_extraction.py
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import fitz # PyMuPDF
+
+# --- Extraction Configuration ---
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Below this many pages the process hand-off costs more than it saves.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+
+@dataclass
+class PageText:
+    number: int # zero-based page index
+    text: str
+    seconds: float
+
+@dataclass
+class ExtractionResult:
+    pages: List[PageText] = field(default_factory=list)
+    seconds: float = 0.0
+    workers: int = 1
+
+    @property
+    def text(self) -> str:
+        return "".join(page.text for page in self.pages)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+# --- Worker-side Extraction ---
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[PageText]:
+    """Runs in a pool process: opens its own handle on the PDF and extracts pages [start, stop)."""
+    pages = []
+    with fitz.open(path, filetype="pdf") as doc:
+        for number in range(start, stop):
+            began = time.perf_counter()
+            text = doc[number].get_text()
+            pages.append(PageText(number, text, time.perf_counter() - began))
+    return pages
+
+# --- Process Pool ---
+# One pool per process, created on first use and shared by every worker thread.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" avoids forking a process that already runs worker threads.
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+def _split_ranges(start: int, stop: int, parts: int) -> List[tuple]:
+    size = max(1, -(-(stop - start) // parts))
+    return [(i, min(i + size, stop)) for i in range(start, stop, size)]
+
+def page_count(path: str) -> int:
+    with fitz.open(path, filetype="pdf") as doc:
+        return doc.page_count
+
+def extract_pages(path: str, start: int = 0, stop: Optional[int] = None,
+                  workers: int = PDF_EXTRACT_WORKERS,
+                  min_pages: int = PDF_PARALLEL_MIN_PAGES) -> ExtractionResult:
+    """
+    Extracts pages [start, stop) of the PDF at `path`, spreading page ranges across
+    the process pool when there are enough of them. Pages come back in document order.
+    """
+    began = time.perf_counter()
+    if stop is None:
+        stop = page_count(path)
+    total = max(0, stop - start)
+
+    if workers <= 1 or total < max(min_pages, 2):
+        pages = _extract_page_range(path, start, stop) if total else []
+        return ExtractionResult(pages, time.perf_counter() - began, 1)
+
+    # A few more ranges than workers keeps the pool busy when some pages are slower than others.
+    ranges = _split_ranges(start, stop, workers * 2)
+    pool = _get_pool(workers)
+    futures = [pool.submit(_extract_page_range, path, a, b) for a, b in ranges]
+    pages = [page for future in futures for page in future.result()]
+    return ExtractionResult(pages, time.perf_counter() - began, min(workers, len(ranges)))
+
+# --- Lazy, Incremental Extraction ---
+
+class LazyPdfText:
+    """
+    Reads pages only when asked for them. The CIM pre-screen pulls just the leading
+    pages it needs via prefix(); full_text() then extracts the rest (in parallel when
+    large enough) and reuses every page already read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pages: List[PageText] = []
+        self._doc = None
+        self._page_count: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    @property
+    def page_count(self) -> int:
+        if self._page_count is None:
+            self._page_count = self._open().page_count
+        return self._page_count
+
+    def _open(self):
+        if self._doc is None:
+            self._doc = fitz.open(self.path, filetype="pdf")
+        return self._doc
+
+    def _read_next_page(self) -> Optional[PageText]:
+        number = len(self.pages)
+        if number >= self.page_count:
+            return None
+        began = time.perf_counter()
+        page = PageText(number, self._open()[number].get_text(), 0.0)
+        page.seconds = time.perf_counter() - began
+        self.pages.append(page)
+        return page
+
+    def iter_pages(self):
+        """Yields pages in order, extracting each one the first time it is reached."""
+        for page in list(self.pages):
+            yield page
+        while True:
+            page = self._read_next_page()
+            if page is None:
+                return
+            yield page
+
+    def prefix(self, chars: int) -> str:
+        """Returns the first `chars` characters of text, reading only as many pages as that takes."""
+        collected = []
+        length = 0
+        for page in self.iter_pages():
+            collected.append(page.text)
+            length += len(page.text)
+            if length >= chars:
+                break
+        return "".join(collected)[:chars]
+
+    def full_text(self) -> str:
+        if len(self.pages) < self.page_count:
+            self.close()
+            rest = extract_pages(self.path, start=len(self.pages), stop=self.page_count)
+            self.pages.extend(rest.pages)
+        return "".join(page.text for page in self.pages)
+
+    @property
+    def extraction_seconds(self) -> float:
+        return sum(page.seconds for page in self.pages)
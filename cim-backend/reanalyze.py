@@ -0,0 +1,74 @@
+# reanalyze.py
+#
+# Bulk re-analysis, e.g. after a SYSTEM_PROMPT change or an OpenAI outage. Queues a
+# "reanalyze" job per selected deal; the worker pool runs them from the stored text
+# (text_store.py), at most REANALYSIS_CONCURRENCY at a time, so new uploads keep
+# flowing. Deals already being analyzed are skipped. Safe to run repeatedly.
+#
+# Usage (from cim-backend/):
+#   python reanalyze.py --status Failed         # retry deals that failed
+#   python reanalyze.py --all                   # every analyzed or failed deal
+#   python reanalyze.py --ids 12 40 41 --dry-run
+import os
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    print("\nFATAL ERROR: DATABASE_URL environment variable is not set.")
+    exit()
+
+from database import SessionLocal
+import models
+import services
+
+ENQUEUE_BATCH_SIZE = 500
+
+def select_deals(query, statuses=None, ids=None):
+    query = query.filter(models.Deal.status != "Analyzing")
+    if ids:
+        query = query.filter(models.Deal.id.in_(ids))
+    if statuses:
+        query = query.filter(models.Deal.status.in_(statuses))
+    return query
+
+def enqueue_reanalyses(statuses=None, ids=None, dry_run: bool = False) -> int:
+    """Queues matching deals in batches of ENQUEUE_BATCH_SIZE, one commit per batch."""
+    db = SessionLocal()
+    try:
+        queued = 0
+        last_id = 0
+        while True:
+            deals = (
+                select_deals(db.query(models.Deal), statuses, ids)
+                .filter(models.Deal.id > last_id)
+                .order_by(models.Deal.id)
+                .limit(ENQUEUE_BATCH_SIZE)
+                .all()
+            )
+            if not deals:
+                break
+            if not dry_run:
+                for deal in deals:
+                    services.enqueue_reanalysis(db, deal)
+                db.commit()
+            queued += len(deals)
+            last_id = deals[-1].id
+        return queued
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue re-analysis of existing deals from their stored text.")
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--status", nargs="+", help='Deal statuses to re-analyze, e.g. "Failed" or "Complete"')
+    selection.add_argument("--ids", nargs="+", type=int, help="Deal ids to re-analyze")
+    selection.add_argument("--all", action="store_true", help="Every deal that is Complete or Failed")
+    parser.add_argument("--dry-run", action="store_true", help="Count the matching deals without queueing them")
+    args = parser.parse_args()
+
+    statuses = ["Complete", "Failed"] if args.all else args.status
+    count = enqueue_reanalyses(statuses=statuses, ids=args.ids, dry_run=args.dry_run)
+    verb = "would be queued" if args.dry_run else "queued"
+    print(f"{count} deal(s) {verb} for re-analysis, {services.REANALYSIS_CONCURRENCY} at a time.")
@@ -21,7 +21,7 @@ print(f"Database URL found, ending in: ...{DATABASE_URL[-15:]}")
 # We define the imports *after* checking the URL to fail faster.
 from database import engine, Base
 # Import the specific model classes that define the schema
-from models import Deal, Feedback
+from models import Deal, Feedback, DealMetrics, AnalysisJob, IdempotencyKey, UploadBatch, DealEvent, PipelineRun, DocumentText, LLMRateBucket, AnalysisCacheEntry
 
 def reset_database():
     """
@@ -47,7 +47,7 @@ def reset_database():
 
     try:
         print("\nDropping all tables...")
-        # The Base object knows about all tables that inherit from it (Deal, Feedback)
+        # The Base object knows about all tables that inherit from it (Deal, Feedback, AnalysisJob)
         Base.metadata.drop_all(bind=engine)
         print("All tables dropped successfully.")
 
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, UploadFile, Form
+from fastapi import APIRouter, Request, Depends, HTTPException, Form, status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
 from sqlalchemy.orm import Session
+import asyncio
 import logging
 import os
+import time
+import uuid
 import hmac
 import hashlib
-from typing import Optional
+from typing import List, Optional
 
-# Import your existing services, schemas, and database configuration
+# Import your existing services, models, and database configuration
 # This has been changed from a relative import to an absolute import to fix the ImportError.
 import services
-import schemas
+import models
 import database
+import idempotency
+import deal_events
+from analysis_cache import hash_stream
 
 router = APIRouter()
 
@@ -18,6 +26,16 @@ router = APIRouter()
 # not hardcoded in the source code.
 MAILGUN_API_KEY = os.environ.get("MAILGUN_API_KEY")
 
+# --- Ingestion Limits ---
+EMAIL_MAX_ATTACHMENTS = int(os.getenv("EMAIL_MAX_ATTACHMENTS", "20"))
+# Attachments of one email staged to S3, and analyzed by the workers, at the same time.
+EMAIL_ATTACHMENT_CONCURRENCY = int(os.getenv("EMAIL_ATTACHMENT_CONCURRENCY", "3"))
+# Deals created from email are owned by this system user.
+EMAIL_INGEST_USER_ID = os.getenv("EMAIL_INGEST_USER_ID", "email-ingest")
+# Signed requests older (or further in the future) than this are rejected as replays. Tokens are
+# remembered for twice as long, so any timestamp we accept is still covered by the token store.
+WEBHOOK_MAX_AGE_SECONDS = int(os.getenv("WEBHOOK_MAX_AGE_SECONDS", "900"))
+
 def verify_mailgun_webhook(token: str, timestamp: str, signature: str) -> bool:
     """
     Verifies the signature of the Mailgun webhook to ensure it's authentic.
@@ -27,19 +45,84 @@ def verify_mailgun_webhook(token: str, timestamp: str, signature: str) -> bool:
     if not MAILGUN_API_KEY:
         logging.error("MAILGUN_API_KEY environment variable is not set. Cannot verify webhook.")
         # In a production environment, you should return False to reject the request.
-        return False 
-    
+        return False
+
     # The signature is an HMAC-SHA256 hash of the timestamp and token, signed with your API key.
     hmac_digest = hmac.new(
         key=MAILGUN_API_KEY.encode(),
         msg=f"{timestamp}{token}".encode(),
         digestmod=hashlib.sha256
     ).hexdigest()
-    
+
     # Use hmac.compare_digest for a secure, constant-time comparison.
     return hmac.compare_digest(hmac_digest, signature)
 
-@router.post("/webhook", tags=["Email Ingestion"])
+def is_pdf_attachment(attachment: UploadFile) -> bool:
+    """Checks the PDF magic bytes, so signature images and other attachments never reach the queue."""
+    head = attachment.file.read(5)
+    attachment.file.seek(0)
+    return head == b"%PDF-"
+
+def collect_attachments(form, attachment_count: int) -> tuple:
+    """Returns (pdf attachments, names of skipped attachments), in Mailgun's attachment-N order."""
+    fields = [f"attachment-{i}" for i in range(1, attachment_count + 1)]
+    if not attachment_count:
+        fields = sorted((key for key in form.keys() if key.startswith("attachment-")),
+                        key=lambda key: int(key.rsplit("-", 1)[-1]) if key.rsplit("-", 1)[-1].isdigit() else 0)
+    pdfs, skipped = [], []
+    for field in fields:
+        attachment = form.get(field)
+        if not isinstance(attachment, UploadFile):
+            continue
+        if is_pdf_attachment(attachment):
+            pdfs.append(attachment)
+        else:
+            skipped.append(attachment.filename or field)
+    return pdfs, skipped
+
+async def stage_attachments(attachments: List[UploadFile]) -> List[Optional[str]]:
+    """Streams attachments to S3 staging, a few at a time. Failed uploads come back as None."""
+    semaphore = asyncio.Semaphore(EMAIL_ATTACHMENT_CONCURRENCY)
+
+    async def stage(attachment: UploadFile) -> Optional[str]:
+        async with semaphore:
+            try:
+                return await run_in_threadpool(services.stage_upload, attachment.file, attachment.filename)
+            except Exception as e:
+                logging.error(f"Could not stage attachment {attachment.filename}: {e}", exc_info=True)
+                return None
+
+    return await asyncio.gather(*(stage(attachment) for attachment in attachments))
+
+def create_email_deals(db: Session, staged: List[tuple], sender: Optional[str], concurrency_key: str) -> List[int]:
+    """Creates one deal and one screened process_pdf job per staged attachment, in a single commit."""
+    deal_ids = []
+    for file_name, staging_key in staged:
+        deal = models.Deal(user_id=EMAIL_INGEST_USER_ID, user_name=sender or "Email Ingest",
+                           file_name=file_name, status="Analyzing")
+        db.add(deal)
+        db.flush()
+        deal_events.record_deal(db, deal)
+        services.enqueue_pdf_processing(db, deal.id, staging_key, file_name, screen=True,
+                                        concurrency_key=concurrency_key,
+                                        concurrency_limit=EMAIL_ATTACHMENT_CONCURRENCY)
+        deal_ids.append(deal.id)
+    db.commit()
+    return deal_ids
+
+def deal_is_live(db: Session, deal_id: Optional[int]) -> bool:
+    """Whether an earlier ingest's deal still stands: not deleted (by a user or as a non-CIM) and not Failed."""
+    if deal_id is None:
+        return False
+    deal_status = db.query(models.Deal.status).filter(models.Deal.id == deal_id).scalar()
+    return deal_status is not None and deal_status != "Failed"
+
+def discard_staged(staging_keys: List[Optional[str]]):
+    for staging_key in staging_keys:
+        if staging_key:
+            services.discard_staged_upload(staging_key)
+
+@router.post("/webhook", status_code=status.HTTP_202_ACCEPTED, tags=["Email Ingestion"])
 async def receive_email(
     request: Request,
     db: Session = Depends(database.get_db),
@@ -51,20 +134,33 @@ async def receive_email(
     sender: Optional[str] = Form(None),
     recipient: Optional[str] = Form(None),
     subject: Optional[str] = Form(None),
-    body_plain: Optional[str] = Form(None, alias='body-plain'),
+    message_id: Optional[str] = Form(None, alias='Message-Id'),
     # Mailgun provides the number of attachments.
     attachment_count: Optional[int] = Form(0, alias='attachment-count'),
 ):
     """
     This endpoint receives incoming emails from a Mailgun route.
-    It verifies the request, processes attachments, and creates deals for valid CIMs.
+    It verifies the request, stages each PDF attachment in S3 and queues it for the
+    worker pool (CIM screening, then analysis), then acknowledges with 202 Accepted.
+    Nothing is analyzed inside the request, so Mailgun never times out and retries.
+    Redeliveries (same token, Message-Id or attachment content) return the original
+    result instead of starting another analysis.
     """
     # --- 1. Verify the Webhook Signature ---
     # It's highly recommended to enforce verification in a production environment.
+    claimed = []
     if all([timestamp, token, signature]):
         if not verify_mailgun_webhook(token, timestamp, signature):
             logging.warning("Mailgun webhook verification failed. Rejecting request.")
             raise HTTPException(status_code=401, detail="Invalid webhook signature")
+        if not is_fresh_timestamp(timestamp):
+            logging.warning(f"Rejecting Mailgun webhook with stale timestamp {timestamp}.")
+            raise HTTPException(status_code=401, detail="Stale webhook timestamp")
+        # The same signed token twice is a replay of one delivery.
+        replay = await run_in_threadpool(idempotency.claim, db, "token", token, 2 * WEBHOOK_MAX_AGE_SECONDS)
+        if not replay.acquired:
+            return previous_delivery(replay)
+        claimed.append(replay.record_id)
     else:
         # If signature fields are missing, log a warning. You might want to reject
         # these requests in production for maximum security.
@@ -72,60 +168,108 @@ async def receive_email(
 
     logging.info(f"Received verified email from: {sender} to: {recipient} with subject: {subject}")
 
-    # --- 2. Check for Attachments ---
-    if not attachment_count or attachment_count == 0:
-        logging.info("Email received, but it has no attachments to process.")
-        return {"message": "Email received, no attachments found."}
+    # --- 2. Deduplicate Redeliveries of the Same Email ---
+    if message_id:
+        delivery = await run_in_threadpool(idempotency.claim, db, "message", message_id)
+        if not delivery.acquired:
+            await run_in_threadpool(idempotency.release, db, claimed)
+            return previous_delivery(delivery)
+        claimed.append(delivery.record_id)
 
-    # --- 3. Process Each Attachment ---
-    form_data = await request.form()
-    deals_created = []
+    try:
+        response, results = await ingest_attachments(request, db, sender, message_id or token, attachment_count or 0)
+    except Exception:
+        # Forget this delivery so Mailgun's retry is processed from scratch.
+        await run_in_threadpool(idempotency.release, db, claimed)
+        raise
+    results.update({record_id: response for record_id in claimed})
+    await run_in_threadpool(idempotency.finish, db, results)
+    try:
+        await run_in_threadpool(idempotency.purge_expired, db)
+    except Exception as e:
+        logging.warning(f"Could not purge expired idempotency keys: {e}")
+    return response
 
-    for i in range(1, attachment_count + 1):
-        attachment_field_name = f'attachment-{i}'
-        if attachment_field_name in form_data:
-            attachment_file: UploadFile = form_data[attachment_field_name]
-            filename = attachment_file.filename
-            file_content = await attachment_file.read()
-            
-            logging.info(f"Processing attachment: {filename}")
+def is_fresh_timestamp(timestamp: str) -> bool:
+    try:
+        return abs(time.time() - float(timestamp)) <= WEBHOOK_MAX_AGE_SECONDS
+    except ValueError:
+        return False
 
-            try:
-                # --- 4. Call the CIM Processing Service ---
-                # This is the "chat call" that analyzes the document.
-                extracted_data = services.process_cim(file_content=file_content, filename=filename)
-
-                # --- 5. Check if it's a CIM and Create a Deal ---
-                if extracted_data.get("is_cim"):
-                    logging.info(f"Attachment '{filename}' identified as a CIM. Creating deal.")
-                    
-                    # Map the data extracted by the AI to your database schema.
-                    deal_schema = schemas.DealCreate(
-                        company_name=extracted_data.get("company_name", "N/A"),
-                        industry=extracted_data.get("industry", "N/A"),
-                        summary=extracted_data.get("summary", ""),
-                        key_highlights=extracted_data.get("key_highlights", []),
-                        financials=extracted_data.get("financials", {}),
-                        score=extracted_data.get("score", 0),
-                        # Note: user_id is not included here. Your database/model
-                        # should handle cases where a deal is created by the system.
-                        # This might involve making the user_id nullable or assigning
-                        # it to a default system user.
-                    )
-                    
-                    # Save the new deal to the database.
-                    deal = services.create_deal(db=db, deal=deal_schema)
-                    deals_created.append(deal.id)
-                    logging.info(f"Successfully created deal with ID: {deal.id}")
-                else:
-                    logging.info(f"Attachment '{filename}' was processed but is not a CIM. Skipping deal creation.")
+def previous_delivery(claim: idempotency.Claim) -> dict:
+    """Response for a delivery we have already seen: the original result, or a note that it is in flight."""
+    if claim.status == "done" and claim.result is not None:
+        logging.info("Duplicate Mailgun delivery; returning the original result.")
+        return {**claim.result, "duplicate": True}
+    logging.info("Duplicate Mailgun delivery while the original is still being ingested.")
+    return {"message": "This email is already being processed.", "deal_ids": [], "skipped": [], "duplicate": True}
 
-            except Exception as e:
-                # Log errors but continue processing other attachments.
-                logging.error(f"An error occurred while processing attachment {filename}: {e}", exc_info=True)
+async def ingest_attachments(request: Request, db: Session, sender: Optional[str], group: Optional[str],
+                             attachment_count: int) -> tuple:
+    """
+    Stages and queues the PDF attachments not seen before. Returns the response and the
+    idempotency results for this email's attachment claims; raises HTTPException(503) on failure.
+    """
+    # --- 3. Collect PDF Attachments ---
+    form_data = await request.form()
+    attachments, skipped = collect_attachments(form_data, attachment_count)
+    if len(attachments) > EMAIL_MAX_ATTACHMENTS:
+        logging.warning(f"Email has {len(attachments)} PDF attachments; only the first {EMAIL_MAX_ATTACHMENTS} are processed.")
+        skipped += [attachment.filename for attachment in attachments[EMAIL_MAX_ATTACHMENTS:]]
+        attachments = attachments[:EMAIL_MAX_ATTACHMENTS]
+    if not attachments:
+        logging.info("Email received, but it has no PDF attachments to process.")
+        return {"message": "Email received, no PDF attachments found.", "deal_ids": [], "skipped": skipped}, {}
+
+    # --- 4. Skip Attachments Already Ingested (by content hash) ---
+    new_attachments, claims, digests, duplicates = [], [], [], []
+    staging_keys = []
+    try:
+        for attachment in attachments:
+            digest = await run_in_threadpool(hash_stream, attachment.file)
+            if digest in digests:
+                duplicates.append({"file_name": attachment.filename, "digest": digest})
                 continue
+            claim = await run_in_threadpool(idempotency.claim, db, "attachment", digest)
+            if not claim.acquired and claim.status == "done":
+                deal_id = (claim.result or {}).get("deal_id")
+                if not await run_in_threadpool(deal_is_live, db, deal_id):
+                    # The earlier deal is gone or failed; ingest the attachment again rather than point at it.
+                    claim = await run_in_threadpool(idempotency.take_over, db, claim.record_id)
+            if claim.acquired:
+                new_attachments.append(attachment)
+                claims.append(claim.record_id)
+                digests.append(digest)
+            else:
+                duplicates.append({"file_name": attachment.filename, "deal_id": (claim.result or {}).get("deal_id")})
 
-    if deals_created:
-        return {"message": f"Successfully processed {attachment_count} attachment(s) and created {len(deals_created)} deal(s).", "deal_ids": deals_created}
-    else:
-        return {"message": "Attachments were processed, but no new CIMs were found to create deals."}
+        # --- 5. Persist Attachments ---
+        staging_keys = await stage_attachments(new_attachments)
+        if not all(staging_keys):
+            # Let Mailgun redeliver the whole email rather than half-ingesting it.
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not store attachments. Please retry.")
+
+        # --- 6. Queue One Analysis Job per Attachment ---
+        concurrency_key = f"email:{group or uuid.uuid4().hex}"
+        staged = [(attachment.filename, staging_key) for attachment, staging_key in zip(new_attachments, staging_keys)]
+        try:
+            deal_ids = await run_in_threadpool(create_email_deals, db, staged, sender, concurrency_key) if staged else []
+        except Exception as e:
+            logging.error(f"Could not queue email attachments: {e}", exc_info=True)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not queue attachments. Please retry.")
+    except BaseException:
+        # Not ingested: drop what was staged and forget the attachment claims, so the retry ingests them.
+        db.rollback()
+        await run_in_threadpool(discard_staged, staging_keys)
+        await run_in_threadpool(idempotency.release, db, claims)
+        raise
+
+    logging.info(f"Queued {len(deal_ids)} attachment(s) for analysis: deals {deal_ids}")
+    # Copies of an attachment earlier in this same email point at its deal.
+    deal_by_digest = dict(zip(digests, deal_ids))
+    for duplicate in duplicates:
+        if "digest" in duplicate:
+            duplicate["deal_id"] = deal_by_digest.get(duplicate.pop("digest"))
+    response = {"message": f"Accepted {len(deal_ids)} attachment(s) for analysis.", "deal_ids": deal_ids,
+                "skipped": skipped, "already_ingested": duplicates}
+    return response, {record_id: {"deal_id": deal_id} for record_id, deal_id in zip(claims, deal_ids)}
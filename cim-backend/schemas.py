@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, create_model
 from typing import List, Dict, Any, Optional
+from datetime import datetime
 
 class FeedbackBase(BaseModel):
     comment: str
@@ -23,6 +24,8 @@ class DealBase(BaseModel):
     analysis_data: Optional[Dict[str, Any]] = None
     # --- NEW ---
     status: str
+    # Sections of analysis_data already written while it streams in; null once the analysis is complete.
+    analysis_sections: Optional[List[str]] = None
 
 class Deal(DealBase):
     id: int
@@ -31,3 +34,115 @@ class Deal(DealBase):
     feedbacks: List[Feedback] = []
     class Config:
         from_attributes = True
+
+# --- Lightweight projection for list views (no analysis_data) ---
+class DealSummary(BaseModel):
+    id: int
+    file_name: str
+    status: str
+    user_id: Optional[str] = None
+    user_name: Optional[str] = "Anonymous"
+    company_name: Optional[str] = None
+    industry: Optional[str] = None
+    confidence_score: Optional[int] = None
+    analysis_sections: Optional[List[str]] = None
+    feedback_count: int = 0
+    feedbacks: Optional[List[Feedback]] = None
+    class Config:
+        from_attributes = True
+
+class DealPage(BaseModel):
+    items: List[DealSummary]
+    # Pass as before_id to fetch the next page; null on the last page.
+    next_cursor: Optional[int] = None
+
+class DealSearchResult(DealSummary):
+    rank: Optional[float] = None
+
+class DealSearchPage(BaseModel):
+    items: List[DealSearchResult]
+    # Pass as offset to fetch the next page; null on the last page.
+    next_offset: Optional[int] = None
+
+class DealMetrics(BaseModel):
+    year: Optional[int] = None
+    revenue: Optional[float] = None
+    ebitda: Optional[float] = None
+    ebitda_margin: Optional[float] = None
+    gross_margin: Optional[float] = None
+    capex: Optional[float] = None
+    capex_pct_revenue: Optional[float] = None
+    fcf: Optional[float] = None
+    estimate_year: Optional[int] = None
+    estimate_revenue: Optional[float] = None
+    estimate_ebitda: Optional[float] = None
+    estimate_capex: Optional[float] = None
+    estimate_fcf: Optional[float] = None
+    historical_revenue_cagr: Optional[float] = None
+    projected_revenue_cagr: Optional[float] = None
+    historical_fcf_cagr: Optional[float] = None
+    projected_fcf_cagr: Optional[float] = None
+    class Config:
+        from_attributes = True
+
+class DealScreenResult(DealSummary):
+    metrics: DealMetrics
+
+class DealScreenPage(BaseModel):
+    items: List[DealScreenResult]
+    # Pass as offset to fetch the next page; null on the last page.
+    next_offset: Optional[int] = None
+
+# min_<metric> / max_<metric> query filters for every DealMetrics field (inclusive bounds).
+SCREEN_FIELDS = list(DealMetrics.model_fields)
+ScreenCriteria = create_model(
+    "ScreenCriteria",
+    **{f"{bound}_{field}": (Optional[float], None) for field in SCREEN_FIELDS for bound in ("min", "max")},
+)
+
+# --- Batch (data room) uploads ---
+class BatchSkippedFile(BaseModel):
+    file_name: str
+    reason: str # "not a PDF", "too large", "unreadable", "unreadable archive" or "batch limit"
+
+class BatchProgress(BaseModel):
+    batch_id: str
+    status: str # "processing" until every deal is Complete, Failed or removed, then "done"
+    total: int
+    analyzing: int
+    complete: int
+    failed: int
+    # Screened out as not a CIM (the deal is deleted).
+    removed: int
+    deal_ids: List[int]
+    skipped: List[BatchSkippedFile] = []
+    created_at: Optional[datetime] = None
+
+class PipelineRun(BaseModel):
+    """Where one processing attempt for a deal spent its time, tokens and money."""
+    id: int
+    deal_id: Optional[int] = None
+    job_id: Optional[int] = None
+    kind: str
+    attempt: int
+    worker: Optional[str] = None
+    outcome: str # "done", "retry" or "failed"
+    error: Optional[str] = None
+    started_at: datetime
+    queue_wait_seconds: Optional[float] = None
+    total_seconds: float
+    stages: Optional[Dict[str, float]] = None
+    llm: Optional[Dict[str, Dict[str, Any]]] = None
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+    file_bytes: Optional[int] = None
+    pages_total: Optional[int] = None
+    pages_extracted: Optional[int] = None
+    extracted_chars: Optional[int] = None
+    text_tokens_raw: Optional[int] = None
+    text_tokens_clean: Optional[int] = None
+    first_content_seconds: Optional[float] = None
+
+    class Config:
+        from_attributes = True
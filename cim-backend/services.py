@@ -3,27 +3,77 @@
 import os
 import json
 import fitz # PyMuPDF
-from openai import OpenAI
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-import io
+import uuid
+import tempfile
+from contextlib import contextmanager
+import asyncio
+import threading
+import concurrent.futures
+from sqlalchemy.orm.attributes import flag_modified
 
 # Import database components for background tasks
 from database import SessionLocal
 import models
 
 # --- NEW: Import the industry list from its own file ---
-from industry_list import IBIS_INDUSTRIES
+import industry_index
+import analysis_cache
+from analysis_cache import CacheEntry
+import pdf_extraction
+import cim_classifier
+import chunked_analysis
+import text_preprocessing
+import financial_tables
+import text_store
+import json_stream
+import financial_metrics
+import derived_financials
+import deal_events
+import instrumentation
+import llm_gateway
+import jobs
+from jobs import PermanentJobError
 
 # --- Setup for OpenAI and S3 ---
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=90.0)
+# All OpenAI traffic goes through the shared gateway (pooled connections, rate limits, retries).
+llm = llm_gateway.gateway
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
+# Uploads wait under this prefix until a worker decides whether to keep them.
+S3_STAGING_PREFIX = os.getenv("S3_STAGING_PREFIX", "incoming/")
 s3_client = boto3.client(
     's3',
     aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
     aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION')
+    region_name=os.getenv('AWS_REGION'),
+    # Unset for AWS; point at MinIO/LocalStack or the benchmark's S3 stand-in otherwise.
+    endpoint_url=os.getenv('S3_ENDPOINT_URL') or None
 )
+# Multipart transfers move files in fixed-size parts, so memory per upload/download
+# is bounded by chunk size x concurrency rather than by the size of the PDF.
+S3_MULTIPART_CHUNK_BYTES = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8")) * 1024 * 1024
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_CHUNK_BYTES,
+    multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+    max_concurrency=int(os.getenv("S3_MULTIPART_CONCURRENCY", "4")),
+)
+# How view-pdf delivers files: "proxy" streams through the API (with Range support),
+# "redirect" sends a 307 to a presigned S3 URL, "url" returns the presigned URL as JSON.
+PDF_DELIVERY_MODE = os.getenv("PDF_DELIVERY_MODE", "proxy")
+PDF_PRESIGNED_URL_TTL_SECONDS = int(os.getenv("PDF_PRESIGNED_URL_TTL_SECONDS", "300"))
+PDF_STREAM_CHUNK_BYTES = 64 * 1024
+
+# "auto" chunks only documents over ANALYSIS_CHAR_LIMIT; "chunked" always splits; "single" restores the hard cut-off.
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto")
+ANALYSIS_CHUNK_CONCURRENCY = int(os.getenv("ANALYSIS_CHUNK_CONCURRENCY", "4"))
+# "on" streams single-call analyses and stores each finished section on the deal as it arrives.
+ANALYSIS_STREAMING = os.getenv("ANALYSIS_STREAMING", "on")
+# Partial results are written to the deal at most this often (the first section right away).
+PARTIAL_ANALYSIS_FLUSH_SECONDS = float(os.getenv("PARTIAL_ANALYSIS_FLUSH_SECONDS", "1"))
+# Re-analysis jobs (reanalyze endpoint, reanalyze.py) the worker pool runs at the same time.
+REANALYSIS_CONCURRENCY = int(os.getenv("REANALYSIS_CONCURRENCY", "4"))
 
 # --- NEW: System prompt for the pre-analysis screening step ---
 PRE_ANALYSIS_PROMPT = """
@@ -46,8 +96,10 @@ Example for a random document:
 {"is_cim": false}
 """
 
-# --- Main analysis prompt (remains the same) ---
-SYSTEM_PROMPT = f"""
+# --- Main analysis prompt ---
+# Static for every document, so it forms a stable prefix that provider prompt caching
+# can reuse; the per-document part (industry shortlist and text) is the user message.
+SYSTEM_PROMPT = """
 You are a top-tier private equity analyst. Your task is to analyze a Confidential Information Memorandum (CIM) or teaser text and return a structured, highly detailed JSON object for investment committee review.
 
 You must extract only **explicitly stated** information — do not guess, infer, or interpolate values. If something is not clearly present in the text, return "N/A".
@@ -65,36 +117,25 @@ This output will be read carefully by professional investors — your goal is to
 ---
 
 🏢 IBIS INDUSTRY SELECTION:
-- Based on the company's description, select one or more applicable industries from the provided list.
+- Based on the company's description, select one or more applicable industries from the candidate list in the user message.
 - The output for `ibis_industries` MUST be a JSON array of strings.
-- Only choose from this exact list: {json.dumps(IBIS_INDUSTRIES)}
+- Only choose names exactly as written in that candidate list.
 
 ---
 
-📊 FINANCIAL FORMATTING RULES:
-- Separate financials into `"actuals"` and `"estimates"`.
-- Do NOT overwrite actuals with projections — show both if present.
-- If both revenue and capex are available, compute `capex_pct_revenue`.
-- Include **free cash flow (FCF)** only if stated — do not compute from EBITDA.
-- Include both historical and projected **CAGR values** (if data allows).
-- If growth rates are stated or computable, include them in the `growth` section.
-- If valuation multiples (EBITDA, FCF, revenue) are provided, extract and flag them.
+📊 FINANCIAL FIGURES:
+- Report every fiscal year with stated figures in `financials.periods`, oldest first, one object per year.
+- Set `type` to "actual" for reported results and "estimate" for budgets, projections or forecasts. If a year appears as both, report both.
+- Copy only figures the document states: revenue, EBITDA (use Adjusted EBITDA if that is what is presented), gross profit, capex and free cash flow (FCF). Do not compute FCF from EBITDA.
+- If gross margin is only stated as a percentage, put it in `gross_margin`; otherwise leave it "N/A".
+- Do NOT calculate margins, ratios or growth rates. They are computed from your figures afterwards.
+- Financial tables detected in the document appear as `[Financial table, page N, units]` blocks with one line item per row and columns separated by " | ". Read figures from them in the stated units and convert to $M.
+- If valuation multiples (EBITDA, FCF, revenue) are provided, mention them in the summary.
 
 ---
 
-📈 GROWTH SECTION (UPDATED):
-
-If at least two years of revenue or FCF data are available in either historical or projected sections, you MUST compute the CAGR using the standard compound growth formula.
-
-Return a `growth` object with:
-
-- `"historical_revenue_cagr"`: Use the earliest and latest historical revenue years (e.g., 2021–2023). Format: "X% (start year – end year)"
-- `"projected_revenue_cagr"`: Use the earliest and latest projected years (e.g., 2024–2029). Same format.
-- `"historical_fcf_cagr"` and `"projected_fcf_cagr"`: Same rule, if FCF is provided.
-- `"growth_commentary"`: Write 1–3 sentences explaining growth patterns, inflection points, or revenue declines.
-
-Only return "N/A" if there are fewer than 2 usable years for a given metric.
-- If no historical or projected data is available, return "N/A" for both CAGRs.
+📈 GROWTH:
+- `growth.growth_commentary`: 1–3 bullet points on trends, declines, inflection points, or reasons for stagnation, based on the figures.
 
 ---
 
@@ -106,115 +147,108 @@ Only return "N/A" if there are fewer than 2 usable years for a given metric.
 
 ---
 
-You MUST compute and return a top-level `"growth"` field in the output.
-
-This field must include:
-- `"historical_revenue_cagr"`: Calculate CAGR between earliest and latest **actual** revenue years.
-- `"projected_revenue_cagr"`: Calculate CAGR between earliest and latest **estimate** revenue years.
-- `"historical_fcf_cagr"` and `"projected_fcf_cagr"` if FCF is available.
-- `"growth_commentary"`: Write 1–3 bullet points summarizing any trends, declines, inflection points, or reasons for stagnation.
-
-⚠️ If a CAGR is negative, still include it. Do not skip.
-⚠️ If only one data point exists, set the value to `"N/A"` but still include the field.
-
-The final JSON must include this section. Do not omit it under any condition.
-
-
 📝 STRUCTURED OUTPUT FORMAT:
 
 ```json
-{{
-  "company": {{
+{
+  "company": {
     "name": "[Company name]",
     "description": "[One-sentence description of what the company does]"
-  }},
+  },
   "industry": "[Primary industry and sub-industry]",
   "ibis_industries": ["[Industry from list]", "[Optional second industry]"],
-  "financials": {{
-    "actuals": {{
-      "revenue": "[e.g., '$39.9M']", 
-      "year": "[e.g., '2023']",
-      "ebitda": "[e.g., '$3.8M']",
-      "margin": "[e.g., '9.6%']",
-      "gross_margin": "[e.g., '23.6%']",
-      "capex": "[e.g., '$1.2M']",
-      "capex_pct_revenue": "[e.g., '3.1%']",
-      "fcf": "[e.g., '$2.5M']"
-    }},
-    "estimates": {{
-      "revenue": "[e.g., '$45.2M']",
-      "year": "[e.g., '2024']",
-      "ebitda": "[e.g., '$5.1M']",
-      "fcf": "[e.g., '$3.0M']",
-      "capex": "[e.g., '$1.5M']",
-      "capex_pct_revenue": "[e.g., '3.3%']"
-    }}
-  }},
-    "growth": {{
-      "historical_revenue_cagr": "1.2% (2021–2023)",
-      "projected_revenue_cagr": "-3.4% (2023–2024)",
-      "historical_fcf_cagr": "N/A",
-      "projected_fcf_cagr": "N/A",
-      "growth_commentary": "- Revenue declined in 2023 and is projected to fall further in 2024.\\n- Projected CAGR is negative, indicating a period of potential contraction.\\n- Strong backlog may provide recovery buffer in out years."
-}}
-
+  "financials": {
+    "periods": [
+      {
+        "year": "[e.g., '2023']",
+        "type": "[actual or estimate]",
+        "revenue": "[e.g., '$39.9M']",
+        "ebitda": "[e.g., '$3.8M']",
+        "gross_profit": "[e.g., '$9.4M']",
+        "gross_margin": "[e.g., '23.6%', only when stated as a percentage]",
+        "capex": "[e.g., '$1.2M']",
+        "fcf": "[e.g., '$2.5M']"
+      }
+    ]
+  },
+  "growth": {
+    "growth_commentary": "- [Bullet point 1]\\n- [Bullet point 2]"
+  },
   "thesis": "- [Bullet point 1]\\n- [Bullet point 2]\\n- [Bullet point 3]",
   "red_flags": "- [Bullet point 1]\\n- [Bullet point 2]\\n- [Bullet point 3]",
   "summary": "[Detailed summary (300–450 words), clear, data-rich, and free of fluff. Summarize financial performance, product model, customers, headwinds, and competitive position.]",
   "confidence_score": [0–100],
   "flagged_fields": ["List all vague, projected, or estimated fields"],
-  "confidence_breakdown": {{
+  "confidence_breakdown": {
     "company": 0,
     "industry": 0,
-    "financials": {{
-      "actuals": {{
-        "revenue": 0,
-        "ebitda": 0,
-        "margin": 0,
-        "gross_margin": 0,
-        "capex": 0,
-        "capex_pct_revenue": 0,
-        "fcf": 0
-      }},
-      "estimates": {{
-        "revenue": 0,
-        "ebitda": 0,
-        "capex": 0,
-        "capex_pct_revenue": 0,
-        "fcf": 0
-      }}
-    }},
+    "financials": {
+      "revenue": 0,
+      "ebitda": 0,
+      "gross_profit": 0,
+      "capex": 0,
+      "fcf": 0
+    },
     "growth": 0,
     "thesis": 0,
     "red_flags": 0,
     "summary": 0
-  }},
+  },
   "low_confidence_flags": [
     "revenue: 2024 figure is projected based on management estimates",
-    "capex: future year value provided with no historical baseline"
+    "capex: 2024 value provided with no historical baseline"
   ]
-}}
+}
 ```
 """
 
 # --- S3 Helper Functions ---
 
-def get_s3_object_stream(file_name: str):
-    # (Implementation is unchanged)
+def get_s3_object_stream(file_name: str, byte_range: str = None):
+    """Body stream for the object, or for one byte range of it (an HTTP Range value such as "bytes=0-1023")."""
     if not S3_BUCKET:
         raise ValueError("S3_BUCKET_NAME environment variable is not set.")
     try:
-        s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=file_name)
+        if byte_range:
+            s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=file_name, Range=byte_range)
+        else:
+            s3_object = s3_client.get_object(Bucket=S3_BUCKET, Key=file_name)
         return s3_object['Body']
     except ClientError as e:
         print(f"Error getting object from S3: {e}")
         return None
 
+def head_s3_object(file_name: str):
+    """Size, ETag and Last-Modified of an object without fetching it; None if it is missing."""
+    if not S3_BUCKET:
+        raise ValueError("S3_BUCKET_NAME environment variable is not set.")
+    try:
+        return s3_client.head_object(Bucket=S3_BUCKET, Key=file_name)
+    except ClientError as e:
+        print(f"Error reading object metadata from S3: {e}")
+        return None
+
+def presigned_pdf_url(file_name: str, expires_in: int = PDF_PRESIGNED_URL_TTL_SECONDS) -> str:
+    """Short-lived GET URL that serves the PDF inline straight from S3 (ranges and all)."""
+    if not S3_BUCKET:
+        raise ValueError("S3_BUCKET_NAME environment variable is not set.")
+    safe_name = file_name.replace('"', "")
+    return s3_client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": S3_BUCKET,
+            "Key": file_name,
+            "ResponseContentType": "application/pdf",
+            "ResponseContentDisposition": f'inline; filename="{safe_name}"',
+        },
+        ExpiresIn=expires_in,
+    )
+
 def upload_to_s3(file_stream, file_name: str) -> str:
     # (Implementation is unchanged)
     if not S3_BUCKET: raise ValueError("S3_BUCKET_NAME not set.")
     try:
-        s3_client.upload_fileobj(file_stream, S3_BUCKET, file_name)
+        s3_client.upload_fileobj(file_stream, S3_BUCKET, file_name, Config=S3_TRANSFER_CONFIG)
         return f"https://{S3_BUCKET}.s3.amazonaws.com/{file_name}"
     except Exception as e: raise e
 
@@ -225,43 +259,248 @@ def delete_from_s3(file_name: str):
         s3_client.delete_object(Bucket=S3_BUCKET, Key=file_name)
     except Exception as e: print(f"Error deleting {file_name} from S3: {e}")
 
+# --- Staging Helpers for Queued Uploads ---
+# The API stores each upload under a staging key so any worker can pick the job up,
+# even after an API restart. Workers promote CIMs to their final key and drop the rest.
+
+def stage_upload(file_stream, file_name: str) -> str:
+    """Streams a file object (e.g. an UploadFile's spooled temp file) to S3 in multipart chunks."""
+    staging_key = f"{S3_STAGING_PREFIX}{uuid.uuid4().hex}/{file_name}"
+    upload_to_s3(file_stream, staging_key)
+    return staging_key
+
+@contextmanager
+def download_staged_upload(staging_key: str):
+    """Streams a staged upload into a temp file and yields its path; the file is removed afterwards."""
+    if not S3_BUCKET: raise ValueError("S3_BUCKET_NAME not set.")
+    tmp = tempfile.NamedTemporaryFile(prefix="cim-", suffix=".pdf", delete=False)
+    try:
+        try:
+            with tmp, instrumentation.stage("s3_download"):
+                s3_client.download_fileobj(S3_BUCKET, staging_key, tmp, Config=S3_TRANSFER_CONFIG)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise PermanentJobError(f"Staged upload '{staging_key}' is missing from S3.")
+            raise
+        instrumentation.record_document(file_bytes=os.path.getsize(tmp.name))
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+def promote_staged_upload(staging_key: str, file_name: str) -> str:
+    """Server-side copy from the staging key to the deal's key; the bytes never pass through the worker."""
+    if not S3_BUCKET: raise ValueError("S3_BUCKET_NAME not set.")
+    with instrumentation.stage("s3_promote"):
+        s3_client.copy({"Bucket": S3_BUCKET, "Key": staging_key}, S3_BUCKET, file_name)
+    return f"https://{S3_BUCKET}.s3.amazonaws.com/{file_name}"
+
+def discard_staged_upload(staging_key):
+    if staging_key:
+        delete_from_s3(staging_key)
+
 # --- Document Processing and AI Analysis Functions ---
 
-def extract_text_from_pdf(file_stream) -> str:
-    # (Implementation is unchanged)
-    file_content = file_stream.read()
-    file_stream.seek(0)
+def extract_text_from_pdf(source) -> str:
+    """
+    Accepts a file path or a binary stream. Prefer paths: MuPDF then reads
+    pages from disk on demand, and large documents are split across the
+    extraction process pool.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        result = pdf_extraction.extract_pages(os.fspath(source))
+        print(f"Extracted {result.page_count} pages in {result.seconds:.2f}s using {result.workers} process(es).")
+        return result.text
+    file_content = source.read()
+    source.seek(0)
     doc = fitz.open(stream=file_content, filetype="pdf")
     text = "".join(page.get_text() for page in doc)
     doc.close()
     return text
 
-def analyze_document_text(text: str) -> dict:
-    """Performs the full, detailed analysis of the document text."""
+def analysis_user_message(content: str, industries) -> str:
+    """The per-document part of the analysis prompt: the IBIS candidate shortlist, then the text."""
+    return f"Candidate IBIS industries: {json.dumps(industries)}\n\nDocument text:\n{content}"
+
+async def request_analysis_async(content: str, industries=None, on_section=None) -> dict:
+    """
+    Runs SYSTEM_PROMPT over one piece of document text on the LLM gateway. With on_section,
+    the answer is streamed and on_section(key, value) is called for each top-level section
+    as soon as it is complete.
+    """
+    if industries is None:
+        industries = industry_index.shortlist_industries(content)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": analysis_user_message(content, industries)}
+    ]
     try:
-        truncated_text = text[:120000]
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": truncated_text}
-            ]
-        )
-        return json.loads(response.choices[0].message.content)
+        if on_section is None:
+            response = await llm.chat_completion(model="gpt-4o", response_format={"type": "json_object"},
+                                                 messages=messages)
+            return json.loads(response.choices[0].message.content)
+        stream = json_stream.ObjectStream()
+        def on_text(text):
+            for key, value in stream.feed(text):
+                on_section(key, value)
+        content = await llm.chat_completion_stream(model="gpt-4o", response_format={"type": "json_object"},
+                                                   messages=messages, on_text=on_text)
+        return json.loads(content)
     except Exception as e:
         print(f"Error calling OpenAI API for full analysis: {e}")
         return {"error": "Failed to analyze document."}
 
+async def analyze_sections_async(contents, industries=None) -> list:
+    """Analyzes sections concurrently, at most ANALYSIS_CHUNK_CONCURRENCY at a time for one document."""
+    limit = asyncio.Semaphore(ANALYSIS_CHUNK_CONCURRENCY)
+
+    async def analyze(content):
+        async with limit:
+            return await request_analysis_async(content, industries)
+
+    return await asyncio.gather(*(analyze(content) for content in contents))
+
+def prepare_analysis_text(pages) -> str:
+    """
+    Strips headers/footers, page numbers, contents pages and disclaimers from the
+    extracted pages (TEXT_PREPROCESSING=off skips this), logging the token savings.
+    """
+    if text_preprocessing.TEXT_PREPROCESSING == "off":
+        return "".join(pages)
+    result = text_preprocessing.preprocess_pages(pages)
+    print(f"Preprocessed text: ~{result.tokens_before} -> ~{result.tokens_after} tokens "
+          f"({result.reduction:.0%} removed; {result.removed}).")
+    instrumentation.record_preprocessing(result.tokens_before, result.tokens_after)
+    return result.text
+
+def find_financial_tables(pdf_path: str, pages):
+    """
+    Rewrites the financial tables of the extracted pages as compact rows (FINANCIAL_TABLES=off
+    skips this) and returns the rewritten pages with the figures the tables state unambiguously.
+    """
+    result = financial_tables.extract_financial_tables(pdf_path, pages)
+    if result.tables:
+        print(f"Found {len(result.tables)} financial table(s) on {result.pages_searched} candidate page(s); "
+              f"{len(result.figures)} figure(s) read directly.")
+    return result
+
+class PartialAnalysis:
+    """
+    Sections of a streaming analysis, collected on the gateway loop and written to the deal
+    from the worker thread (analysis_data plus analysis_sections), so the UI can show the
+    first sections long before the whole answer is in.
+    """
+    def __init__(self, deal_id: int, table_figures=None):
+        self.deal_id = deal_id
+        self.table_figures = table_figures or []
+        self.arrived = threading.Event()
+        self._sections = {}
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def add(self, key, value):
+        """Called on the gateway loop; must not block."""
+        with self._lock:
+            self._sections[key] = value
+        self.arrived.set()
+
+    def flush(self):
+        """Writes the sections received so far, if any are new. Best effort: errors are logged."""
+        with self._lock:
+            self.arrived.clear()
+            if len(self._sections) == self._written:
+                return
+            sections = dict(self._sections)
+        analysis = sections
+        if "financials" in sections:
+            # Table figures and derived values need the closed financials section, and land only
+            # in sections that have arrived (growth, confidence_breakdown may still be streaming).
+            processed = derived_financials.derive_financials(financial_tables.fill_periods(sections, self.table_figures))
+            analysis = {key: value for key, value in processed.items() if key in sections}
+        db = SessionLocal()
+        try:
+            deal = db.query(models.Deal).filter(models.Deal.id == self.deal_id).first()
+            if deal is None or deal.status != "Analyzing":
+                return
+            deal.analysis_data = analysis
+            deal.analysis_sections = list(sections)
+            company = sections.get("company") if isinstance(sections.get("company"), dict) else {}
+            deal.company_name = _summary_text(company.get("name"))
+            deal.industry = _summary_text(sections.get("industry"))
+            deal_events.record_deal(db, deal, sections=list(sections))
+            db.commit()
+            self._written = len(sections)
+            instrumentation.record_first_content()
+        except Exception as e:
+            db.rollback()
+            print(f"Could not store partial analysis for deal {self.deal_id}: {e}")
+        finally:
+            db.close()
+
+def run_streaming(coro, partial: PartialAnalysis):
+    """Runs coro on the gateway while this thread writes the sections it streams into partial."""
+    future = llm.submit(coro)
+    while not future.done():
+        # Wake up for the first section right away, then batch what arrives within the flush interval.
+        partial.arrived.wait(timeout=PARTIAL_ANALYSIS_FLUSH_SECONDS)
+        partial.flush()
+        concurrent.futures.wait([future], timeout=PARTIAL_ANALYSIS_FLUSH_SECONDS)
+    return future.result()
+
+def analyze_pages(pages, table_figures=None, stream_to_deal=None) -> dict:
+    """
+    Preprocesses and analyzes extracted page texts, streaming finished sections onto deal
+    stream_to_deal when given. Raises when the analysis failed, so the job retries.
+    """
+    with instrumentation.stage("preprocess"):
+        analysis_text = prepare_analysis_text(pages)
+    partial = PartialAnalysis(stream_to_deal, table_figures) if stream_to_deal is not None else None
+    with instrumentation.stage("analyze"):
+        analysis_data = analyze_document_text(analysis_text, table_figures, partial)
+    if "error" in analysis_data:
+        raise Exception(analysis_data["error"])
+    return analysis_data
+
+def analyze_document_text(text: str, table_figures=None, partial: PartialAnalysis = None) -> dict:
+    """
+    Performs the full, detailed analysis of the document text. Documents over
+    ANALYSIS_CHAR_LIMIT (or every document, with ANALYSIS_MODE=chunked) are split
+    into overlapping sections analyzed concurrently and merged, instead of being
+    cut off at the limit. Every section gets the industry shortlist of the whole document.
+    Figures read from the financial tables replace the model's, then ratios and CAGRs
+    are computed locally from the yearly figures. Single-call analyses stream their
+    sections into partial, when given; sections only exist after the merge otherwise.
+    """
+    industries = industry_index.shortlist_industries(text)
+    chunked = ANALYSIS_MODE == "chunked" or (ANALYSIS_MODE == "auto" and len(text) > chunked_analysis.ANALYSIS_CHAR_LIMIT)
+    chunks = chunked_analysis.split_text(text) if chunked else [text[:chunked_analysis.ANALYSIS_CHAR_LIMIT]]
+    if len(chunks) == 1 and partial is not None and ANALYSIS_STREAMING == "on":
+        analysis = run_streaming(request_analysis_async(chunks[0], industries, on_section=partial.add), partial)
+    elif len(chunks) == 1:
+        analysis = llm.run(request_analysis_async(chunks[0], industries))
+    else:
+        print(f"Analyzing {len(text)} characters as {len(chunks)} overlapping sections.")
+        contents = [chunked_analysis.chunk_preamble(i, len(chunks)) + chunk for i, chunk in enumerate(chunks)]
+        analysis = chunked_analysis.merge_analyses(llm.run(analyze_sections_async(contents, industries)))
+    analysis = financial_tables.fill_periods(analysis, table_figures or [])
+    return derived_financials.derive_financials(analysis)
+
 # --- NEW: Function for the screening step ---
+# The pre-screen only ever looks at this much leading text, so that is all we extract for it.
+CIM_SCREEN_CHARS = 2000
+
 def is_document_a_cim(text: str) -> dict:
     """
-    Uses a lightweight AI call to determine if the document is a CIM.
+    Determines if the document is a CIM. The local classifier settles clear
+    accepts and rejects; only ambiguous documents cost a lightweight AI call.
     """
+    local = cim_classifier.score_text(text[:CIM_SCREEN_CHARS])
+    if local.is_confident:
+        print(f"Local pre-screen decided '{local.decision}' (score {local.score}). Skipping LLM screening call.")
+        return {"is_cim": local.decision == "cim", "source": "local", "score": local.score}
     try:
         # Use only the first ~2000 characters for a quick and cheap check
-        truncated_text = text[:2000]
-        response = client.chat.completions.create(
+        truncated_text = text[:CIM_SCREEN_CHARS]
+        response = llm.complete(
             model="gpt-3.5-turbo", # Use a cheaper, faster model for classification
             response_format={"type": "json_object"},
             messages=[
@@ -269,63 +508,284 @@ def is_document_a_cim(text: str) -> dict:
                 {"role": "user", "content": truncated_text}
             ]
         )
-        return json.loads(response.choices[0].message.content)
+        result = json.loads(response.choices[0].message.content)
+        result["source"] = "llm"
+        return result
     except Exception as e:
         print(f"Error during CIM pre-analysis: {e}")
-        # Default to not a CIM to be safe and avoid costs
-        return {"is_cim": False}
+        # Default to not a CIM to be safe and avoid costs. The error key keeps
+        # this fallback out of the analysis cache.
+        return {"is_cim": False, "error": "Failed to screen document."}
+
+# --- Content-hash cache helpers ---
+# Cached verdicts and analyses are only reused under the prompts that produced them.
+analysis_cache.cache.version = analysis_cache.hash_bytes((PRE_ANALYSIS_PROMPT + SYSTEM_PROMPT).encode("utf-8"))[:16]
+
+def remember_result(cached, file_hash: str, text_hash, text, is_cim: bool, analysis_data=None):
+    """Stores a final result in the analysis cache under this upload's file hash."""
+    entry = CacheEntry(
+        file_hash=cached.file_hash if cached else file_hash,
+        text_hash=text_hash,
+        is_cim=is_cim,
+        text=text,
+        analysis_data=analysis_data,
+    )
+    analysis_cache.cache.put(entry, alias_file_hash=file_hash)
+
+def mark_deal_failed(deal_id: int):
+    db = SessionLocal()
+    try:
+        deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
+        if deal:
+            deal.status = "Failed"
+            deal_events.record_deal(db, deal)
+            db.commit()
+    finally:
+        db.close()
+
+# --- Deal Updates ---
+
+def _summary_text(value):
+    if not isinstance(value, str) or value.strip() in ("", "N/A"):
+        return None
+    return value.strip()
+
+def _summary_score(value):
+    try:
+        return int(round(float(str(value).strip().rstrip("%"))))
+    except (TypeError, ValueError):
+        return None
+
+def set_deal_analysis(deal, analysis_data: dict):
+    """
+    Stores the complete analysis, copies its list-view fields onto the summary columns and
+    refreshes deal_metrics. Clears analysis_sections, which PartialAnalysis may have set from
+    another session.
+    """
+    deal.analysis_data = analysis_data
+    deal.analysis_sections = None
+    flag_modified(deal, "analysis_sections")
+    company = analysis_data.get("company") if isinstance(analysis_data.get("company"), dict) else {}
+    deal.company_name = _summary_text(company.get("name"))
+    deal.industry = _summary_text(analysis_data.get("industry"))
+    deal.confidence_score = _summary_score(analysis_data.get("confidence_score"))
+    values = financial_metrics.metrics_from_analysis(analysis_data)
+    if deal.metrics is None:
+        deal.metrics = models.DealMetrics(**values)
+    else:
+        for name, value in values.items():
+            setattr(deal.metrics, name, value)
+    deal.metrics.industry = deal.industry
 
 # --- NEW: Centralized background task for processing all PDFs ---
-def process_uploaded_pdf(deal_id: int, file_contents: bytes, file_name: str):
+def process_uploaded_pdf(deal_id: int, staging_key: str, file_name: str, screen: bool = True):
     """
-    Consolidated background task for processing all uploaded PDFs.
-    Includes a pre-analysis step to check if the document is a CIM before proceeding.
+    Consolidated job for processing all uploaded PDFs, run by worker.py.
+    Includes a pre-analysis step to check if the document is a CIM before proceeding;
+    manual uploads pass screen=False to skip it. Errors propagate so the queue can retry.
     """
     db = SessionLocal()
     deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
     if not deal:
-        print(f"Background task failed: Deal with ID {deal_id} not found.")
+        print(f"Background task skipped: Deal with ID {deal_id} not found.")
         db.close()
+        discard_staged_upload(staging_key)
         return
 
+    tables, table_figures = None, []
     try:
-        # 1. Extract text first for pre-analysis
-        pdf_stream = io.BytesIO(file_contents)
-        text = extract_text_from_pdf(pdf_stream)
-        if not text:
-            raise Exception("Failed to extract text from PDF for pre-analysis.")
-
-        # 2. Perform pre-analysis to check if it's a CIM
-        pre_analysis_result = is_document_a_cim(text)
-        if not pre_analysis_result.get("is_cim"):
+        with download_staged_upload(staging_key) as pdf_path, pdf_extraction.LazyPdfText(pdf_path) as document:
+            # 1. Reuse a cached result for identical content
+            with instrumentation.stage("hash"):
+                file_hash = analysis_cache.hash_file(pdf_path)
+            cached = analysis_cache.cache.get(file_hash=file_hash)
+
+            # 2. Perform pre-analysis on just the leading pages to check if it's a CIM
+            if not screen:
+                is_cim = True
+            elif cached is not None:
+                print(f"Cache hit for '{file_name}' (deal {deal_id}). Skipping screening call.")
+                is_cim = cached.is_cim
+            else:
+                with instrumentation.stage("screen_extract"):
+                    leading_text = document.prefix(CIM_SCREEN_CHARS)
+                if not leading_text.strip():
+                    raise PermanentJobError("Failed to extract text from PDF for pre-analysis.")
+                with instrumentation.stage("screen"):
+                    pre_analysis_result = is_document_a_cim(leading_text)
+                is_cim = bool(pre_analysis_result.get("is_cim"))
+                if "error" not in pre_analysis_result and not is_cim:
+                    # Only the leading pages were read; the entry carries no text.
+                    remember_result(None, file_hash, None, None, is_cim=False)
+                print(f"Screened '{file_name}' using {len(document.pages)} of {document.page_count} pages.")
+
+            # 3. Extract the full text only for CIMs, reusing the pages already read
+            if is_cim:
+                with instrumentation.stage("extract"):
+                    if cached is not None and cached.text:
+                        text, pages = cached.text, [cached.text]
+                    else:
+                        text = document.full_text()
+                        pages = [page.text for page in document.pages]
+                if not text:
+                    raise PermanentJobError("Failed to extract text from PDF.")
+                raw_pages = pages
+                text_hash = analysis_cache.hash_text(text)
+                if cached is None:
+                    # Fallback: same document content behind different bytes (re-saved or re-sent PDF).
+                    cached = analysis_cache.cache.get(text_hash=text_hash)
+                if (cached is None or cached.analysis_data is None) and len(pages) == document.page_count:
+                    # Tables need the PDF itself, so they are read while it is still on disk.
+                    with instrumentation.stage("tables"):
+                        tables = find_financial_tables(pdf_path, pages)
+                    pages = tables.pages
+                    table_figures = tables.figures
+
+            if document.pages:
+                instrumentation.record_document(pages_total=document.page_count, pages_extracted=len(document.pages),
+                                                chars=len(text) if is_cim else 0)
+
+        if not is_cim:
             print(f"Document '{file_name}' for deal {deal_id} is not a CIM. Deleting deal record.")
+            deal_events.record_deal(db, deal, "Removed")
             db.delete(deal)
             db.commit()
-            db.close()
+            discard_staged_upload(staging_key)
             return
 
-        # 3. If it is a CIM, proceed with the full process
+        # 4. If it is a CIM, proceed with the full process
         print(f"Document '{file_name}' is a CIM. Proceeding with full analysis.")
-        
-        s3_stream = io.BytesIO(file_contents)
-        s3_url = upload_to_s3(s3_stream, file_name)
-        
-        analysis_data = analyze_document_text(text)
-        if "error" in analysis_data:
-            raise Exception(analysis_data["error"])
-
-        deal.s3_url = s3_url
-        deal.analysis_data = analysis_data
-        deal.status = "Complete"
-        db.commit()
+
+        # Keep the text first, so a deal whose analysis fails can be re-analyzed without its PDF.
+        with instrumentation.stage("store_text"):
+            text_store.save_text(db, deal.id, file_hash, text_hash, raw_pages, tables)
+            db.commit()
+
+        # Manual uploads skip the screen, so a cached non-CIM entry may still lack an analysis.
+        analysis_data = cached.analysis_data if cached is not None else None
+        if analysis_data is None:
+            analysis_data = analyze_pages(pages, table_figures, stream_to_deal=deal.id)
+
+        # Always this upload's own copy: a cached deal's object may have been deleted with its deal.
+        s3_url = promote_staged_upload(staging_key, file_name)
+        discard_staged_upload(staging_key)
+        if cached is None or cached.analysis_data is None:
+            remember_result(cached, file_hash, text_hash, text, is_cim=True, analysis_data=analysis_data)
+
+        with instrumentation.stage("db_write"):
+            deal.s3_url = s3_url
+            set_deal_analysis(deal, analysis_data)
+            deal.status = "Complete"
+            deal_events.record_deal(db, deal)
+            db.commit()
         print(f"Successfully processed and analyzed deal {deal_id}.")
 
     except Exception as e:
         print(f"Error in background task for deal {deal_id}: {e}")
-        # Check if deal still exists before trying to update it
-        deal_to_update = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
-        if deal_to_update:
-            deal_to_update.status = "Failed"
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _give_up_on_deal(job, error: str):
+    mark_deal_failed(job.deal_id)
+    discard_staged_upload(job.payload.get("staging_key"))
+
+@jobs.job_handler("process_pdf", on_give_up=_give_up_on_deal)
+def _run_process_pdf_job(job):
+    process_uploaded_pdf(job.deal_id, job.payload["staging_key"], job.payload["file_name"],
+                         screen=job.payload.get("screen", True))
+
+def enqueue_pdf_processing(db, deal_id: int, staging_key: str, file_name: str, screen: bool = True,
+                           concurrency_key: str = None, concurrency_limit: int = None):
+    """Queues a staged upload for the worker pool. The caller commits."""
+    return jobs.enqueue_job(db, "process_pdf", deal_id=deal_id,
+                            payload={"staging_key": staging_key, "file_name": file_name, "screen": screen},
+                            concurrency_key=concurrency_key, concurrency_limit=concurrency_limit)
+
+# --- Re-analysis ---
+# Re-runs the analysis of an existing deal from its stored text, for prompt changes and for
+# deals that failed on OpenAI errors. The analysis cache is bypassed, since it would hand
+# back the very result being replaced.
+
+def _extract_deal_text(db, deal) -> text_store.StoredText:
+    """Deals processed before texts were stored: extract their PDF from S3 once and store the text."""
+    if not deal.s3_url or not deal.file_name:
+        raise PermanentJobError(f"Deal {deal.id} has no stored text and no PDF in S3. Re-upload it.")
+    print(f"No stored text for deal {deal.id}. Extracting '{deal.file_name}' from S3 once.")
+    with download_staged_upload(deal.file_name) as pdf_path:
+        with instrumentation.stage("hash"):
+            file_hash = analysis_cache.hash_file(pdf_path)
+        with instrumentation.stage("extract"):
+            result = pdf_extraction.extract_pages(pdf_path)
+        pages = [page.text for page in result.pages]
+        if not "".join(pages):
+            raise PermanentJobError("Failed to extract text from PDF.")
+        with instrumentation.stage("tables"):
+            tables = find_financial_tables(pdf_path, pages)
+    instrumentation.record_document(pages_total=len(pages), pages_extracted=len(pages), chars=sum(map(len, pages)))
+    with instrumentation.stage("store_text"):
+        text_store.save_text(db, deal.id, file_hash, analysis_cache.hash_text("".join(pages)), pages, tables)
+        db.commit()
+    return text_store.load_text(db, deal.id)
+
+def reanalyze_deal(deal_id: int):
+    """Job body for "reanalyze": no S3 traffic and no PDF extraction when the deal's text is stored."""
+    db = SessionLocal()
+    try:
+        deal = db.query(models.Deal).filter(models.Deal.id == deal_id).first()
+        if not deal:
+            print(f"Re-analysis skipped: Deal with ID {deal_id} not found.")
+            return
+        with instrumentation.stage("load_text"):
+            stored = text_store.load_text(db, deal_id)
+        if stored is None:
+            stored = _extract_deal_text(db, deal)
+
+        # A complete earlier analysis stays on show until the new one is done; otherwise stream it in.
+        partial_ok = deal.analysis_data is None or deal.analysis_sections is not None
+        analysis_data = analyze_pages(stored.analysis_pages(), stored.figures,
+                                      stream_to_deal=deal.id if partial_ok else None)
+        # The cached analysis predates this one; drop it, and copies of the same text, so a
+        # re-upload does not bring it back.
+        analysis_cache.cache.invalidate(stored.file_hash, stored.text_hash)
+
+        with instrumentation.stage("db_write"):
+            set_deal_analysis(deal, analysis_data)
+            deal.status = "Complete"
+            deal_events.record_deal(db, deal)
+            db.commit()
+        print(f"Successfully re-analyzed deal {deal_id}.")
+    except Exception as e:
+        print(f"Error re-analyzing deal {deal_id}: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _give_up_on_reanalysis(job, error: str):
+    """A deal with a complete earlier analysis keeps it (and its Complete status); others are marked failed."""
+    db = SessionLocal()
+    try:
+        deal = db.query(models.Deal).filter(models.Deal.id == job.deal_id).first()
+        if deal:
+            deal.status = "Complete" if deal.analysis_data and deal.analysis_sections is None else "Failed"
+            deal_events.record_deal(db, deal)
             db.commit()
     finally:
         db.close()
+
+@jobs.job_handler("reanalyze", on_give_up=_give_up_on_reanalysis)
+def _run_reanalyze_job(job):
+    reanalyze_deal(job.deal_id)
+
+def enqueue_reanalysis(db, deal):
+    """
+    Marks the deal Analyzing and queues its re-analysis. Every re-analysis shares one
+    concurrency group, so a bulk run never has more than REANALYSIS_CONCURRENCY in flight
+    and leaves the rest of the worker pool to new uploads. The caller commits.
+    """
+    deal.status = "Analyzing"
+    deal_events.record_deal(db, deal)
+    return jobs.enqueue_job(db, "reanalyze", deal_id=deal.id,
+                            concurrency_key="reanalyze", concurrency_limit=REANALYSIS_CONCURRENCY)
@@ -0,0 +1,183 @@
+# cim-backend/text_preprocessing.py
+#
+# Token-reducing cleanup of extracted CIM text before it is sent to gpt-4o.
+# Works page by page: strips running headers/footers and confidentiality banners
+# (lines repeated at the top or bottom of many pages), page numbers at the edges
+# of pages that number them,
+# table-of-contents entries and legal disclaimer paragraphs, and collapses
+# whitespace and blank lines. Paragraphs with figures ($, %, multiples) are never dropped as
+# boilerplate, so financial content survives.
+
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+# --- Preprocessing Configuration ---
+# "on" cleans text before analysis, "off" sends the extracted text as is.
+TEXT_PREPROCESSING = os.getenv("TEXT_PREPROCESSING", "on")
+# A line at a page edge is a header/footer when it shows up on at least this share of pages...
+PREPROCESS_REPEAT_SHARE = float(os.getenv("PREPROCESS_REPEAT_SHARE", "0.5"))
+# ...and on at least this many pages.
+PREPROCESS_REPEAT_MIN_PAGES = 3
+# Lines counted as the top/bottom edge of a page.
+PREPROCESS_EDGE_LINES = 2
+# Longer lines are body text, never headers or footers.
+PREPROCESS_MAX_EDGE_LINE_CHARS = 160
+
+# --- Patterns ---
+_WHITESPACE = re.compile(r"[ \t\u00a0\u2000-\u200b\u3000]+")
+_DIGITS = re.compile(r"\d+")
+_PAGE_NUMBER = re.compile(
+    r"^(?:[-–—]\s*)?(?:page\s*)?(?:\d{1,4}|[ivxlc]{1,6})(?:\s*(?:of|/)\s*\d{1,4})?(?:\s*[-–—])?$", re.IGNORECASE
+)
+# "Company Overview ........ 12", "Financial Summary … 4"
+_TOC_LEADER = re.compile(r"^\S.{1,120}?(?:\s*\.{3,}|\s*…+|\s*(?:\. ){3,})\s*\d{1,4}$")
+# "3 Company Overview 12" or "Company Overview 12", only trusted on a contents page.
+_TOC_ENTRY = re.compile(r"^(?:\d{1,2}(?:\.\d{1,2})*\.?\s+)?[A-Za-z][^$%]{1,100}?\s+\d{1,4}$")
+_TOC_HEADING = re.compile(r"^(?:table of contents|contents|index)$", re.IGNORECASE)
+_LEGAL_PHRASES = re.compile(
+    r"representations? or warrant(?:y|ies)|does not purport|all[- ]inclusive|confidentiality agreement"
+    r"|forward[- ]looking statements?|no obligation to (?:update|revise)|not (?:be )?(?:reproduced|copied|distributed)"
+    r"|solely for (?:the )?(?:use|information|purpose)|not an offer|offer to (?:sell|buy)|securities act"
+    r"|independent (?:investigation|evaluation)|without (?:the )?(?:prior )?written consent|liability"
+    r"|express(?:ed)? or implied|prospective (?:buyers?|purchasers?|investors?)|the recipient",
+    re.IGNORECASE,
+)
+# Figures that mark a paragraph as content even when it sounds legal.
+_FIGURES = re.compile(r"\$\s?\d|\d(?:\.\d+)?\s?%|\d(?:\.\d+)?x\b|\b(?:fy|cy)\s?\d{2,4}\b", re.IGNORECASE)
+# A paragraph is boilerplate with this many distinct legal phrases, at this many matches per 100 words.
+_LEGAL_MIN_PHRASES = 2
+_LEGAL_MIN_DENSITY = 1.0
+_SENTENCE_END = re.compile(r"[.:;!?)\]][\"'”’]?$")
+_BULLET = re.compile(r"^(?:[-–•·▪*●◦]|\(?\d{1,2}[.)]|[a-z][.)])\s")
+# Lines up to this long without closing punctuation are headings or table rows, not prose.
+_SHORT_LINE_CHARS = 60
+
+def estimate_tokens(text: str) -> int:
+    """Same ~4 characters per token heuristic as llm_gateway.estimate_tokens."""
+    return len(text) // 4
+
+@dataclass
+class PreprocessedText:
+    text: str
+    chars_before: int
+    chars_after: int
+    tokens_before: int
+    tokens_after: int
+    # Lines or paragraphs dropped per rule: repeated_lines, page_numbers, toc_lines, boilerplate.
+    removed: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def reduction(self) -> float:
+        return 1 - self.chars_after / self.chars_before if self.chars_before else 0.0
+
+# Shared edge key of page-number lines, which differ on every page.
+_PAGE_NUMBER_KEY = "<page number>"
+
+# --- Steps ---
+
+def _normalize_line(line: str) -> str:
+    return _WHITESPACE.sub(" ", line).strip()
+
+def _edge_key(line: str) -> str:
+    """Page numbers and dates vary from page to page; mask digits so the banner still matches."""
+    if _PAGE_NUMBER.match(line):
+        return _PAGE_NUMBER_KEY
+    return _DIGITS.sub("#", line.lower())
+
+def _edges(lines: List[str]) -> List[int]:
+    """Indexes of the first and last PREPROCESS_EDGE_LINES non-empty lines."""
+    filled = [i for i, line in enumerate(lines) if line]
+    return sorted(set(filled[:PREPROCESS_EDGE_LINES] + filled[-PREPROCESS_EDGE_LINES:]))
+
+def _repeated_edge_keys(pages: List[List[str]]) -> set:
+    if len(pages) < PREPROCESS_REPEAT_MIN_PAGES:
+        return set()
+    seen = Counter()
+    for lines in pages:
+        seen.update({_edge_key(lines[i]) for i in _edges(lines) if len(lines[i]) <= PREPROCESS_MAX_EDGE_LINE_CHARS})
+    needed = max(PREPROCESS_REPEAT_MIN_PAGES, PREPROCESS_REPEAT_SHARE * len(pages))
+    return {key for key, count in seen.items() if count >= needed}
+
+def _is_contents_page(lines: List[str]) -> bool:
+    return any(_TOC_HEADING.match(line) for line in lines[:PREPROCESS_EDGE_LINES] if line)
+
+def _strip_lines(lines: List[str], repeated: set, removed: Counter) -> List[str]:
+    edges = set(_edges(lines))
+    contents_page = _is_contents_page(lines)
+    kept = []
+    for i, line in enumerate(lines):
+        if not line:
+            kept.append(line)
+        elif i in edges and _edge_key(line) in repeated:
+            # A bare number in the body is a table cell (a year, a figure), never a page number.
+            removed["page_numbers" if _edge_key(line) == _PAGE_NUMBER_KEY else "repeated_lines"] += 1
+        elif _TOC_LEADER.match(line) or (contents_page and (_TOC_ENTRY.match(line) or _TOC_HEADING.match(line))):
+            removed["toc_lines"] += 1
+        else:
+            kept.append(line)
+    return kept
+
+def _paragraphs(lines: List[str]) -> List[List[str]]:
+    """
+    Groups lines into paragraphs. MuPDF rarely emits blank lines between blocks, so a
+    paragraph also ends after closing punctuation, before a bullet, and around
+    short unpunctuated lines (headings, table rows).
+    """
+    paragraphs, current = [], []
+    for line in lines:
+        if not line or _BULLET.match(line):
+            if current:
+                paragraphs.append(current)
+            current = [line] if line else []
+            continue
+        if not current and len(line) <= _SHORT_LINE_CHARS and not _SENTENCE_END.search(line):
+            paragraphs.append([line])
+            continue
+        current.append(line)
+        if _SENTENCE_END.search(line):
+            paragraphs.append(current)
+            current = []
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+def _is_boilerplate(paragraph: List[str]) -> bool:
+    text = " ".join(paragraph)
+    if _FIGURES.search(text):
+        return False
+    matches = [match.lower() for match in _LEGAL_PHRASES.findall(text)]
+    words = max(len(text.split()), 1)
+    return len(set(matches)) >= _LEGAL_MIN_PHRASES and len(matches) * 100 / words >= _LEGAL_MIN_DENSITY
+
+# --- Entry Point ---
+
+def preprocess_pages(pages: Sequence[str]) -> PreprocessedText:
+    """Cleans a document given as one string per page (a single string works too, minus header detection)."""
+    raw = "".join(pages)
+    removed = Counter()
+    page_lines = [[_normalize_line(line) for line in page.splitlines()] for page in pages]
+    repeated = _repeated_edge_keys(page_lines)
+
+    cleaned_pages = []
+    for lines in page_lines:
+        kept = []
+        for paragraph in _paragraphs(_strip_lines(lines, repeated, removed)):
+            if _is_boilerplate(paragraph):
+                removed["boilerplate"] += 1
+            else:
+                kept.extend(paragraph)
+        if kept:
+            cleaned_pages.append("\n".join(kept))
+
+    text = "\n\n".join(cleaned_pages)
+    return PreprocessedText(
+        text=text,
+        chars_before=len(raw),
+        chars_after=len(text),
+        tokens_before=estimate_tokens(raw),
+        tokens_after=estimate_tokens(text),
+        removed=dict(removed),
+    )
@@ -0,0 +1,137 @@
+# upgrade_db.py
+#
+# Non-destructive counterpart to reset_db.py: creates any tables, columns and
+# indexes that the current models define but the database does not have yet,
+# then backfills derived data (summary columns, deal_metrics). Existing data is
+# kept. Safe to run repeatedly.
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    print("\nFATAL ERROR: DATABASE_URL environment variable is not set.")
+    exit()
+
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.schema import CreateColumn
+from database import engine, Base, SessionLocal
+import models  # noqa: F401 -- registers every table on Base.metadata
+
+BACKFILL_BATCH_SIZE = 500
+
+def convert_json_columns(connection):
+    """Upgrades json columns the models now declare as jsonb (needed by the GIN indexes)."""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            if isinstance(column.type, JSONB) and current is not None and not isinstance(current, JSONB):
+                print(f"Converting column {table.name}.{column.name} to jsonb")
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ALTER COLUMN "{column.name}" TYPE jsonb USING "{column.name}"::jsonb'
+                ))
+
+def add_missing_columns(connection):
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            # CreateColumn keeps generated-column and default clauses.
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            print(f"Adding column {table.name}.{column.name} ({definition})")
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+
+def add_missing_indexes(connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+def backfill_deal_summaries():
+    """Copies list-view fields out of analysis_data for deals analyzed before those columns existed."""
+    import services
+    db = SessionLocal()
+    try:
+        updated = 0
+        last_id = 0
+        while True:
+            deals = (
+                db.query(models.Deal)
+                .filter(models.Deal.id > last_id, models.Deal.analysis_data.isnot(None),
+                        models.Deal.company_name.is_(None), models.Deal.industry.is_(None),
+                        models.Deal.confidence_score.is_(None))
+                .order_by(models.Deal.id)
+                .limit(BACKFILL_BATCH_SIZE)
+                .all()
+            )
+            if not deals:
+                break
+            for deal in deals:
+                if isinstance(deal.analysis_data, dict):
+                    services.set_deal_analysis(deal, deal.analysis_data)
+                    updated += 1
+            last_id = deals[-1].id
+            db.commit()
+        print(f"Backfilled summary fields for {updated} deal(s).")
+    finally:
+        db.close()
+
+def backfill_deal_metrics(rebuild: bool = False):
+    """
+    Parses financials for analyzed deals that have no deal_metrics row yet (every analyzed
+    deal with rebuild=True, e.g. after parser changes), inserting one batch per statement.
+    """
+    import financial_metrics
+    from sqlalchemy.dialects.postgresql import insert
+    db = SessionLocal()
+    try:
+        written = 0
+        last_id = 0
+        while True:
+            query = (
+                db.query(models.Deal.id, models.Deal.industry, models.Deal.analysis_data)
+                .filter(models.Deal.id > last_id, models.Deal.analysis_data.isnot(None))
+            )
+            if not rebuild:
+                query = query.outerjoin(models.DealMetrics).filter(models.DealMetrics.deal_id.is_(None))
+            rows = query.order_by(models.Deal.id).limit(BACKFILL_BATCH_SIZE).all()
+            if not rows:
+                break
+            values = [
+                {"deal_id": deal_id, "industry": industry, **financial_metrics.metrics_from_analysis(analysis_data)}
+                for deal_id, industry, analysis_data in rows if isinstance(analysis_data, dict)
+            ]
+            if values:
+                statement = insert(models.DealMetrics).values(values)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[models.DealMetrics.deal_id],
+                    set_={name: statement.excluded[name] for name in values[0] if name != "deal_id"},
+                )
+                db.execute(statement)
+                written += len(values)
+            last_id = rows[-1].id
+            db.commit()
+        print(f"Wrote financial metrics for {written} deal(s).")
+    finally:
+        db.close()
+
+def upgrade_database(rebuild_metrics: bool = False):
+    print("\nCreating missing tables...")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        print("Adding missing columns and indexes...")
+        convert_json_columns(connection)
+        add_missing_columns(connection)
+        add_missing_indexes(connection)
+    backfill_deal_summaries()
+    backfill_deal_metrics(rebuild=rebuild_metrics)
+    print("\n✅ Database schema is up to date.")
+
+if __name__ == "__main__":
+    import sys
+    # --rebuild-metrics re-parses every deal's financials, e.g. after financial_metrics changes.
+    upgrade_database(rebuild_metrics="--rebuild-metrics" in sys.argv)
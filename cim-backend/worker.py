@@ -0,0 +1,83 @@
+# cim-backend/worker.py
+#
+# Standalone worker process that drains the analysis job queue.
+# Run it next to the API, e.g. `python worker.py`, and scale it independently.
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import signal
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jobs
+import instrumentation
+import services  # noqa: F401 -- registers the pipeline's job handlers
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+WORKER_POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL_SECONDS", "2"))
+# Port for Prometheus to scrape this process's /metrics; unset disables it.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = instrumentation.render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", instrumentation.PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving worker metrics on :{port}/metrics.")
+    return server
+
+def worker_loop(worker_id: str, stop_event: threading.Event):
+    """Runs jobs back to back, sleeping only when the queue is empty."""
+    while not stop_event.is_set():
+        try:
+            ran_job = jobs.run_next_job(worker_id)
+        except Exception as e:
+            # Typically a lost database connection; back off and try again.
+            print(f"[{worker_id}] Error while polling the job queue: {e}")
+            ran_job = False
+        if not ran_job:
+            stop_event.wait(WORKER_POLL_INTERVAL_SECONDS)
+
+def main():
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Shutdown requested. Finishing in-flight jobs...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    if WORKER_METRICS_PORT:
+        start_metrics_server(WORKER_METRICS_PORT)
+
+    host_id = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=worker_loop, args=(f"{host_id}/{i}", stop_event), name=f"worker-{i}")
+        for i in range(WORKER_CONCURRENCY)
+    ]
+    print(f"Starting {WORKER_CONCURRENCY} worker thread(s) on {host_id}.")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("Worker stopped.")
+
+if __name__ == "__main__":
+    main()